@@ -1,4 +1,4 @@
-import { useState } from 'react'
+import { useEffect, useState } from 'react'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Button } from '@/components/ui/button'
 import { Input } from '@/components/ui/input'
@@ -18,7 +18,6 @@ import {
   Wifi, // Added for connection status
   WifiOff // Added for connection status
 } from 'lucide-react'
-import { useQuery } from '@tanstack/react-query'; // Added for fetching real-time data
 import { Progress } from '@/components/ui/progress'; // Added for fill level progress bar
 
 // Updated BinData interface to match backend AdminBinData model
@@ -34,6 +33,10 @@ interface BinData {
   totalCollections: number
   connection_status: 'online' | 'offline'; // New: Connection status from backend
   last_seen_timestamp: number; // New: Unix timestamp from backend
+  offline_threshold_seconds: number;
+  fill_rate_per_hour: number | null;
+  time_to_full_seconds: number | null;
+  predicted_full_at: number | null;
 }
 
 const API_BASE_URL = 'http://localhost:8000'; // Define API base URL
@@ -85,12 +88,24 @@ const Admin = () => {
 
   const { toast } = useToast()
 
-  // --- NEW: Fetch real-time bin data from backend ---
-  const { data: fetchedBins, isLoading: isFetchingBins, error: fetchError } = useQuery<Record<string, BinData>>({
-    queryKey: ['adminRealtimeBins'],
-    queryFn: () => fetch(`${API_BASE_URL}/admin/bins-data`).then(res => res.json()),
-    refetchInterval: 5000, // Refetch every 5 seconds for real-time updates
-  });
+  // --- NEW: Real-time bin data pushed by the backend (snapshot first, then per-bin changes) ---
+  const [fetchedBins, setFetchedBins] = useState<Record<string, BinData> | null>(null);
+  const [fetchError, setFetchError] = useState<Error | null>(null);
+  useEffect(() => {
+    const source = new EventSource(`${API_BASE_URL}/admin/bins-events`);
+    source.addEventListener('snapshot', (event) => {
+      setFetchedBins(JSON.parse((event as MessageEvent).data));
+      setFetchError(null);
+    });
+    source.addEventListener('bin', (event) => {
+      const change: Partial<BinData> & { id: string } = JSON.parse((event as MessageEvent).data);
+      setFetchedBins(prev => ({ ...prev, [change.id]: { ...prev?.[change.id], ...change } as BinData }));
+    });
+    // EventSource reconnects on its own; the server sends a fresh snapshot when it does
+    source.onerror = () => setFetchError(new Error('Lost connection to the server. Reconnecting...'));
+    return () => source.close();
+  }, []);
+  const isFetchingBins = fetchedBins === null && !fetchError;
   const fetchedBinsArray = fetchedBins ? Object.values(fetchedBins) : [];
   // --- END NEW ---
 
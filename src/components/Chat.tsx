@@ -40,6 +40,7 @@ const Chat = () => {
   const [inputMessage, setInputMessage] = useState('')
   const [isTyping, setIsTyping] = useState(false)
   const [isApiConnected, setIsApiConnected] = useState<boolean | null>(null); // null for initial, true/false after attempt
+  const [userLocation, setUserLocation] = useState<{ lat: number; lng: number } | null>(null); // Lets the assistant name nearby bins
   const scrollAreaRef = useRef<HTMLDivElement>(null)
   const inputRef = useRef<HTMLInputElement>(null)
 
@@ -56,6 +57,16 @@ const Chat = () => {
     }
   }, [messages]);
 
+  // Ask for the user's location once; chat works the same without it
+  useEffect(() => {
+    if (!navigator.geolocation) return;
+    navigator.geolocation.getCurrentPosition(
+      (position) => setUserLocation({ lat: position.coords.latitude, lng: position.coords.longitude }),
+      () => setUserLocation(null),
+      { maximumAge: 5 * 60 * 1000 }
+    );
+  }, []);
+
   // Initial connection check to the API
   useEffect(() => {
     const checkConnection = async () => {
@@ -90,31 +101,52 @@ const Chat = () => {
     setIsTyping(true);
 
     try {
-      const response = await fetch(`${API_BASE_URL}/chat/gemini-query`, {
+      const response = await fetch(`${API_BASE_URL}/chat/gemini-query/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ user_id: userId, message: newUserMessage.content }),
+        body: JSON.stringify({ user_id: userId, message: newUserMessage.content, ...(userLocation ?? {}) }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const data = await response.json();
-      const assistantResponse: Message = {
-        id: String(messages.length + 2),
-        type: 'assistant',
-        content: data.response,
-        timestamp: new Date(),
-      };
-      setMessages((prevMessages) => [...prevMessages, assistantResponse]);
+      // Show the reply as it streams in: one assistant message, extended with every "chunk" event
+      const assistantId = String(messages.length + 2);
+      setMessages((prevMessages) => [...prevMessages, { id: assistantId, type: 'assistant', content: '', timestamp: new Date() }]);
+      setIsTyping(false);
+      const appendToAssistant = (text: string) =>
+        setMessages((prevMessages) => prevMessages.map((message) =>
+          message.id === assistantId ? { ...message, content: message.content + text } : message));
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const event = rawEvent.match(/^event: (.*)$/m)?.[1];
+          const data = rawEvent.match(/^data: (.*)$/m)?.[1];
+          if (!data) continue;
+          if (event === 'chunk') {
+            appendToAssistant(JSON.parse(data).text);
+          } else if (event === 'error') {
+            throw new Error(JSON.parse(data).detail);
+          }
+        }
+      }
       setIsApiConnected(true); // Confirm connection if successful
     } catch (error) {
       console.error('Error fetching from Gemini API:', error);
       const errorMessage: Message = {
-        id: String(messages.length + 2),
+        id: `${messages.length + 2}-error`,
         type: 'assistant',
         content: "I'm sorry, I couldn't connect to the AI assistant right now. Please try again later.",
         timestamp: new Date(),
@@ -21,6 +21,8 @@ import { Link } from 'react-router-dom';
 // Assuming your backend URL
 const API_BASE_URL = 'http://localhost:8000'; // Make sure this matches your FastAPI server
 
+const RECENT_ITEMS_LIMIT = 4;
+
 // Define the interface for the data received from the backend
 interface UserCreditsResponse {
   user_id: string;
@@ -32,11 +34,13 @@ interface UserCreditsResponse {
     bin_id: string;
     credits: number; // ADDED: Now includes the credits for this specific item
   }>;
+  total_items: number; // Lifetime count from the backend's running totals
 }
 
 // Function to fetch data from your FastAPI backend
 const fetchUserCredits = async (userId: string): Promise<UserCreditsResponse> => {
-  const response = await fetch(`${API_BASE_URL}/user-credits/${userId}`);
+  // Only the latest few items are shown, so don't pull the whole history on every poll
+  const response = await fetch(`${API_BASE_URL}/user-credits/${userId}?limit=${RECENT_ITEMS_LIMIT}`);
   if (!response.ok) {
     throw new Error('Failed to fetch user credits');
   }
@@ -73,7 +77,7 @@ const Dashboard = () => {
 
   // Calculate real-time stats based on fetched data
   const ecoCreditsBalance = data?.credits || 0;
-  const totalItemsRecycled = data?.recycled_items?.length || 0;
+  const totalItemsRecycled = data?.total_items || 0;
   // Example CO2 saved: 0.5 kg per item. Adjust as per your logic.
   const co2Saved = (totalItemsRecycled * 0.5).toFixed(2); 
 
@@ -116,7 +120,7 @@ const Dashboard = () => {
   // Use the actual recycled items from the backend for recent activities
   // Slice to show only the last 4 items (or whatever quantity fits your UI)
   const recentActivities = data?.recycled_items
-    ?.slice(-4) // Get last 4 items
+    ?.slice(-RECENT_ITEMS_LIMIT) // Get last 4 items
     .reverse() // Show most recent first
     .map(item => ({
       type: item.item_name || item.category, // Use specific item name, fallback to category
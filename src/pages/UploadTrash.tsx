@@ -57,11 +57,12 @@ const UploadTrash: React.FC = () => {
   const canvasRef = useRef<HTMLCanvasElement | null>(null);
   const streamRef = useRef<MediaStream | null>(null);
   const videoTimeoutRef = useRef<NodeJS.Timeout | null>(null);
+  const submissionKeyRef = useRef<string | null>(null); // One key per detected item, so a retried submit is not credited twice
 
   // Use react-query to fetch user credits for display
   const { data: userCreditsData, isLoading: loadingCredits, refetch: refetchCredits } = useQuery<UserCreditsResponse>({
     queryKey: ['userCredits', userId],
-    queryFn: () => fetch(`${API_URL}/user-credits/${userId}`).then(res => res.json()),
+    queryFn: () => fetch(`${API_URL}/user-credits/${userId}?limit=4`).then(res => res.json()), // Same page size as Dashboard, which shares this query key
     enabled: !!userId, // Only fetch if userId is available
     refetchInterval: 5000, // Keep credits updated
   });
@@ -170,6 +171,7 @@ const UploadTrash: React.FC = () => {
         setDetectedSpecificItem(data.specific_item);
         setAssignedCredits(data.credits_value);
         setResultReady(true);
+        submissionKeyRef.current = crypto.randomUUID();
         toast({ title: 'Detection Complete', description: `Detected: ${data.specific_item} (${data.category}), Credits: ${data.credits_value}` });
       } else {
         toast({ title: 'Error', description: 'Detection failed', variant: 'destructive' });
@@ -195,7 +197,8 @@ const UploadTrash: React.FC = () => {
         bin_id: binId, 
         category: detectedCategory, 
         specific_item: detectedSpecificItem,
-        credits_value: assignedCredits
+        credits_value: assignedCredits,
+        idempotency_key: submissionKeyRef.current
       }),
     });
 
@@ -217,6 +220,7 @@ const UploadTrash: React.FC = () => {
     setDetectedSpecificItem('');
     setAssignedCredits(0);
     setResultReady(false);
+    submissionKeyRef.current = null;
     // Webcam will auto-restart due to useEffect
   };
 
@@ -1,14 +1,16 @@
 import serial
 import time
-import requests
-import re
 import argparse # To handle command-line arguments for BIN_ID
+from telemetry import TelemetrySender, parse_arduino_line, compute_fill_percentage
 
 # --- CONFIGURATION ---
 PORT = 'COM4'        # Change if your Arduino is on a different port (e.g., '/dev/ttyUSB0' on Linux)
 BAUD_RATE = 9600     # Must match the baud rate in your Arduino code
 BIN_HEIGHT = 62      # in cm (your bin height, from sensor to bottom when empty)
 API_BASE_URL = 'http://localhost:8000' # Your FastAPI server URL
+BATCH_SIZE = 100     # Send as soon as this many readings are buffered...
+FLUSH_INTERVAL = 2   # ...or at least this often (seconds)
+SPOOL_PATH = 'telemetry_spool.ndjson' # Readings are kept here while the server is unreachable
 
 # --- Parse command-line arguments ---
 parser = argparse.ArgumentParser(description="Arduino Gateway for TrashNet Eco-Hub.")
@@ -32,43 +34,9 @@ def connect_to_arduino(port, baud_rate):
 
 arduino_connection = connect_to_arduino(PORT, BAUD_RATE)
 
-# --- HELPER FUNCTIONS ---
-def send_bin_status(bin_id, distance_cm, fill_percentage, status_text):
-    """Sends bin status update to FastAPI server."""
-    endpoint = f"{API_BASE_URL}/bin-status-update"
-    payload = {
-        "bin_id": bin_id,
-        "distance_cm": distance_cm,
-        "fill_percentage": fill_percentage,
-        "status_text": status_text,
-        "timestamp": int(time.time()) # Unix timestamp
-    }
-    try:
-        response = requests.post(endpoint, json=payload, timeout=5)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        # print(f"Sent status for {bin_id}: {status_text}, {fill_percentage}%")
-    except requests.exceptions.ConnectionError:
-        print(f"Warning: Could not connect to FastAPI server at {API_BASE_URL}. Is it running?")
-    except requests.exceptions.Timeout:
-        print(f"Warning: Request to FastAPI server timed out.")
-    except requests.exceptions.HTTPError as e:
-        print(f"Warning: HTTP error when sending status: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred while sending status: {e}")
-
-def send_heartbeat(bin_id):
-    """Sends a heartbeat to FastAPI server to indicate gateway is active."""
-    endpoint = f"{API_BASE_URL}/bin-heartbeat"
-    payload = {
-        "bin_id": bin_id,
-        "timestamp": int(time.time())
-    }
-    try:
-        requests.post(endpoint, json=payload, timeout=2)
-    except requests.exceptions.ConnectionError:
-        pass # Suppress connection errors for heartbeats, as they are frequent
-    except Exception as e:
-        print(f"An unexpected error occurred while sending heartbeat: {e}")
+# --- TELEMETRY SENDER ---
+# Buffers readings and posts them in batches over one pooled connection
+sender = TelemetrySender(API_BASE_URL, max_batch=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, spool_path=SPOOL_PATH)
 
 # --- MAIN LOOP ---
 last_heartbeat_time = 0
@@ -81,22 +49,11 @@ try:
                 line = arduino_connection.readline().decode().strip()
                 if line:
                     print(f"Arduino says: {line}")
-                    # Regex to extract Distance and Status
-                    match = re.search(r"Distance: (\d+) cm \| Status: (.+)", line)
-                    if match:
-                        distance_cm = int(match.group(1))
-                        status_text = match.group(2)
-
-                        # Calculate fill percentage (0% full when distance is BIN_HEIGHT, 100% full when distance is 0)
-                        # We reverse the distance as closer means fuller
-                        fill_level_distance = BIN_HEIGHT - distance_cm
-                        if fill_level_distance < 0: fill_level_distance = 0 # Cannot be less than 0
-                        
-                        fill_percentage = (fill_level_distance / BIN_HEIGHT) * 100
-                        if fill_percentage > 100: fill_percentage = 100 # Cannot be more than 100
-                        if fill_percentage < 0: fill_percentage = 0 # Ensure non-negative
-
-                        send_bin_status(BIN_ID, distance_cm, round(fill_percentage), status_text)
+                    parsed = parse_arduino_line(line)
+                    if parsed:
+                        distance_cm, status_text = parsed
+                        fill_percentage = compute_fill_percentage(distance_cm, BIN_HEIGHT)
+                        sender.add_status(BIN_ID, distance_cm, fill_percentage, status_text)
                     else:
                         print(f"Warning: Could not parse Arduino line: {line}")
         else:
@@ -108,7 +65,7 @@ try:
         # Send heartbeat periodically
         current_time = time.time()
         if current_time - last_heartbeat_time >= HEARTBEAT_INTERVAL:
-            send_heartbeat(BIN_ID)
+            sender.add_heartbeat(BIN_ID)
             last_heartbeat_time = current_time
 
         time.sleep(1) # Read from serial approximately once per second
@@ -120,4 +77,6 @@ except KeyboardInterrupt:
 except Exception as e:
     print(f"An unhandled error occurred: {e}")
     if arduino_connection:
-        arduino_connection.close()
\ No newline at end of file
+        arduino_connection.close()
+finally:
+    sender.close() # Send (or spool) whatever is still buffered
\ No newline at end of file
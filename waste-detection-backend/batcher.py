@@ -0,0 +1,96 @@
+# batcher.py
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional
+
+
+class MicroBatcher:
+    """Coalesces concurrent requests into batches.
+
+    Callers `await submit(item)`; items are collected until `max_batch_size`
+    are waiting or `max_wait_ms` has passed since the first one arrived, then
+    `process_batch(items)` runs once and each caller receives the result at its
+    own position (a processor may put an exception at a position to fail just
+    that caller). Batches are dispatched as separate tasks so a slow batch does
+    not hold up collection of the next one.
+    """
+
+    def __init__(self, process_batch: Callable[[list], Awaitable[list]], max_batch_size: int = 8, max_wait_ms: float = 10):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes: Counter = Counter()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._collect())
+
+    async def submit(self, item: Any) -> Any:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.create_task(self._run(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, batch: list) -> None:
+        # Callers that gave up (e.g. client disconnected) are dropped before spending work on them
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch processor returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight_batches": len(self._in_flight),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_size_counts": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
@@ -0,0 +1,92 @@
+# fake_gemini.py
+"""Local stand-in for google.generativeai.GenerativeModel, so benchmarks never call (or pay for) Gemini.
+
+install() swaps it in for genai.GenerativeModel. GeminiClient looks the class
+up when it first needs a model, so installing before the first request is
+enough. Every call waits `latency_ms` (plus up to `jitter_ms`) and answers in
+the shape the real model is prompted for: one JSON object per image, a JSON
+array for multi-image prompts, plain text for chat.
+"""
+import asyncio
+import json
+import random
+import time
+from typing import AsyncIterator
+
+import google.generativeai as genai
+
+ITEMS = [
+    ("plastic", "plastic bottle"),
+    ("metal", "aluminum can"),
+    ("glass", "glass jar"),
+    ("paper", "cardboard box"),
+    ("wood", "wooden stick"),
+]
+CHAT_ANSWER = "The nearest bin with space is Central Park Bin, about 0.4 km away. Rinse bottles before recycling them."
+STREAM_CHUNKS = 8
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    """What awaiting generate_content_async(..., stream=True) returns: an async iterable of chunks."""
+
+    def __init__(self, text: str, chunk_delay: float):
+        self._text = text
+        self._chunk_delay = chunk_delay
+
+    async def _chunks(self) -> AsyncIterator[FakeResponse]:
+        size = max(1, len(self._text) // STREAM_CHUNKS)
+        for start in range(0, len(self._text), size):
+            if start:
+                await asyncio.sleep(self._chunk_delay)
+            yield FakeResponse(self._text[start:start + size])
+
+    def __aiter__(self) -> AsyncIterator[FakeResponse]:
+        return self._chunks()
+
+
+class FakeGenerativeModel:
+    latency_ms = 300.0
+    jitter_ms = 100.0
+    calls = 0
+
+    def __init__(self, model_name: str = "gemini-2.0-flash", **kwargs):
+        self.model_name = model_name
+
+    @classmethod
+    def _delay(cls) -> float:
+        return (cls.latency_ms + random.uniform(0, cls.jitter_ms)) / 1000
+
+    @staticmethod
+    def _answer(contents) -> str:
+        if isinstance(contents, str):
+            return CHAT_ANSWER
+        images = sum(1 for part in contents if isinstance(part, dict))
+        if images > 1:
+            return json.dumps([{"category": category, "item_name": item} for category, item in random.choices(ITEMS, k=images)])
+        category, item = random.choice(ITEMS)
+        return json.dumps({"category": category, "item_name": item})
+
+    def generate_content(self, contents, **kwargs) -> FakeResponse:
+        FakeGenerativeModel.calls += 1
+        time.sleep(self._delay())
+        return FakeResponse(self._answer(contents))
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        FakeGenerativeModel.calls += 1
+        delay = self._delay()
+        await asyncio.sleep(delay)
+        if stream:
+            # Time to first chunk is the configured latency; the rest trickles in after it
+            return FakeStream(self._answer(contents), delay / STREAM_CHUNKS)
+        return FakeResponse(self._answer(contents))
+
+
+def install(latency_ms: float = 300.0, jitter_ms: float = 100.0) -> None:
+    FakeGenerativeModel.latency_ms = latency_ms
+    FakeGenerativeModel.jitter_ms = jitter_ms
+    genai.GenerativeModel = FakeGenerativeModel
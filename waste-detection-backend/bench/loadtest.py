@@ -0,0 +1,313 @@
+# loadtest.py
+"""Scripted load against the backend: p50/p99 latency, requests per second and server CPU for each endpoint.
+
+    python bench/loadtest.py                                   # starts bench/serve.py on a free port
+    python bench/loadtest.py --streams submit-waste admin-bins-data --concurrency 32 --duration 20
+    python bench/loadtest.py --output baseline.json
+    python bench/loadtest.py --compare baseline.json           # exits 1 if any stream regressed
+    python bench/loadtest.py --url http://kiosk-01:8000 --streams video-feed
+
+Streams run one after another, each with --concurrency clients for
+--duration seconds, so the server CPU used during a stream (read from
+process_cpu_seconds_total on /metrics) belongs to that stream alone. For
+video-feed every client is a viewer: latency is the time to the first frame
+and the rate is frames delivered per second across all viewers.
+
+The client shares the machine with the server when it starts it itself;
+compare runs made on the same hardware.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+import cv2
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STREAMS = ["detect-waste", "classify-image", "submit-waste", "bin-status-update", "admin-bins-data", "video-feed"]
+CATEGORIES = ["plastic", "metal", "glass", "paper", "wood"]
+BENCH_USERS = 100
+FRAME_BOUNDARY = b"--frame\r\n"
+
+
+@dataclass
+class StreamResult:
+    stream: str
+    requests: int = 0            # Frames, for video-feed
+    errors: int = 0
+    seconds: float = 0.0
+    rps: float = 0.0
+    p50_ms: Optional[float] = None
+    p99_ms: Optional[float] = None
+    cpu_percent: Optional[float] = None        # Server CPU during the stream, 100 = one core
+    cpu_ms_per_request: Optional[float] = None
+    latencies_ms: list[float] = field(default_factory=list, repr=False)
+
+    def finish(self, seconds: float, cpu_seconds: Optional[float]) -> None:
+        self.seconds = seconds
+        self.rps = self.requests / seconds if seconds else 0.0
+        if self.latencies_ms:
+            self.p50_ms, self.p99_ms = (float(value) for value in np.percentile(self.latencies_ms, [50, 99]))
+        if cpu_seconds is not None:
+            self.cpu_percent = 100 * cpu_seconds / seconds
+            self.cpu_ms_per_request = 1000 * cpu_seconds / self.requests if self.requests else None
+
+    def summary(self) -> dict:
+        result = asdict(self)
+        del result["latencies_ms"]
+        return result
+
+
+def upload_pool(count: int, seed: int = 0) -> list[bytes]:
+    """Distinct JPEGs (different perceptual hashes), so uploads are not all answered from the classification cache."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        image = cv2.resize(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8), (640, 480), interpolation=cv2.INTER_LINEAR)
+        images.append(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes())
+    return images
+
+
+class Load:
+    """Builds each stream's requests; seeded so runs are repeatable."""
+
+    def __init__(self, bin_ids: list[str], uploads: list[bytes], seed: int = 0):
+        self.bin_ids = bin_ids
+        self.uploads = uploads
+        self.random = random.Random(seed)
+        self.upload_index = 0
+
+    async def request(self, client: httpx.AsyncClient, stream: str) -> httpx.Response:
+        if stream == "detect-waste":
+            return await client.get("/detect-waste")
+        if stream == "classify-image":
+            self.upload_index = (self.upload_index + 1) % len(self.uploads)
+            return await client.post("/classify-image", files={"file": ("item.jpg", self.uploads[self.upload_index], "image/jpeg")})
+        if stream == "submit-waste":
+            category = self.random.choice(CATEGORIES)
+            return await client.post("/submit-waste", json={
+                "user_id": f"bench-user-{self.random.randrange(BENCH_USERS)}", "bin_id": self.random.choice(self.bin_ids),
+                "category": category, "specific_item": f"bench {category}", "credits_value": 10, "idempotency_key": uuid.uuid4().hex,
+            })
+        if stream == "bin-status-update":
+            fill = self.random.randrange(101)
+            return await client.post("/bin-status-update", json={
+                "bin_id": self.random.choice(self.bin_ids), "distance_cm": 62 - fill * 62 // 100, "fill_percentage": fill,
+                "status_text": "Full" if fill >= 90 else "Half" if fill > 40 else "Empty", "timestamp": int(time.time()),
+            })
+        if stream == "admin-bins-data":
+            return await client.get("/admin/bins-data")
+        raise ValueError(f"Unknown stream {stream}")
+
+
+async def server_cpu_seconds(client: httpx.AsyncClient) -> Optional[float]:
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    for line in response.text.splitlines():
+        if line.startswith("process_cpu_seconds_total "):
+            return float(line.split()[1])
+    return None
+
+
+async def run_requests(client: httpx.AsyncClient, load: Load, stream: str, concurrency: int, duration: float, result: StreamResult) -> None:
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await load.request(client, stream)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                result.requests += 1
+                result.latencies_ms.append((time.perf_counter() - start) * 1000)
+            else:
+                result.errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_viewers(client: httpx.AsyncClient, concurrency: int, duration: float, result: StreamResult) -> None:
+    async def viewer():
+        start = time.perf_counter()
+        first_frame = True
+        tail = b""
+        try:
+            async with client.stream("GET", "/video-feed", timeout=httpx.Timeout(10.0, read=10.0)) as response:
+                if response.status_code >= 400:
+                    result.errors += 1
+                    return
+                async for chunk in response.aiter_bytes():
+                    data = tail + chunk
+                    frames = data.count(FRAME_BOUNDARY)
+                    tail = data[-(len(FRAME_BOUNDARY) - 1):]
+                    if frames and first_frame:
+                        result.latencies_ms.append((time.perf_counter() - start) * 1000)
+                        first_frame = False
+                    result.requests += frames
+                    if time.perf_counter() - start >= duration:
+                        return
+        except httpx.HTTPError:
+            result.errors += 1
+
+    await asyncio.gather(*(viewer() for _ in range(concurrency)))
+
+
+async def run_stream(base_url: str, load: Load, stream: str, concurrency: int, duration: float) -> StreamResult:
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        result = StreamResult(stream)
+        cpu_before = await server_cpu_seconds(client)
+        start = time.perf_counter()
+        if stream == "video-feed":
+            await run_viewers(client, concurrency, duration, result)
+        else:
+            await run_requests(client, load, stream, concurrency, duration, result)
+        seconds = time.perf_counter() - start
+        cpu_after = await server_cpu_seconds(client)
+        result.finish(seconds, cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None)
+        return result
+
+
+async def seed_bins(base_url: str, count: int) -> list[str]:
+    """Registers count bins through the batch telemetry endpoint, so fleet-wide endpoints work on a realistic fleet."""
+    bin_ids = [f"BENCH{index:05d}" for index in range(count)]
+    now = int(time.time())
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+        for begin in range(0, count, 500):
+            updates = [{"bin_id": bin_id, "distance_cm": 31, "fill_percentage": 50, "status_text": "Half", "timestamp": now}
+                       for bin_id in bin_ids[begin:begin + 500]]
+            response = await client.post("/bin-telemetry/batch", json={"status_updates": updates})
+            response.raise_for_status()
+    return bin_ids
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, args) -> subprocess.Popen:
+    command = [sys.executable, os.path.join(BENCH_DIR, "serve.py"), "--port", str(port),
+               "--gemini-latency-ms", str(args.gemini_latency_ms), "--gemini-jitter-ms", str(args.gemini_jitter_ms)]
+    if args.video:
+        command += ["--video", args.video]
+    server = subprocess.Popen(command)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1.0).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    server.terminate()
+    raise RuntimeError("Benchmark server did not come up within 120s")
+
+
+def print_table(results: list[StreamResult]) -> None:
+    def number(value, digits=1):
+        return "-" if value is None else f"{value:.{digits}f}"
+    print(f"\n{'stream':<18} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'cpu %':>7} {'cpu ms/req':>11}")
+    for r in results:
+        print(f"{r.stream:<18} {r.requests:>9} {r.errors:>7} {number(r.rps):>9} {number(r.p50_ms):>9} {number(r.p99_ms):>9} "
+              f"{number(r.cpu_percent):>7} {number(r.cpu_ms_per_request, 2):>11}")
+    print("(video-feed: requests are frames received, p50/p99 the time to the first frame)")
+
+
+def regressions(results: list[StreamResult], baseline: dict, tolerance: float) -> list[str]:
+    """Streams whose p99 rose, or whose throughput fell, by more than tolerance against the baseline run."""
+    found = []
+    for r in results:
+        base = baseline.get("streams", {}).get(r.stream)
+        if base is None:
+            continue
+        if base.get("p99_ms") and r.p99_ms is not None and r.p99_ms > base["p99_ms"] * (1 + tolerance):
+            found.append(f"{r.stream}: p99 {r.p99_ms:.1f} ms vs {base['p99_ms']:.1f} ms")
+        if base.get("rps") and r.rps < base["rps"] * (1 - tolerance):
+            found.append(f"{r.stream}: {r.rps:.1f} rps vs {base['rps']:.1f} rps")
+        if r.errors and not base.get("errors"):
+            found.append(f"{r.stream}: {r.errors} errors (baseline had none)")
+    return found
+
+
+async def run(args, base_url: str) -> list[StreamResult]:
+    bin_ids = await seed_bins(base_url, args.bins) if args.bins else ["A01", "B03", "C05"]
+    load = Load(bin_ids, upload_pool(args.upload_pool, args.seed), args.seed)
+    results = []
+    for stream in args.streams:
+        print(f"Running {stream}: {args.concurrency} clients for {args.duration:.0f}s", flush=True)
+        results.append(await run_stream(base_url, load, stream, args.concurrency, args.duration))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the backend and report latency, throughput and CPU per endpoint.")
+    parser.add_argument("--url", help="Backend to test. Without it, bench/serve.py is started on a free port.")
+    parser.add_argument("--streams", nargs="+", choices=STREAMS, default=STREAMS)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients per stream.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per stream.")
+    parser.add_argument("--bins", type=int, help="Bins to register before the run (default 500 for a started server, 0 with --url).")
+    parser.add_argument("--upload-pool", type=int, default=512,
+                        help="Distinct images cycled through by classify-image; more than CLASSIFY_CACHE_SIZE means every upload misses the cache.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--video", help="Video file for the started server's camera (default: generated).")
+    parser.add_argument("--gemini-latency-ms", type=float, default=300.0, help="Latency of the started server's Gemini stub.")
+    parser.add_argument("--gemini-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--output", help="Write the results as JSON (usable as a later --compare baseline).")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier --output run.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p99 rise / throughput drop against the baseline (0.2 = 20%%).")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        args.bins = args.bins or 0
+    else:
+        port = free_port()
+        server = start_server(port, args)
+        base_url = f"http://127.0.0.1:{port}"
+        args.bins = 500 if args.bins is None else args.bins
+    try:
+        results = asyncio.run(run(args, base_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print_table(results)
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        with open(args.output, "w") as f:
+            json.dump({"config": config, "streams": {r.stream: r.summary() for r in results}}, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        if found:
+            print(f"\nRegressions against {args.compare} (tolerance {args.tolerance:.0%}):")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# serve.py
+"""Runs the backend for benchmarks: Gemini stubbed, a looping video file as the camera, state in a scratch directory.
+
+    python bench/serve.py --port 8100 --gemini-latency-ms 400
+    python bench/serve.py --video recorded_kiosk.mp4 --camera-fps 15
+
+Without --video a synthetic clip is generated: items of random colour and
+size appear in front of a textured background every couple of seconds and
+stay still, so the motion-gated auto-detection fires as it would at a bin.
+loadtest.py starts this script itself unless it is given --url.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_video(path: str, seconds: float = 20.0, fps: float = 15.0, width: int = 640, height: int = 480,
+               scene_seconds: float = 2.0, seed: int = 0) -> str:
+    """Writes a synthetic MJPEG clip to path and returns path."""
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(60, 120, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not write {path}")
+    frames_per_scene = max(1, round(scene_seconds * fps))
+    frame = background
+    for index in range(round(seconds * fps)):
+        if index % frames_per_scene == 0:
+            # A new item lands; it stays put until the next scene
+            frame = background.copy()
+            x, y = int(rng.integers(0, width * 3 // 4)), int(rng.integers(0, height * 3 // 4))
+            w, h = int(rng.integers(width // 8, width // 4)), int(rng.integers(height // 8, height // 3))
+            cv2.rectangle(frame, (x, y), (x + w, y + h), tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+        # Sensor noise, so consecutive frames are not byte-identical
+        noisy = cv2.add(frame, rng.integers(0, 4, frame.shape, dtype=np.uint8))
+        writer.write(noisy)
+    writer.release()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend with a stubbed Gemini and a video file for a camera.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--video", help="Video file to use as the camera (default: a generated clip).")
+    parser.add_argument("--camera-fps", type=float, default=15.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300.0)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--data-dir", help="Where the database and credit ledger go (default: a temporary directory).")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="trashnet-bench-")
+    video = args.video or make_video(os.path.join(data_dir, "camera.avi"), fps=args.camera_fps)
+    # Explicit environment wins, so any other setting can still be tuned per run
+    os.environ.setdefault("TRASHNET_DB_PATH", os.path.join(data_dir, "trashnet.db"))
+    os.environ.setdefault("CREDIT_LEDGER_PATH", os.path.join(data_dir, "credits.ledger"))
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("LOG_LEVEL", "ERROR") # Seeding a bench fleet would otherwise log a warning per new bin
+    os.environ["CAMERA_DEVICE"] = video
+    os.environ["CAMERA_FPS"] = str(args.camera_fps)
+
+    sys.path.insert(0, BACKEND_DIR)
+    import fake_gemini # Next to this script
+    fake_gemini.install(args.gemini_latency_ms, args.gemini_jitter_ms)
+    import uvicorn
+    import main as backend
+
+    print(f"Benchmark server on http://{args.host}:{args.port} (data in {data_dir}, camera {video}, "
+          f"Gemini stub {args.gemini_latency_ms:.0f}+{args.gemini_jitter_ms:.0f} ms)", flush=True)
+    try:
+        uvicorn.run(backend.app, host=args.host, port=args.port, log_level="warning")
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
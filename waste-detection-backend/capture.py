@@ -0,0 +1,292 @@
+# capture.py
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import IO, Callable, NamedTuple, Optional, Union
+
+import cv2
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows: no advisory locks, so nothing stops two processes opening the camera
+    fcntl = None
+
+import metrics
+from jpeg import JpegCodec, default_codec
+from log import get_logger
+
+logger = get_logger("capture")
+FRAMES_CAPTURED = metrics.counter("camera_frames_captured_total", "Frames read from the camera into the frame ring.")
+FRAMES_DROPPED = metrics.counter("camera_frames_dropped_total", "Frames the camera delivered that could not be decoded.")
+READ_FAILURES = metrics.counter("camera_read_failures_total", "Camera reads that produced no usable frame.")
+REOPENS = metrics.counter("camera_reopens_total", "Times the camera was closed and reopened after failing.")
+
+
+class Frame(NamedTuple):
+    seq: int          # Monotonic, starts at 1; 0 means "nothing seen yet"
+    timestamp: float  # Unix time the frame was captured
+    image: np.ndarray
+
+
+class FrameRing:
+    """Fixed-size ring of preallocated frame buffers shared by the capture thread and its consumers.
+
+    The capture thread reads straight into the next slot (see next_slot/commit),
+    so a frame is never copied on the way in. Readers get a view of the slot,
+    which stays valid until the ring wraps around `capacity` frames later; pass
+    copy=True if a frame has to be held longer than that.
+    """
+
+    def __init__(self, capacity: int = 8):
+        if capacity < 2:
+            raise ValueError("FrameRing needs at least 2 slots")
+        self.capacity = capacity
+        self._cond = threading.Condition()
+        self._buffers: Optional[np.ndarray] = None
+        self._seqs = np.zeros(capacity, dtype=np.int64)
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._seq = 0
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def _allocate(self, shape: tuple, dtype) -> None:
+        self._buffers = np.empty((self.capacity,) + tuple(shape), dtype=dtype)
+        self._seqs[:] = 0
+
+    def next_slot(self) -> Optional[np.ndarray]:
+        """Returns the buffer the next frame will be written into (None until the frame shape is known)."""
+        if self._buffers is None:
+            return None
+        return self._buffers[(self._seq + 1) % self.capacity]
+
+    def commit(self, image: np.ndarray, timestamp: Optional[float] = None) -> int:
+        """Publishes the next frame. `image` is normally the slot from next_slot(); anything else is copied in."""
+        timestamp = time.time() if timestamp is None else timestamp
+        if self._buffers is None or self._buffers.shape[1:] != image.shape or self._buffers.dtype != image.dtype:
+            # First frame, or the camera changed resolution: (re)allocate every slot once
+            with self._cond:
+                self._allocate(image.shape, image.dtype)
+        index = (self._seq + 1) % self.capacity
+        slot = self._buffers[index]
+        if not np.shares_memory(slot, image):
+            np.copyto(slot, image)
+        with self._cond:
+            self._seq += 1
+            self._seqs[index] = self._seq
+            self._timestamps[index] = timestamp
+            self._cond.notify_all()
+            return self._seq
+
+    def _frame_at(self, seq: int, copy: bool) -> Optional[Frame]:
+        index = seq % self.capacity
+        if self._buffers is None or self._seqs[index] != seq:
+            return None
+        image = self._buffers[index]
+        return Frame(seq, float(self._timestamps[index]), image.copy() if copy else image)
+
+    def latest(self, copy: bool = False) -> Optional[Frame]:
+        """Returns the most recent frame without blocking, or None before the first frame."""
+        with self._cond:
+            return self._frame_at(self._seq, copy) if self._seq else None
+
+    def wait_newer(self, after_seq: int, timeout: Optional[float] = None, copy: bool = False) -> Optional[Frame]:
+        """Blocks until a frame with seq > after_seq exists and returns the newest one (None on timeout)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after_seq, timeout=timeout):
+                return None
+            return self._frame_at(self._seq, copy)
+
+    def next_frame(self, timeout: Optional[float] = None, copy: bool = False) -> Optional[Frame]:
+        """Waits for the next frame captured after this call, so callers never get a stale one."""
+        return self.wait_newer(self._seq, timeout=timeout, copy=copy)
+
+    def fps(self) -> float:
+        """Capture rate over the frames currently in the ring (0 if the newest is older than a second or two)."""
+        with self._cond:
+            count = min(self._seq, self.capacity)
+            if count < 2:
+                return 0.0
+            newest = self._timestamps[self._seq % self.capacity]
+            oldest = self._timestamps[(self._seq - count + 1) % self.capacity]
+        if time.time() - newest > 2.0 or newest <= oldest:
+            return 0.0 # Camera stalled
+        return (count - 1) / (newest - oldest)
+
+
+@dataclass
+class CaptureConfig:
+    device: Union[int, str] = 0          # Camera index, device path, stream URL or a video file (looped, for testing)
+    width: Optional[int] = None          # None keeps the driver default
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    fourcc: Optional[str] = None         # e.g. "MJPG" to have the camera compress on-chip
+    mjpeg_passthrough: bool = False      # With fourcc MJPG: take the camera's JPEGs as-is for the video feed
+    jpeg_quality: int = 80               # For frames this server has to encode itself
+    retry_delay: float = 0.05            # First wait after a failed read/open; doubles up to max_retry_delay
+    max_retry_delay: float = 5.0
+    reopen_after: int = 20               # Consecutive failed reads before the device is closed and reopened
+
+    @classmethod
+    def from_env(cls) -> "CaptureConfig":
+        def optional(name, cast):
+            value = os.getenv(name)
+            return cast(value) if value else None
+        device = os.getenv("CAMERA_DEVICE", "0")
+        return cls(
+            device=int(device) if device.isdigit() else device,
+            width=optional("CAMERA_WIDTH", int),
+            height=optional("CAMERA_HEIGHT", int),
+            fps=optional("CAMERA_FPS", float),
+            fourcc=optional("CAMERA_FOURCC", str),
+            mjpeg_passthrough=os.getenv("CAMERA_MJPEG_PASSTHROUGH", "0") == "1",
+            jpeg_quality=int(os.getenv("VIDEO_FEED_JPEG_QUALITY", "80")),
+        )
+
+
+def lock_device(device: Union[int, str], lock_dir: Optional[str] = None) -> Optional[IO]:
+    """Claims a capture device for this process through an advisory lock file.
+
+    Returns the open lock file, which holds the claim until it is closed (or
+    the process exits), or None if another process already holds it. This
+    lets every worker of a multi-worker server try, and exactly one win.
+    """
+    name = re.sub(r"[^A-Za-z0-9]+", "_", str(device)).strip("_") or "default"
+    lock_file = open(os.path.join(lock_dir or tempfile.gettempdir(), f"trashnet-camera-{name}.lock"), "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+def is_jpeg_buffer(frame: np.ndarray) -> bool:
+    # With RGB conversion off, an MJPEG camera returns each compressed frame as one row of bytes
+    return frame.ndim < 3 and frame.size > 2 and frame.reshape(-1)[:2].tobytes() == b"\xff\xd8"
+
+
+class Camera:
+    """Opens a capture device per CaptureConfig and feeds a FrameRing, backing off and reopening on failures.
+
+    In MJPEG passthrough mode the camera's own JPEG for each frame is handed
+    to `on_jpeg` untouched (no decode/re-encode round trip for the video feed)
+    and only decoded once for the ring. If the driver does not deliver MJPEG,
+    capture falls back to normal mode.
+
+    A video file stands in for a camera: it is played at `fps` (or its own
+    frame rate) and starts over at the end, so benchmarks and demos run
+    without hardware.
+    """
+
+    def __init__(self, config: CaptureConfig, codec: JpegCodec = default_codec):
+        self.config = config
+        self.codec = codec
+        self.passthrough_active = False
+        self._passthrough = False
+        self._passthrough_refused = False # Set once the device has delivered non-JPEG frames in passthrough mode
+        self._cap: Optional[cv2.VideoCapture] = None
+        self._frame_interval = 0.0 # Seconds between frames when playing a video file, 0 for live devices
+        self._stopped = threading.Event()
+        self.read_failures = 0
+
+    def open(self) -> bool:
+        config = self.config
+        cap = cv2.VideoCapture(config.device)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        if config.fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*config.fourcc))
+        if config.width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.width)
+        if config.height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.height)
+        if config.fps:
+            cap.set(cv2.CAP_PROP_FPS, config.fps)
+        self._passthrough = config.mjpeg_passthrough and not self._passthrough_refused
+        is_file = isinstance(config.device, str) and os.path.isfile(config.device)
+        self._frame_interval = 1.0 / (config.fps or cap.get(cv2.CAP_PROP_FPS) or 30.0) if is_file else 0.0
+        if self._passthrough:
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        self._cap = cap
+        logger.info(f"Camera {config.device} opened: {int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))} "
+              f"@ {cap.get(cv2.CAP_PROP_FPS):.0f} fps, JPEG via {self.codec.backend}")
+        return True
+
+    def release(self) -> None:
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+        self.passthrough_active = False
+
+    def _read_into(self, ring: FrameRing, on_jpeg: Optional[Callable[[bytes], None]]) -> bool:
+        if not self._passthrough:
+            # Read straight into the ring's next slot so the frame is never copied
+            ret, frame = self._cap.read(ring.next_slot())
+            if not ret and self._frame_interval:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0) # End of the video file: loop
+                ret, frame = self._cap.read(ring.next_slot())
+            if ret:
+                ring.commit(frame)
+                FRAMES_CAPTURED.inc()
+            return ret
+        ret, frame = self._cap.read()
+        if not ret or frame is None:
+            return False
+        if not is_jpeg_buffer(frame):
+            # The driver does not hand out MJPEG and raw unconverted frames are not BGR; reopen in normal mode
+            logger.warning(f"Camera {self.config.device} did not deliver MJPEG; reopening without passthrough.")
+            self._passthrough_refused = True
+            self.release()
+            return True
+        jpeg = frame.tobytes()
+        image = self.codec.decode(jpeg)
+        if image is None:
+            FRAMES_DROPPED.inc()
+            return False # Corrupt frame from the camera; skip it
+        ring.commit(image)
+        FRAMES_CAPTURED.inc()
+        self.passthrough_active = True
+        if on_jpeg is not None:
+            on_jpeg(jpeg)
+        return True
+
+    def run(self, ring: FrameRing, on_jpeg: Optional[Callable[[bytes], None]] = None) -> None:
+        """Capture loop; returns after stop()."""
+        delay = self.config.retry_delay
+        next_frame_at = 0.0
+        while not self._stopped.is_set():
+            if self._cap is None and not self.open():
+                logger.warning(f"Could not open camera {self.config.device}. Retrying in {delay:.2f}s")
+                self._stopped.wait(delay)
+                delay = min(delay * 2, self.config.max_retry_delay)
+                continue
+            if self._read_into(ring, on_jpeg):
+                self.read_failures = 0
+                delay = self.config.retry_delay
+                if self._frame_interval:
+                    # A file reads as fast as it decodes; hold it to its frame rate like a real camera
+                    next_frame_at = max(next_frame_at + self._frame_interval, time.monotonic() - self._frame_interval)
+                    self._stopped.wait(max(0.0, next_frame_at - time.monotonic()))
+                continue
+            # Back off instead of spinning on a camera that is not delivering
+            self.read_failures += 1
+            READ_FAILURES.inc()
+            if self.read_failures >= self.config.reopen_after:
+                logger.warning(f"Camera {self.config.device} failed {self.read_failures} reads in a row; reopening.")
+                REOPENS.inc()
+                self.read_failures = 0
+                self.release()
+            self._stopped.wait(delay)
+            delay = min(delay * 2, self.config.max_retry_delay)
+        self.release()
+
+    def stop(self) -> None:
+        self._stopped.set()
@@ -3,8 +3,9 @@ import cv2
 from dotenv import load_dotenv
 import google.generativeai as genai
 import tkinter as tk
-from tkinter import messagebox
 from PIL import Image, ImageTk
+from classifier import CascadeClassifier, GeminiClassifier, load_local_classifier
+from gemini_client import GeminiClient
 
 # Load Gemini API key
 load_dotenv()
@@ -13,40 +14,23 @@ genai.configure(api_key=GEMINI_API_KEY)
 
 IMG_PATH = "test.jpg"
 
-# Gemini mapping logic
-def map_gemini_to_category(description: str) -> str:
-    desc = description.lower()
-    if any(word in desc for word in ["plastic", "bottle", "container", "bag"]):
-        return "plastic"
-    if any(word in desc for word in ["metal", "can", "aluminum", "steel"]):
-        return "metal"
-    if any(word in desc for word in ["glass", "jar", "bottle"]):
-        return "glass"
-    if any(word in desc for word in ["paper", "cardboard", "sheet", "newspaper"]):
-        return "paper"
-    if any(word in desc for word in ["wood", "stick", "timber", "plywood"]):
-        return "wood"
-    return "unknown"
+# Local model first (if LOCAL_CLASSIFIER_MODEL is set), Gemini only when it is unsure or missing
+classifier = CascadeClassifier(
+    remote=GeminiClassifier(GeminiClient(), model_name=os.getenv("GEMINI_VISION_MODEL", "gemini-2.0-flash")),
+    local=load_local_classifier(os.getenv("LOCAL_CLASSIFIER_MODEL")),
+    threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.8")),
+)
 
 def classify_image_file(image_path):
     with open(image_path, "rb") as f:
         img_bytes = f.read()
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    prompt = "Classify this waste item as plastic, metal, glass, paper, or wood."
+    image = cv2.imread(image_path) if classifier.local else None
     try:
-        response = model.generate_content([
-            prompt,
-            {
-                "mime_type": "image/jpeg",
-                "data": img_bytes
-            }
-        ])
-        print("Gemini response:", response)
-        desc = response.text if hasattr(response, 'text') else str(response)
-        category = map_gemini_to_category(desc)
-        print("Mapped category:", category)
+        prediction = classifier.classify(image, img_bytes=img_bytes)
+        category = prediction.category
+        print(f"Mapped category: {category} (item: {prediction.specific_item}, source: {prediction.source}, confidence: {prediction.confidence:.2f})")
     except Exception as e:
-        print("Gemini error:", e)
+        print("Classifier error:", e)
         category = "unknown"
     return category
 
@@ -93,7 +77,7 @@ def preview_with_tkinter(image_path):
 def main():
     if capture_with_opencv():
         preview_with_tkinter(IMG_PATH)
-        print("Classifying with Gemini...")
+        print("Classifying...")
         classify_image_file(IMG_PATH)
     else:
         print("No image captured.")
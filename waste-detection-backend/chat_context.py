@@ -0,0 +1,184 @@
+# chat_context.py
+import re
+import threading
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Mapping, Optional, Sequence
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+")
+# Words too common in bin names/locations (and chat messages) to say which bin someone means
+STOPWORDS = {
+    "bin", "bins", "the", "and", "near", "street", "road", "ave", "avenue", "new", "unknown", "location",
+    "which", "what", "where", "there", "with", "from", "this", "that", "full", "empty", "status",
+}
+CHARS_PER_TOKEN = 4 # Rough estimate for English prompt text
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def keywords(text: str) -> set[str]:
+    return {word for word in (w.lower() for w in WORD_PATTERN.findall(text)) if len(word) >= 3 and word not in STOPWORDS}
+
+
+def format_bin_line(bin_info: Mapping, distance_km: Optional[float] = None) -> str:
+    distance = f", Distance: {distance_km:.1f} km" if distance_km is not None else ""
+    return (
+        f"- Bin ID: {bin_info['id']}, Name: {bin_info['name']}, Location: {bin_info['location']}, "
+        f"Fill Level: {bin_info['fillLevel']}%, Status: {bin_info['status']}, "
+        f"Connection: {bin_info['connection_status']}, "
+        f"Last Seen: {datetime.fromtimestamp(int(bin_info['last_seen'])).strftime('%Y-%m-%d %H:%M:%S UTC')}{distance}\n"
+    )
+
+
+class FleetContext:
+    """Incrementally maintained fleet summary and bin lookup for chat prompts.
+
+    update() is called whenever a bin changes and costs O(1) (plus the bin's
+    name/location words when those change). Bins are bucketed by fill level
+    (0-100), so the N fullest are found by walking buckets from the top
+    instead of sorting the fleet. Prompts are assembled under a token budget,
+    so their size does not grow with the number of bins.
+    """
+
+    def __init__(self, bins: Mapping[str, Mapping], token_budget: int = 1500, top_n: int = 5, offline_limit: int = 10,
+                 relevant_limit: int = 10):
+        self.bins = bins
+        self.token_budget = token_budget
+        self.top_n = top_n
+        self.offline_limit = offline_limit
+        self.relevant_limit = relevant_limit
+        self._lock = threading.Lock()
+        self._state: dict[str, tuple[int, str, str]] = {}
+        self._by_fill: list[set[str]] = [set() for _ in range(101)]
+        self._status_counts: dict[str, int] = {}
+        self._offline: set[str] = set()
+        self._ids: dict[str, str] = {}                  # Upper-cased ID -> bin ID
+        self._words: dict[str, set[str]] = {}           # Bin ID -> its name/location keywords
+        self._word_index: dict[str, set[str]] = {}      # Keyword -> bin IDs
+
+    # --- Incremental maintenance ---
+    def update(self, bin_info: Mapping) -> None:
+        bin_id = bin_info["id"]
+        fill = max(0, min(100, int(bin_info["fillLevel"])))
+        state = (fill, str(bin_info["status"]), str(bin_info["connection_status"]))
+        words = keywords(f"{bin_info['name']} {bin_info['location']}")
+        with self._lock:
+            previous = self._state.get(bin_id)
+            if previous != state:
+                if previous is not None:
+                    self._by_fill[previous[0]].discard(bin_id)
+                    self._status_counts[previous[1]] -= 1
+                self._state[bin_id] = state
+                self._by_fill[fill].add(bin_id)
+                self._status_counts[state[1]] = self._status_counts.get(state[1], 0) + 1
+                if state[2] == "offline":
+                    self._offline.add(bin_id)
+                else:
+                    self._offline.discard(bin_id)
+            if self._words.get(bin_id) != words:
+                for word in self._words.get(bin_id, ()):
+                    self._word_index[word].discard(bin_id)
+                for word in words:
+                    self._word_index.setdefault(word, set()).add(bin_id)
+                self._words[bin_id] = words
+                self._ids[bin_id.upper()] = bin_id
+
+    # --- Queries ---
+    def fullest(self, n: int) -> list[str]:
+        result = []
+        with self._lock:
+            for fill in range(100, -1, -1):
+                for bin_id in self._by_fill[fill]:
+                    result.append(bin_id)
+                    if len(result) >= n:
+                        return result
+        return result
+
+    def offline(self, limit: int) -> tuple[list[str], int]:
+        """Up to `limit` offline bin IDs, plus how many are offline in total."""
+        with self._lock:
+            return sorted(islice(self._offline, limit)), len(self._offline)
+
+    def relevant(self, message: str, extra_ids: Iterable[str] = ()) -> list[str]:
+        """Bins named in the message by ID, then bins whose name or location shares its keywords, then extra_ids."""
+        found: dict[str, None] = {}
+        with self._lock:
+            for token in WORD_PATTERN.findall(message):
+                bin_id = self._ids.get(token.upper())
+                if bin_id is not None:
+                    found[bin_id] = None
+            # Rank keyword matches by how many of the message's keywords each bin shares
+            scores: dict[str, int] = {}
+            for word in keywords(message):
+                matches = self._word_index.get(word, ())
+                if len(matches) > self.relevant_limit * 10:
+                    continue # Too common to narrow anything down
+                for bin_id in matches:
+                    scores[bin_id] = scores.get(bin_id, 0) + 1
+        for bin_id in sorted(scores, key=scores.get, reverse=True):
+            found[bin_id] = None
+        for bin_id in extra_ids:
+            if bin_id in self.bins:
+                found[bin_id] = None
+        return list(found)[:self.relevant_limit]
+
+    def summary(self) -> str:
+        with self._lock:
+            total = len(self._state)
+            counts = ", ".join(f"{status}: {count}" for status, count in sorted(self._status_counts.items()) if count)
+            offline = len(self._offline)
+        return f"Total bins: {total} ({counts}). Online: {total - offline}, offline: {offline}.\n"
+
+    # --- Prompt assembly ---
+    def _bin_section(self, title: str, bin_ids: list[str], budget: int, total: Optional[int] = None,
+                     distances: Optional[Mapping[str, float]] = None) -> tuple[str, int]:
+        """Renders as many of the bins as fit in `budget` tokens. Returns (text, tokens used)."""
+        lines = [f"{title}:\n"]
+        used = estimate_tokens(lines[0])
+        shown = 0
+        for bin_id in bin_ids:
+            bin_info = self.bins.get(bin_id)
+            if bin_info is None:
+                continue
+            line = format_bin_line(bin_info, distances.get(bin_id) if distances else None)
+            cost = estimate_tokens(line)
+            if used + cost > budget:
+                break
+            lines.append(line)
+            used += cost
+            shown += 1
+        if not shown:
+            return "", 0
+        remaining = (total if total is not None else len(bin_ids)) - shown
+        if remaining > 0:
+            lines.append(f"(... and {remaining} more not listed)\n")
+            used += estimate_tokens(lines[-1])
+        return "".join(lines), used
+
+    def build_prompt(self, header: str, footer: str, message: str, extra_bin_ids: Iterable[str] = (),
+                     nearby: Sequence[tuple[str, float]] = ()) -> str:
+        """header + fleet summary + nearby, relevant, offline and fullest bins (as far as the budget allows) + footer.
+
+        `nearby` is (bin ID, distance km) pairs, closest first, for a user who shared their location.
+        """
+        budget = self.token_budget - estimate_tokens(header) - estimate_tokens(footer)
+        sections = ["--- Bin Data ---\n", self.summary()]
+        budget -= sum(estimate_tokens(section) for section in sections)
+        distances = dict(nearby)
+        relevant = [b for b in self.relevant(message, extra_bin_ids) if b not in distances]
+        offline_ids, offline_total = self.offline(self.offline_limit)
+        shown = set(relevant) | distances.keys()
+        for title, bin_ids, total in (
+            ("Nearest bins with space, from the user's location", list(distances), None),
+            ("Bins relevant to this question", relevant, None),
+            ("Fullest bins", [b for b in self.fullest(self.top_n + len(shown)) if b not in shown][:self.top_n], None),
+            ("Offline bins", offline_ids, offline_total),
+        ):
+            if budget <= 0:
+                break
+            text, used = self._bin_section(title, bin_ids, budget, total, distances)
+            sections.append(text)
+            budget -= used
+        return header + "".join(sections) + "\n" + footer
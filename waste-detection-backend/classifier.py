@@ -0,0 +1,304 @@
+# classifier.py
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+from gemini_client import GeminiClient
+from jpeg import encode_jpeg
+from log import get_logger
+
+logger = get_logger("classifier")
+
+CATEGORIES = ["plastic", "metal", "glass", "paper", "wood"]
+
+CLASSIFY_PROMPT = "Analyze the waste item in the image. Respond in JSON format with two keys: 'category' (classify as plastic, metal, glass, paper, or wood) and 'item_name' (a specific name for the item, e.g., 'plastic bottle', 'aluminum can', 'cardboard box')."
+
+CLASSIFY_BATCH_PROMPT = "You will receive {count} images, each showing one waste item. Respond with a JSON array of exactly {count} objects in the same order as the images, each with two keys: 'category' (classify as plastic, metal, glass, paper, or wood) and 'item_name' (a specific name for the item, e.g., 'plastic bottle', 'aluminum can', 'cardboard box')."
+
+
+# --- Gemini response parsing ---
+def map_gemini_to_category(description: str) -> str:
+    desc = description.lower()
+    if any(word in desc for word in ["plastic", "bottle", "container", "bag"]):
+        return "plastic"
+    if any(word in desc for word in ["metal", "can", "aluminum", "steel"]):
+        return "metal"
+    if any(word in desc for word in ["glass", "jar", "bottle"]):
+        return "glass"
+    if any(word in desc for word in ["paper", "cardboard", "sheet", "newspaper"]):
+        return "paper"
+    if any(word in desc for word in ["wood", "stick", "timber", "plywood"]):
+        return "wood"
+    return "unknown"
+
+def parse_gemini_response(text_response: str) -> tuple[str, str]:
+    clean_response = text_response.strip()
+    if clean_response.startswith('```json') and clean_response.endswith('```'):
+        clean_response = clean_response[len('```json'):-len('```')].strip()
+
+    try:
+        data = json.loads(clean_response)
+        category = data.get("category", "unknown").lower()
+        specific_item = data.get("item_name", "unknown").lower()
+        return category, specific_item
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSONDecodeError: Could not parse response as JSON. Error: {e}. Cleaned response: '{clean_response}'. Original response: '{text_response}'")
+        category = map_gemini_to_category(text_response)
+        specific_item = "unknown_item_parsing_error"
+        return category, specific_item
+
+def parse_gemini_batch_response(text_response: str, count: int) -> Optional[list[tuple[str, str]]]:
+    """Parses the JSON array answer to CLASSIFY_BATCH_PROMPT; None if it is unusable."""
+    clean_response = text_response.strip()
+    if clean_response.startswith('```json') and clean_response.endswith('```'):
+        clean_response = clean_response[len('```json'):-len('```')].strip()
+    try:
+        data = json.loads(clean_response)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, list) or len(data) != count or not all(isinstance(entry, dict) for entry in data):
+        return None
+    return [(str(entry.get("category", "unknown")).lower(), str(entry.get("item_name", "unknown")).lower()) for entry in data]
+
+
+# --- Backends ---
+@dataclass
+class Prediction:
+    category: str
+    specific_item: str
+    confidence: float # 0..1; remote backends that give no score report 1.0
+    source: str       # Name of the backend that produced it
+
+
+class ClassifierBackend:
+    """Interface every classification engine implements. Images are BGR arrays as read by OpenCV."""
+    name = "base"
+
+    def classify_batch(self, images: list[np.ndarray]) -> list[Prediction]:
+        raise NotImplementedError
+
+    def classify(self, image: np.ndarray) -> Prediction:
+        return self.classify_batch([image])[0]
+
+
+class LocalClassifier(ClassifierBackend):
+    """On-CPU ONNX model run through OpenCV DNN, one output logit per label.
+
+    Each worker thread loads its own copy of the network (cv2.dnn.Net is not
+    thread-safe), and batches are split into `batch_size` chunks that run in
+    parallel on the pool.
+    """
+    name = "local"
+
+    def __init__(self, model_path: str, labels: list[str] = CATEGORIES, input_size: int = 224,
+                 mean: tuple = (0.485, 0.456, 0.406), std: tuple = (0.229, 0.224, 0.225),
+                 batch_size: int = 8, num_workers: int = 2):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Local classifier model not found: {model_path}")
+        self.model_path = model_path
+        self.labels = labels
+        self.input_size = input_size
+        self.mean = np.array(mean, dtype=np.float32).reshape(1, 3, 1, 1)
+        self.std = np.array(std, dtype=np.float32).reshape(1, 3, 1, 1)
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="local-classifier")
+        self._net() # Fail at startup rather than on the first request if the model is unreadable
+
+    def _net(self):
+        net = getattr(self._local, "net", None)
+        if net is None:
+            net = cv2.dnn.readNetFromONNX(self.model_path)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self._local.net = net
+        return net
+
+    def _run(self, images: list[np.ndarray]) -> list[Prediction]:
+        blob = cv2.dnn.blobFromImages(images, scalefactor=1.0 / 255, size=(self.input_size, self.input_size), swapRB=True, crop=False)
+        blob = (blob - self.mean) / self.std
+        net = self._net()
+        net.setInput(blob)
+        logits = net.forward().reshape(len(images), -1)
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        predictions = []
+        for row, index in zip(probs, best):
+            category = self.labels[index]
+            predictions.append(Prediction(category, f"{category} item", float(row[index]), self.name))
+        return predictions
+
+    def submit_batch(self, images: list[np.ndarray]) -> Future:
+        """Schedules one batch on the pool and returns a Future of its predictions."""
+        return self._executor.submit(self._run, images)
+
+    def classify_batch(self, images: list[np.ndarray]) -> list[Prediction]:
+        futures = [self.submit_batch(images[i:i + self.batch_size]) for i in range(0, len(images), self.batch_size)]
+        return [prediction for future in futures for prediction in future.result()]
+
+
+class GeminiClassifier(ClassifierBackend):
+    """Sends each image to Gemini with CLASSIFY_PROMPT and parses the JSON reply."""
+    name = "gemini"
+
+    def __init__(self, client: GeminiClient, model_name: str = "gemini-2.0-flash", prompt: str = CLASSIFY_PROMPT,
+                 parse_response: Callable[[str], tuple[str, str]] = parse_gemini_response):
+        self.client = client
+        self.model_name = model_name
+        self.prompt = prompt
+        self.parse_response = parse_response
+
+    def _contents(self, img_bytes: bytes, mime_type: str) -> list:
+        return [
+            self.prompt,
+            {
+                "mime_type": mime_type,
+                "data": img_bytes
+            }
+        ]
+
+    def _prediction(self, response) -> Prediction:
+        desc = response.text if hasattr(response, 'text') else str(response)
+        logger.debug("Gemini raw response: %s", desc)
+        category, specific_item = self.parse_response(desc)
+        return Prediction(category, specific_item, 1.0, self.name)
+
+    def classify_encoded(self, img_bytes: bytes, mime_type: str = "image/jpeg") -> Prediction:
+        return self._prediction(self.client.generate_sync(self._contents(img_bytes, mime_type), self.model_name))
+
+    async def aclassify_encoded(self, img_bytes: bytes, mime_type: str = "image/jpeg") -> Prediction:
+        return self._prediction(await self.client.generate(self._contents(img_bytes, mime_type), self.model_name))
+
+    def classify_batch(self, images: list[np.ndarray]) -> list[Prediction]:
+        return [self.classify_encoded(encode_jpeg(image)) for image in images]
+
+    async def aclassify_encoded_batch(self, images: list[bytes], mime_type: str = "image/jpeg") -> list[Prediction]:
+        """Classifies several uploads with one multi-image prompt, falling back to one call each if the reply does not line up."""
+        if len(images) == 1:
+            return [await self.aclassify_encoded(images[0], mime_type)]
+        contents = [CLASSIFY_BATCH_PROMPT.format(count=len(images))]
+        contents.extend({"mime_type": mime_type, "data": img_bytes} for img_bytes in images)
+        response = await self.client.generate(contents, self.model_name)
+        desc = response.text if hasattr(response, 'text') else str(response)
+        parsed = parse_gemini_batch_response(desc, len(images))
+        if parsed is None:
+            logger.warning(f"Gemini batch response did not match {len(images)} images; classifying individually. Response: {desc}")
+            return list(await asyncio.gather(*(self.aclassify_encoded(img_bytes, mime_type) for img_bytes in images)))
+        return [Prediction(category, specific_item, 1.0, self.name) for category, specific_item in parsed]
+
+
+class CascadeClassifier:
+    """Runs the local engine first and only escalates to the remote backend when it is unsure.
+
+    If the remote call fails (e.g. the network is down) and a local prediction
+    exists, the local prediction is returned instead of an error.
+    """
+
+    def __init__(self, remote: ClassifierBackend, local: Optional[LocalClassifier] = None, threshold: float = 0.8):
+        self.remote = remote
+        self.local = local
+        self.threshold = threshold
+
+    def classify(self, image: Optional[np.ndarray], img_bytes: Optional[bytes] = None) -> Prediction:
+        """Classifies a decoded frame; img_bytes, if given, is sent to the remote backend as-is."""
+        local_prediction = None
+        if self.local is not None and image is not None:
+            local_prediction = self.local.classify(image)
+            if local_prediction.confidence >= self.threshold:
+                return local_prediction
+        try:
+            if img_bytes is not None and isinstance(self.remote, GeminiClassifier):
+                return self.remote.classify_encoded(img_bytes)
+            if image is None:
+                raise ValueError("No decodable image to classify")
+            return self.remote.classify(image)
+        except Exception as e:
+            if local_prediction is None:
+                raise
+            logger.warning(f"Remote classifier failed ({e}); using local prediction with confidence {local_prediction.confidence:.2f}")
+            return local_prediction
+
+    async def aclassify(self, image: Optional[np.ndarray], img_bytes: Optional[bytes] = None) -> Prediction:
+        """Event-loop friendly classify: local inference runs on its pool, Gemini through the async client."""
+        local_prediction = None
+        if self.local is not None and image is not None:
+            local_prediction = (await asyncio.wrap_future(self.local.submit_batch([image])))[0]
+            if local_prediction.confidence >= self.threshold:
+                return local_prediction
+        try:
+            if not isinstance(self.remote, GeminiClassifier):
+                if image is None:
+                    raise ValueError("No decodable image to classify")
+                return await asyncio.to_thread(self.remote.classify, image)
+            if img_bytes is None:
+                if image is None:
+                    raise ValueError("No decodable image to classify")
+                img_bytes = await asyncio.to_thread(encode_jpeg, image)
+            return await self.remote.aclassify_encoded(img_bytes)
+        except Exception as e:
+            if local_prediction is None:
+                raise
+            logger.warning(f"Remote classifier failed ({e}); using local prediction with confidence {local_prediction.confidence:.2f}")
+            return local_prediction
+
+    async def aclassify_batch(self, items: list[tuple[Optional[np.ndarray], Optional[bytes]]]) -> list:
+        """Batched aclassify over (image, img_bytes) pairs: local inference in `batch_size` chunks, then one Gemini call for the unsure ones.
+
+        Items that could not be classified at all get their exception in place of a Prediction.
+        """
+        results: list[Optional[Prediction]] = [None] * len(items)
+        if self.local is not None:
+            local_indexes = [i for i, (image, _) in enumerate(items) if image is not None]
+            if local_indexes:
+                # Chunks of the engine's batch_size run in parallel on its pool, as in LocalClassifier.classify_batch
+                images, size = [items[i][0] for i in local_indexes], self.local.batch_size
+                chunks = await asyncio.gather(*(asyncio.wrap_future(self.local.submit_batch(images[start:start + size]))
+                                                for start in range(0, len(images), size)))
+                for i, prediction in zip(local_indexes, (prediction for chunk in chunks for prediction in chunk)):
+                    results[i] = prediction
+        pending = [i for i, prediction in enumerate(results) if prediction is None or prediction.confidence < self.threshold]
+        if not pending:
+            return results
+        if not isinstance(self.remote, GeminiClassifier):
+            remote_predictions = await asyncio.gather(*(self.aclassify(*items[i]) for i in pending), return_exceptions=True)
+        else:
+            try:
+                encoded = []
+                for i in pending:
+                    image, img_bytes = items[i]
+                    if img_bytes is None:
+                        if image is None:
+                            raise ValueError("No decodable image to classify")
+                        img_bytes = await asyncio.to_thread(encode_jpeg, image)
+                    encoded.append(img_bytes)
+                remote_predictions = await self.remote.aclassify_encoded_batch(encoded)
+            except Exception as e:
+                remote_predictions = [e] * len(pending)
+        for i, prediction in zip(pending, remote_predictions):
+            if not isinstance(prediction, Exception):
+                results[i] = prediction
+            elif results[i] is not None:
+                logger.warning(f"Remote classifier failed ({prediction}); using local prediction with confidence {results[i].confidence:.2f}")
+            else:
+                results[i] = prediction
+        return results
+
+
+def load_local_classifier(model_path: Optional[str], **kwargs) -> Optional[LocalClassifier]:
+    """Builds the local engine if a model is configured; returns None (Gemini only) otherwise."""
+    if not model_path:
+        return None
+    try:
+        return LocalClassifier(model_path, **kwargs)
+    except Exception as e:
+        logger.warning(f"Local classifier disabled: {e}")
+        return None
@@ -0,0 +1,124 @@
+# events.py
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+# Returned by Subscription.next() when the subscriber fell behind and dropped events
+RESYNC = object()
+
+
+def sse_message(event: str, data) -> bytes:
+    """Formats one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class Subscription:
+    """One subscriber's queue of pre-encoded messages, drained by an async stream."""
+
+    def __init__(self, hub: "EventHub", loop: asyncio.AbstractEventLoop, max_queue: int):
+        self._hub = hub
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._queue: deque[bytes] = deque()
+        self._max_queue = max_queue
+        self._overflowed = False
+
+    def _push(self, message: bytes) -> None:
+        # Called with the hub lock held
+        if len(self._queue) >= self._max_queue:
+            # A client this far behind is better served by a fresh snapshot than a backlog
+            self._queue.clear()
+            self._overflowed = True
+        else:
+            self._queue.append(message)
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass # Event loop already closed; the stream will be cleaned up
+
+    async def next(self, timeout: Optional[float] = None):
+        """Next message, RESYNC after an overflow, or None if nothing arrived within timeout."""
+        while True:
+            with self._hub._lock:
+                if self._overflowed:
+                    self._overflowed = False
+                    return RESYNC
+                if self._queue:
+                    return self._queue.popleft()
+                self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    def close(self) -> None:
+        self._hub._unsubscribe(self)
+
+
+class EventHub:
+    """Thread-safe fan-out of named JSON events to async subscribers.
+
+    publish() may be called from any thread (sync endpoints run in the
+    threadpool). Each message is encoded once and shared by every
+    subscriber; idle subscribers cost nothing but a parked coroutine.
+    """
+
+    def __init__(self, max_queue: int = 256):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers: set[Subscription] = set()
+        self.events_published = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscription:
+        """Must be called from the event loop that will consume the subscription."""
+        subscription = Subscription(self, asyncio.get_running_loop(), self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event: str, data) -> int:
+        """Sends an event to every subscriber. Returns how many received it."""
+        with self._lock:
+            if not self._subscribers:
+                return 0
+            message = sse_message(event, data)
+            for subscription in self._subscribers:
+                subscription._push(message)
+            self.events_published += 1
+            return len(self._subscribers)
+
+
+async def sse_stream(hub: EventHub, snapshot: Callable[[], Optional[bytes]], keepalive: float = 15) -> AsyncIterator[bytes]:
+    """SSE body: snapshot() first (and again after an overflow), then every published message.
+
+    snapshot() runs in a worker thread, so it must not touch the event loop.
+
+    An idle stream gets a comment line every `keepalive` seconds so proxies keep it open.
+    """
+    subscription = hub.subscribe() # Subscribe before the snapshot so no change falls in between
+    try:
+        initial = await asyncio.to_thread(snapshot) # Serialising every bin must not stall the event loop
+        if initial:
+            yield initial
+        while True:
+            message = await subscription.next(timeout=keepalive)
+            if message is None:
+                yield b": keepalive\n\n"
+            elif message is RESYNC:
+                resync = await asyncio.to_thread(snapshot)
+                if resync:
+                    yield resync
+            else:
+                yield message
+    finally:
+        subscription.close()
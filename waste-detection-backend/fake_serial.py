@@ -0,0 +1,75 @@
+# fake_serial.py
+"""Fake Arduino bins on pseudo-terminals, for running gateway.py without hardware (POSIX only).
+
+    python fake_serial.py --bins A01 B03 C05 --config-out fake_gateway_config.json
+    python gateway.py --config fake_gateway_config.json
+
+Each bin gets its own pty that prints 'Distance: <cm> cm | Status: <text>'
+lines like the real sketch, with the distance slowly shrinking as the bin fills.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+BIN_HEIGHT = 62 # cm
+
+
+def status_text(distance_cm: int) -> str:
+    if distance_cm <= BIN_HEIGHT * 0.1:
+        return "Full"
+    if distance_cm <= BIN_HEIGHT * 0.6:
+        return "Half"
+    return "Empty"
+
+
+def open_fake_port():
+    """Returns (master_fd, slave_path, slave_fd). The gateway opens slave_path like a serial device.
+
+    Whatever is written to master_fd is read from the port. Close both fds
+    when done.
+    """
+    master_fd, slave_fd = os.openpty()
+    return master_fd, os.ttyname(slave_fd), slave_fd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Arduino bins on pseudo-terminals.")
+    parser.add_argument('--bins', nargs='+', default=['A01'], help='Bin IDs to simulate.')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between readings per bin.')
+    parser.add_argument('--config-out', help='Write a gateway.py config for these ports to this path.')
+    parser.add_argument('--api-base-url', default='http://localhost:8000')
+    args = parser.parse_args()
+
+    ports = {}
+    for bin_id in args.bins:
+        master_fd, slave_path, slave_fd = open_fake_port()
+        ports[bin_id] = {"master_fd": master_fd, "slave_fd": slave_fd, "distance": BIN_HEIGHT}
+        print(f"{bin_id}: {slave_path}")
+        ports[bin_id]["path"] = slave_path
+
+    if args.config_out:
+        config = {
+            "api_base_url": args.api_base_url,
+            "bins": [{"port": port["path"], "bin_id": bin_id, "bin_height": BIN_HEIGHT} for bin_id, port in ports.items()],
+        }
+        with open(args.config_out, "w") as f:
+            json.dump(config, f, indent=2)
+        print(f"Wrote gateway config to {args.config_out}")
+
+    try:
+        while True:
+            for bin_id, port in ports.items():
+                port["distance"] = max(0, port["distance"] - random.randint(0, 3))
+                if port["distance"] == 0 and random.random() < 0.2:
+                    port["distance"] = BIN_HEIGHT # Emptied
+                line = f"Distance: {port['distance']} cm | Status: {status_text(port['distance'])}\r\n"
+                os.write(port["master_fd"], line.encode())
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\nStopping fake bins.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# forecast.py
+import math
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+class FillForecaster:
+    """Incremental fill-rate estimates and time-to-full predictions for every bin.
+
+    Each bin is one row in a set of NumPy columns holding an exponentially
+    weighted least-squares fit of fill level over time. Sums are kept relative
+    to the bin's latest reading, so an update is O(1) and history is never
+    refit. A sharp drop in fill level means the bin was emptied and restarts
+    its fit. predict() evaluates every bin at once with array arithmetic.
+    """
+
+    def __init__(self, half_life_seconds: float = 6 * 3600, full_threshold: float = 90,
+                 empty_drop: float = 30, min_points: int = 3, min_rate_per_hour: float = 0.1,
+                 initial_capacity: int = 1024):
+        self.decay_rate = math.log(2) / half_life_seconds
+        self.full_threshold = full_threshold
+        self.empty_drop = empty_drop
+        self.min_points = min_points
+        self.min_rate = min_rate_per_hour / 3600
+        self._index: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._allocate(initial_capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        old = getattr(self, "_columns", None)
+        columns = {
+            "last_t": np.zeros(capacity, dtype=np.float64),  # Time of latest reading (origin of the sums)
+            "last_fill": np.zeros(capacity, dtype=np.float64),
+            "points": np.zeros(capacity, dtype=np.int64),     # Readings since the last reset
+            "s0": np.zeros(capacity, dtype=np.float64),       # sum(w)
+            "st": np.zeros(capacity, dtype=np.float64),       # sum(w * t)
+            "stt": np.zeros(capacity, dtype=np.float64),      # sum(w * t^2)
+            "sy": np.zeros(capacity, dtype=np.float64),       # sum(w * y)
+            "sty": np.zeros(capacity, dtype=np.float64),      # sum(w * t * y)
+        }
+        if old is not None:
+            size = len(self._index)
+            for name, column in columns.items():
+                column[:size] = old[name][:size]
+        self._columns = columns
+        self._capacity = capacity
+
+    def _row(self, bin_id: str) -> int:
+        row = self._index.get(bin_id)
+        if row is None:
+            row = len(self._index)
+            if row >= self._capacity:
+                self._allocate(self._capacity * 2)
+            self._index[bin_id] = row
+        return row
+
+    def update(self, bin_id: str, timestamp: float, fill: float) -> None:
+        """Folds one reading into the bin's fit. Readings must arrive in time order per bin."""
+        with self._lock:
+            i = self._row(bin_id) # May grow (and replace) the columns
+            c = self._columns
+            if c["points"][i] == 0 or fill < c["last_fill"][i] - self.empty_drop or timestamp < c["last_t"][i]:
+                # First reading, bin was emptied, or clock went backwards: start a fresh fit
+                c["s0"][i] = c["st"][i] = c["stt"][i] = c["sy"][i] = c["sty"][i] = 0.0
+                c["points"][i] = 0
+            else:
+                # Move the origin to the new reading's time (t -> t - d), then age the old weights
+                d = timestamp - c["last_t"][i]
+                s0, st, sy = c["s0"][i], c["st"][i], c["sy"][i]
+                decay = math.exp(-self.decay_rate * d)
+                c["stt"][i] = (c["stt"][i] - 2 * d * st + d * d * s0) * decay
+                c["sty"][i] = (c["sty"][i] - d * sy) * decay
+                c["st"][i] = (st - d * s0) * decay
+                c["s0"][i] = s0 * decay
+                c["sy"][i] = sy * decay
+            # The new reading sits at t = 0, so it only adds to the weight and value sums
+            c["s0"][i] += 1.0
+            c["sy"][i] += fill
+            c["points"][i] += 1
+            c["last_t"][i] = timestamp
+            c["last_fill"][i] = fill
+
+    def predict(self, now: float) -> "FleetForecast":
+        """Fill rate and time-to-full for every bin, computed in one vectorized pass."""
+        with self._lock:
+            n = len(self._index)
+            c = {name: column[:n].copy() for name, column in self._columns.items()}
+            index = dict(self._index)
+        denominator = c["s0"] * c["stt"] - c["st"] ** 2
+        fitted = (c["points"] >= self.min_points) & (denominator > 1e-9)
+        safe_denominator = np.where(fitted, denominator, 1.0)
+        slope = np.where(fitted, (c["s0"] * c["sty"] - c["st"] * c["sy"]) / safe_denominator, 0.0)
+        intercept = (c["sy"] - slope * c["st"]) / np.where(c["s0"] > 0, c["s0"], 1.0)
+        level_now = intercept + slope * (now - c["last_t"])
+        filling = fitted & (slope > self.min_rate)
+        remaining = np.maximum(self.full_threshold - level_now, 0.0)
+        time_to_full = np.where(filling, remaining / np.where(filling, slope, 1.0), np.nan)
+        time_to_full[(c["points"] > 0) & (c["last_fill"] >= self.full_threshold)] = 0.0 # Already full
+        return FleetForecast(index, np.where(fitted, slope * 3600, np.nan), time_to_full)
+
+
+class FleetForecast:
+    """Result of FillForecaster.predict: per-bin arrays plus the bin_id -> row mapping."""
+
+    def __init__(self, index: dict[str, int], rate_per_hour: np.ndarray, time_to_full: np.ndarray):
+        self.index = index
+        self.rate_per_hour = rate_per_hour
+        self.time_to_full = time_to_full
+
+    def get(self, bin_id: str) -> tuple[Optional[float], Optional[float]]:
+        """(fill rate in %/hour, seconds until full); None where there is no fit or no upward trend."""
+        row = self.index.get(bin_id)
+        if row is None:
+            return None, None
+        rate, remaining = self.rate_per_hour[row], self.time_to_full[row]
+        return (None if math.isnan(rate) else float(rate)), (None if math.isnan(remaining) else float(remaining))
@@ -0,0 +1,136 @@
+# frame_broadcaster.py
+import asyncio
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+from jpeg import JpegCodec, default_codec
+
+BOUNDARY = b"frame"
+
+
+def mjpeg_part(jpeg_bytes: bytes) -> bytes:
+    """Wraps one JPEG in a multipart/x-mixed-replace part."""
+    return (b'--' + BOUNDARY + b'\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\n')
+
+
+class FrameBroadcaster:
+    """Encodes each captured frame once and fans the same MJPEG part out to every viewer.
+
+    Subscribers only ever see the most recent part: a slow client skips the
+    frames it missed instead of queueing them, so CPU and memory stay flat no
+    matter how many viewers are attached.
+    """
+
+    def __init__(self, jpeg_quality: int = 80, codec: JpegCodec = default_codec):
+        self.jpeg_quality = jpeg_quality
+        self.codec = codec
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._part: Optional[bytes] = None
+        self._subscribers = 0
+        self._async_waiters: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.frames_encoded = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return self._subscribers
+
+    def publish(self, frame) -> bool:
+        """Encodes a new frame (only if someone is watching) and wakes all subscribers."""
+        if self._subscribers == 0:
+            return False
+        try:
+            jpeg = self.codec.encode(frame, self.jpeg_quality)
+        except ValueError:
+            return False
+        self._store(mjpeg_part(jpeg))
+        self.frames_encoded += 1
+        return True
+
+    def publish_jpeg(self, jpeg: bytes) -> bool:
+        """Shares an already-encoded JPEG (e.g. straight from an MJPEG camera) without re-encoding it."""
+        if self._subscribers == 0:
+            return False
+        self._store(mjpeg_part(jpeg))
+        return True
+
+    def _store(self, part: bytes) -> None:
+        with self._cond:
+            self._part = part
+            self._seq += 1
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Event loop already closed; the generator will clean itself up.
+                pass
+
+    def wait_for_part(self, last_seq: int, timeout: Optional[float] = None) -> tuple[int, Optional[bytes]]:
+        """Blocks until a part newer than last_seq exists. Returns (seq, part)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq, timeout=timeout)
+            return self._seq, self._part if self._seq > last_seq else None
+
+    def _min_interval(self, max_fps: Optional[float]) -> float:
+        return 1.0 / max_fps if max_fps and max_fps > 0 else 0.0
+
+    def stream(self, max_fps: Optional[float] = None) -> Iterator[bytes]:
+        """Blocking generator of MJPEG parts, capped at max_fps per client."""
+        min_interval = self._min_interval(max_fps)
+        last_seq = 0
+        last_sent = 0.0
+        with self._cond:
+            self._subscribers += 1
+        try:
+            while True:
+                seq, part = self.wait_for_part(last_seq, timeout=1.0)
+                if part is None:
+                    continue
+                delay = min_interval - (time.monotonic() - last_sent)
+                if delay > 0:
+                    time.sleep(delay)
+                    # Skip whatever arrived while we were throttled and send the freshest part.
+                    seq, part = self._seq, self._part
+                last_seq = seq
+                last_sent = time.monotonic()
+                yield part
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    async def astream(self, max_fps: Optional[float] = None) -> AsyncIterator[bytes]:
+        """Async generator of MJPEG parts; does not tie up a threadpool worker per viewer."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        min_interval = self._min_interval(max_fps)
+        last_seq = 0
+        last_sent = 0.0
+        with self._cond:
+            self._async_waiters.add(waiter)
+            self._subscribers += 1
+        try:
+            while True:
+                if self._seq <= last_seq:
+                    event.clear()
+                    # Re-check after clearing so a publish between the check and clear is not lost.
+                    if self._seq <= last_seq:
+                        await event.wait()
+                delay = min_interval - (loop.time() - last_sent)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                with self._cond:
+                    seq, part = self._seq, self._part
+                if part is None:
+                    continue
+                last_seq = seq
+                last_sent = loop.time()
+                yield part
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+                self._subscribers -= 1
@@ -0,0 +1,229 @@
+# gateway.py
+"""Asyncio gateway that reads many Arduino bins from one process.
+
+    python gateway.py --config gateway_config.json
+
+Each configured serial port is read concurrently and reconnects on its own;
+all readings go to the backend's batch endpoint over one shared HTTP client.
+"""
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+import serial_asyncio
+
+from telemetry import (BATCH_ENDPOINT, NDJSON_MEDIA_TYPE, TelemetrySpool, compute_fill_percentage,
+                       encode_ndjson, heartbeat_record, parse_arduino_line, status_record)
+
+
+# --- CONFIGURATION ---
+@dataclass
+class BinPortConfig:
+    port: str               # e.g. '/dev/ttyUSB0' or 'COM4'
+    bin_id: str
+    bin_height: float = 62  # cm from sensor to bottom when empty
+    baud_rate: int = 9600   # Must match the baud rate in the Arduino code
+
+
+@dataclass
+class GatewayConfig:
+    bins: list[BinPortConfig]
+    api_base_url: str = "http://localhost:8000"
+    heartbeat_interval: float = 10   # seconds
+    reconnect_delay: float = 2       # first retry delay after a port fails; doubles up to max_reconnect_delay
+    max_reconnect_delay: float = 60
+    batch_size: int = 100
+    flush_interval: float = 2
+    spool_path: str = "telemetry_spool.ndjson"
+    request_timeout: float = 5
+
+
+def load_config(path: str) -> GatewayConfig:
+    """Reads a JSON config: gateway settings plus a "bins" list mapping each port to a bin ID (and its height)."""
+    with open(path) as f:
+        raw = json.load(f)
+    bins = [BinPortConfig(**entry) for entry in raw.pop("bins", [])]
+    if not bins:
+        raise ValueError(f"{path}: no bins configured")
+    bin_ids = [entry.bin_id for entry in bins]
+    if len(set(bin_ids)) != len(bin_ids):
+        raise ValueError(f"{path}: duplicate bin_id")
+    return GatewayConfig(bins=bins, **raw)
+
+
+# --- ASYNC SENDER ---
+class AsyncTelemetrySender:
+    """Async counterpart of telemetry.TelemetrySender sharing one httpx.AsyncClient across all ports."""
+
+    def __init__(self, client: httpx.AsyncClient, api_base_url: str, max_batch: int = 100,
+                 flush_interval: float = 2, spool_path: str = "telemetry_spool.ndjson"):
+        self.client = client
+        self.url = api_base_url.rstrip("/") + BATCH_ENDPOINT
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.spool = TelemetrySpool(spool_path)
+        self._buffer: list[dict] = []
+        self._wakeup = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+
+    def add(self, record: dict) -> None:
+        self._buffer.append(record)
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _post(self, records: list[dict]) -> bool:
+        try:
+            response = await self.client.post(self.url, content=encode_ndjson(records), headers={"Content-Type": NDJSON_MEDIA_TYPE})
+        except httpx.TransportError as e:
+            print(f"Warning: Could not reach FastAPI server at {self.url}: {e!r}")
+            return False
+        if response.status_code >= 500:
+            print(f"Warning: Server error {response.status_code} when sending telemetry.")
+            return False
+        if response.status_code >= 400:
+            print(f"Warning: Telemetry batch rejected ({response.status_code}): {response.text}")
+        return True
+
+    async def _replay_spool(self) -> bool:
+        records = await asyncio.to_thread(self.spool.read)
+        for start in range(0, len(records), self.max_batch):
+            if not await self._post(records[start:start + self.max_batch]):
+                await asyncio.to_thread(self.spool.replace, records[start:])
+                return False
+        if records:
+            print(f"Replayed {len(records)} spooled readings.")
+            await asyncio.to_thread(self.spool.replace, [])
+        return True
+
+    async def flush(self) -> None:
+        async with self._send_lock:
+            records, self._buffer = self._buffer, []
+            unsent = 0 # records[unsent:] are neither delivered nor handed to the spool
+            try:
+                if self.spool.size() and not await self._replay_spool():
+                    unsent = len(records) # The thread finishes the append even if we are cancelled while it runs
+                    await asyncio.to_thread(self.spool.append, records)
+                    return
+                for start in range(0, len(records), self.max_batch):
+                    unsent = start
+                    if not await self._post(records[start:start + self.max_batch]):
+                        unsent = len(records)
+                        await asyncio.to_thread(self.spool.append, records[start:])
+                        return
+                unsent = len(records)
+            except asyncio.CancelledError:
+                # run_gateway cancels run() on shutdown; spool what was in flight so the next start sends it
+                self.spool.append(records[unsent:])
+                raise
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"An unexpected error occurred while sending telemetry: {e}")
+
+
+# --- PER-PORT READER ---
+class BinPortReader:
+    """Reads one serial port, turning each Arduino line into a status reading as soon as it arrives."""
+
+    def __init__(self, bin_config: BinPortConfig, sender: AsyncTelemetrySender, gateway_config: GatewayConfig):
+        self.bin = bin_config
+        self.sender = sender
+        self.gateway = gateway_config
+        self.connected = False
+
+    async def _open(self):
+        return await serial_asyncio.open_serial_connection(url=self.bin.port, baudrate=self.bin.baud_rate)
+
+    def handle_line(self, line: str) -> None:
+        print(f"[{self.bin.bin_id}] Arduino says: {line}")
+        parsed = parse_arduino_line(line)
+        if not parsed:
+            print(f"[{self.bin.bin_id}] Warning: Could not parse Arduino line: {line}")
+            return
+        distance_cm, status_text = parsed
+        fill_percentage = compute_fill_percentage(distance_cm, self.bin.bin_height)
+        self.sender.add(status_record(self.bin.bin_id, distance_cm, fill_percentage, status_text))
+
+    async def run(self) -> None:
+        delay = self.gateway.reconnect_delay
+        while True:
+            try:
+                reader, writer = await self._open()
+            except Exception as e:
+                print(f"[{self.bin.bin_id}] Could not connect to Arduino on {self.bin.port}: {e}. Retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.gateway.max_reconnect_delay)
+                continue
+            print(f"[{self.bin.bin_id}] Connected to Arduino on {self.bin.port}. Listening...")
+            self.connected = True
+            delay = self.gateway.reconnect_delay
+            try:
+                while True:
+                    raw = await reader.readline()
+                    if not raw:
+                        raise ConnectionError("serial port closed")
+                    line = raw.decode(errors="replace").strip()
+                    if line:
+                        self.handle_line(line)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{self.bin.bin_id}] Lost connection to {self.bin.port}: {e}")
+            finally:
+                self.connected = False
+                writer.close()
+            await asyncio.sleep(delay)
+
+
+async def send_heartbeats(readers: list[BinPortReader], sender: AsyncTelemetrySender, interval: float) -> None:
+    # Only bins whose serial link is up are reported alive
+    while True:
+        timestamp = int(time.time())
+        for reader in readers:
+            if reader.connected:
+                sender.add(heartbeat_record(reader.bin.bin_id, timestamp))
+        await asyncio.sleep(interval)
+
+
+async def run_gateway(config: GatewayConfig, stop: Optional[asyncio.Event] = None) -> None:
+    stop = stop or asyncio.Event()
+    async with httpx.AsyncClient(timeout=config.request_timeout) as client:
+        sender = AsyncTelemetrySender(client, config.api_base_url, config.batch_size, config.flush_interval, config.spool_path)
+        readers = [BinPortReader(bin_config, sender, config) for bin_config in config.bins]
+        tasks = [asyncio.create_task(reader.run()) for reader in readers]
+        tasks.append(asyncio.create_task(send_heartbeats(readers, sender, config.heartbeat_interval)))
+        tasks.append(asyncio.create_task(sender.run()))
+        print(f"Gateway serving {len(readers)} bins: {', '.join(f'{r.bin.bin_id}@{r.bin.port}' for r in readers)}")
+        try:
+            await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await sender.flush() # Send (or spool) whatever is still buffered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-bin asyncio gateway for TrashNet Eco-Hub.")
+    parser.add_argument('--config', required=True, help='Path to the JSON config mapping serial ports to bin IDs.')
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_gateway(load_config(args.config)))
+    except KeyboardInterrupt:
+        print("\nGateway stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# gemini_client.py
+import asyncio
+import inspect
+import random
+import threading
+import time
+from typing import AsyncIterator, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+import metrics
+from log import get_logger
+
+logger = get_logger("gemini")
+CALL_SECONDS = metrics.histogram("gemini_call_duration_seconds",
+                                 "Gemini call latency per attempt (for streams, until the first chunk).", ("model", "call", "outcome"))
+RETRIES = metrics.counter("gemini_retries_total", "Gemini calls retried after a retryable failure.", ("model", "call"))
+
+# Errors worth another attempt: rate limits, overloaded or flaky backend, and our own timeouts
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    ConnectionError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+def _outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    return "cancelled" if isinstance(error, asyncio.CancelledError) else "error"
+
+
+async def _timed(call, model_name: str):
+    start, error = time.perf_counter(), None
+    try:
+        return await call
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        CALL_SECONDS.labels(model_name, "generate", _outcome(error)).observe(time.perf_counter() - start)
+
+
+async def _close_stream(response, chunks) -> None:
+    """Closes a stream's chunk iterator and response, so an abandoned stream frees its connection now rather than at GC."""
+    for close in (getattr(chunks, "aclose", None), getattr(response, "aclose", None) or getattr(response, "close", None)):
+        if close is None:
+            continue
+        try:
+            closed = close()
+            if inspect.isawaitable(closed):
+                await closed
+        except Exception as e:
+            logger.debug(f"Ignoring error while closing a Gemini stream: {e!r}")
+
+
+def chunk_text(chunk) -> str:
+    """Text of one streamed chunk; chunks without text parts (e.g. only safety ratings) give ''."""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+class GeminiClient:
+    """Shared async access to Gemini for every endpoint.
+
+    - One GenerativeModel per model name, reused across requests (and with it the underlying gRPC channel).
+    - A semaphore caps in-flight calls so a burst cannot exhaust quota or sockets.
+    - Each attempt has its own timeout; retryable failures back off with full jitter.
+    - google.generativeai (most of a second to import) is only loaded, and
+      configured with `api_key` if one is given, when the first model is needed.
+    """
+
+    def __init__(self, max_concurrency: int = 8, timeout: float = 20.0, max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, api_key: Optional[str] = None):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._models: dict = {} # Model name -> genai.GenerativeModel
+        self._models_lock = threading.Lock()
+
+    def model(self, model_name: str):
+        model = self._models.get(model_name)
+        if model is None:
+            with self._models_lock:
+                model = self._models.get(model_name)
+                if model is None:
+                    import google.generativeai as genai
+                    if self.api_key is not None and not self._models:
+                        genai.configure(api_key=self.api_key)
+                    model = self._models[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def generate(self, contents, model_name: str, timeout: Optional[float] = None, **kwargs):
+        """Awaitable generate_content with concurrency cap, per-attempt timeout and jittered retries."""
+        model = self.model(model_name)
+        timeout = self.timeout if timeout is None else timeout
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    return await _timed(asyncio.wait_for(model.generate_content_async(contents, **kwargs), timeout), model_name)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                RETRIES.labels(model_name, "generate").inc()
+                logger.warning(f"Gemini call to {model_name} failed ({type(e).__name__}: {e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def stream(self, contents, model_name: str, timeout: Optional[float] = None, **kwargs) -> AsyncIterator[str]:
+        """Yields text chunks as Gemini generates them.
+
+        Failures before the first chunk are retried like generate(); once text
+        has been yielded a retry would repeat it, so later errors propagate.
+        `timeout` bounds the wait for each chunk. The concurrency slot is held
+        until the stream ends or the consumer stops iterating (e.g. the client
+        disconnected and the generator was closed); either way the response
+        is closed before the slot is released.
+        """
+        model = self.model(model_name)
+        timeout = self.timeout if timeout is None else timeout
+        attempt = 0
+        while True:
+            await self._semaphore.acquire()
+            start = time.perf_counter()
+            response = chunks = None
+            try:
+                response = await asyncio.wait_for(model.generate_content_async(contents, stream=True, **kwargs), timeout)
+                chunks = response.__aiter__()
+                first = await asyncio.wait_for(chunks.__anext__(), timeout)
+                CALL_SECONDS.labels(model_name, "stream", "ok").observe(time.perf_counter() - start)
+                break
+            except StopAsyncIteration:
+                CALL_SECONDS.labels(model_name, "stream", "ok").observe(time.perf_counter() - start)
+                await self._release_stream(response, chunks)
+                return
+            except RETRYABLE_ERRORS as e:
+                CALL_SECONDS.labels(model_name, "stream", _outcome(e)).observe(time.perf_counter() - start)
+                await self._release_stream(response, chunks)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                RETRIES.labels(model_name, "stream").inc()
+                logger.warning(f"Gemini stream from {model_name} failed ({type(e).__name__}: {e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            except BaseException as e:
+                CALL_SECONDS.labels(model_name, "stream", _outcome(e)).observe(time.perf_counter() - start)
+                await self._release_stream(response, chunks)
+                raise
+        try:
+            chunk = first
+            while True:
+                text = chunk_text(chunk)
+                if text:
+                    yield text
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return
+        finally:
+            await self._release_stream(response, chunks)
+
+    async def _release_stream(self, response, chunks) -> None:
+        try:
+            await _close_stream(response, chunks)
+        finally:
+            self._semaphore.release()
+
+    def generate_sync(self, contents, model_name: str, **kwargs):
+        """Blocking call for scripts and worker threads; shares the pooled model but not the async limits."""
+        return self.model(model_name).generate_content(contents, request_options={"timeout": self.timeout}, **kwargs)
@@ -0,0 +1,195 @@
+# geoindex.py
+import heapq
+import math
+import threading
+from typing import Optional
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+FANOUT = 4 # Each level's cells are FANOUT x FANOUT cells of the level below
+
+
+def haversine_km(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Great-circle distances in km from one point to each of the given points."""
+    lat1, lat2 = math.radians(lat), np.radians(lats)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((np.radians(lngs) - math.radians(lng)) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _distance_km(lat1: float, lat2: float, dlng: float) -> float:
+    a = math.sin(math.radians(lat2 - lat1) / 2) ** 2 + \
+        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(math.radians(dlng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def rect_distance_km(lat: float, lng: float, lat0: float, lat1: float, lng0: float, lng1: float) -> float:
+    """Shortest great-circle distance in km from a point to a lat/lng rectangle."""
+    if lng0 <= lng <= lng1:
+        dlng = 0.0
+    else:
+        dlng = min((lng0 - lng) % 360, (lng - lng1) % 360)
+    if dlng == 0.0:
+        if lat < lat0:
+            return (lat0 - lat) * KM_PER_DEGREE
+        return max(0.0, lat - lat1) * KM_PER_DEGREE
+    if dlng >= 90:
+        # The nearest point of the edge meridian is one of its ends
+        return min(_distance_km(lat, lat0, dlng), _distance_km(lat, lat1, dlng))
+    # Foot of the perpendicular onto the edge meridian, clamped to the rectangle
+    foot = math.degrees(math.atan2(math.tan(math.radians(lat)), math.cos(math.radians(dlng))))
+    return _distance_km(lat, min(lat1, max(lat0, foot)), dlng)
+
+
+class _Cell:
+    """Bins in one leaf cell, as growable arrays so a query measures them all in one NumPy call."""
+
+    def __init__(self):
+        self.ids: list[str] = []
+        self.coords = np.empty((4, 2), dtype=np.float64)
+        self.available = np.empty(4, dtype=bool)
+
+    def add(self, bin_id: str, lat: float, lng: float, available: bool) -> int:
+        slot = len(self.ids)
+        if slot == len(self.available):
+            self.coords = np.concatenate((self.coords, np.empty_like(self.coords)))
+            self.available = np.concatenate((self.available, np.empty_like(self.available)))
+        self.ids.append(bin_id)
+        self.coords[slot] = (lat, lng)
+        self.available[slot] = available
+        return slot
+
+    def remove(self, slot: int) -> Optional[str]:
+        """Removes a slot by moving the last bin into it. Returns the moved bin's ID, if any."""
+        last = len(self.ids) - 1
+        moved = None
+        if slot != last:
+            moved = self.ids[slot] = self.ids[last]
+            self.coords[slot] = self.coords[last]
+            self.available[slot] = self.available[last]
+        self.ids.pop()
+        return moved
+
+
+class GeoGrid:
+    """Bins on a lat/lng grid pyramid for nearest-bin queries, maintained incrementally.
+
+    Leaf cells are `cell_degrees` wide and hold the bins; every coarser level
+    groups 4x4 cells of the one below, up to a single cell for the globe, and
+    only counts bins (all, and available). update() touches one cell per
+    level. nearest() is a best-first search: cells are opened in order of
+    their shortest possible distance to the query, and the search ends once
+    that exceeds the k-th best bin found, so only cells near the answer are
+    visited whatever the fleet size or density.
+    """
+
+    def __init__(self, cell_degrees: float = 0.01):
+        self.cell_degrees = cell_degrees
+        self._columns = max(1, round(360 / cell_degrees))
+        self._rows = math.ceil(180 / cell_degrees)
+        self._depth = 0
+        while cell_degrees * FANOUT ** self._depth < 360:
+            self._depth += 1
+        self._lock = threading.Lock()
+        self._leaves: dict[tuple[int, int], _Cell] = {}
+        self._counts: list[dict[tuple[int, int], list[int]]] = [{} for _ in range(self._depth + 1)] # Per level: key -> [bins, available]
+        self._where: dict[str, tuple[float, float, tuple[int, int], int]] = {} # Bin ID -> (lat, lng, leaf key, slot)
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def _leaf_key(self, lat: float, lng: float) -> tuple[int, int]:
+        row = min(self._rows - 1, max(0, int((lat + 90) // self.cell_degrees)))
+        return row, int((lng + 180) // self.cell_degrees) % self._columns
+
+    def _count(self, key: tuple[int, int], bins: int, available: int) -> None:
+        row, column = key
+        for level in range(self._depth + 1):
+            level_key = (row // FANOUT ** level, column // FANOUT ** level)
+            counts = self._counts[level].get(level_key)
+            if counts is None:
+                counts = self._counts[level][level_key] = [0, 0]
+            counts[0] += bins
+            counts[1] += available
+            if counts[0] == 0:
+                del self._counts[level][level_key]
+
+    def _remove(self, bin_id: str) -> None:
+        _, _, key, slot = self._where.pop(bin_id)
+        cell = self._leaves[key]
+        self._count(key, -1, -int(cell.available[slot]))
+        moved = cell.remove(slot)
+        if moved is not None:
+            self._where[moved] = self._where[moved][:3] + (slot,)
+        if not cell.ids:
+            del self._leaves[key]
+
+    def update(self, bin_id: str, lat: float, lng: float, available: bool = True) -> None:
+        with self._lock:
+            where = self._where.get(bin_id)
+            if where is not None:
+                if where[:2] == (lat, lng):
+                    cell, slot = self._leaves[where[2]], where[3]
+                    if cell.available[slot] != available:
+                        cell.available[slot] = available
+                        self._count(where[2], 0, 1 if available else -1)
+                    return
+                self._remove(bin_id)
+            key = self._leaf_key(lat, lng)
+            cell = self._leaves.get(key)
+            if cell is None:
+                cell = self._leaves[key] = _Cell()
+            self._where[bin_id] = (lat, lng, key, cell.add(bin_id, lat, lng, available))
+            self._count(key, 1, int(available))
+
+    def remove(self, bin_id: str) -> None:
+        with self._lock:
+            if bin_id in self._where:
+                self._remove(bin_id)
+
+    def _cell_distance(self, lat: float, lng: float, level: int, key: tuple[int, int]) -> float:
+        size = self.cell_degrees * FANOUT ** level
+        lat0, lng0 = -90 + key[0] * size, -180 + key[1] * size
+        return rect_distance_km(lat, lng, lat0, min(90.0, lat0 + size), lng0, min(180.0, lng0 + size))
+
+    def nearest(self, lat: float, lng: float, k: int, available_only: bool = False,
+                max_km: Optional[float] = None) -> list[tuple[str, float]]:
+        """Up to k (bin ID, distance km) pairs, closest first."""
+        if k <= 0:
+            return []
+        limit = math.inf if max_km is None else max_km
+        best: list[tuple[float, str]] = [] # Max-heap (negated distances) of the k closest so far
+        with self._lock:
+            queue = [(0.0, self._depth, (0, 0))]
+            while queue:
+                distance, level, key = heapq.heappop(queue)
+                if distance > limit:
+                    break
+                if level == 0:
+                    cell = self._leaves[key]
+                    size = len(cell.ids)
+                    distances = haversine_km(lat, lng, cell.coords[:size, 0], cell.coords[:size, 1])
+                    candidates = np.flatnonzero(distances <= limit)
+                    if available_only:
+                        candidates = candidates[cell.available[:size][candidates]]
+                    if len(candidates) > k:
+                        candidates = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+                    for i in candidates.tolist():
+                        if len(best) < k:
+                            heapq.heappush(best, (-distances[i], cell.ids[i]))
+                        elif distances[i] < -best[0][0]:
+                            heapq.heapreplace(best, (-distances[i], cell.ids[i]))
+                    if len(best) == k:
+                        limit = min(limit, -best[0][0])
+                    continue
+                child_counts = self._counts[level - 1]
+                for row in range(key[0] * FANOUT, key[0] * FANOUT + FANOUT):
+                    for column in range(key[1] * FANOUT, key[1] * FANOUT + FANOUT):
+                        counts = child_counts.get((row, column))
+                        if counts is None or (available_only and not counts[1]):
+                            continue
+                        child_distance = self._cell_distance(lat, lng, level - 1, (row, column))
+                        if child_distance <= limit:
+                            heapq.heappush(queue, (child_distance, level - 1, (row, column)))
+        return [(bin_id, float(-distance)) for distance, bin_id in sorted(best, reverse=True)]
@@ -0,0 +1,93 @@
+# jpeg.py
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+import metrics
+from log import get_logger
+
+try:
+    from turbojpeg import TurboJPEG
+except ImportError: # Optional: pip install PyTurboJPEG (needs the libjpeg-turbo shared library)
+    TurboJPEG = None
+
+logger = get_logger("jpeg")
+ENCODE_SECONDS = metrics.histogram("jpeg_encode_seconds", "Time to encode one image as JPEG.", ("backend",))
+DECODE_SECONDS = metrics.histogram("jpeg_decode_seconds", "Time to decode one JPEG.", ("backend",))
+
+
+class JpegCodec:
+    """JPEG encode/decode through libjpeg-turbo's TurboJPEG API when available, OpenCV otherwise.
+
+    PyTurboJPEG skips OpenCV's generic codec layer and is noticeably cheaper on
+    small ARM boards. A failing turbo call falls back to OpenCV for that frame;
+    after `max_failures` failures in a row the turbo path is switched off.
+    """
+
+    def __init__(self, prefer_turbo: bool = True, max_failures: int = 3):
+        self.max_failures = max_failures
+        self._failures = 0
+        self._turbo = None
+        if prefer_turbo and TurboJPEG is not None:
+            try:
+                self._turbo = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                logger.warning(f"libjpeg-turbo not usable ({e}); using OpenCV for JPEG.")
+
+    @property
+    def backend(self) -> str:
+        return "turbojpeg" if self._turbo is not None else "opencv"
+
+    def _turbo_failed(self, e: Exception) -> None:
+        self._failures += 1
+        if self._failures >= self.max_failures:
+            logger.warning(f"TurboJPEG failed {self._failures} times in a row ({e}); switching to OpenCV for JPEG.")
+            self._turbo = None
+
+    def encode(self, image: np.ndarray, quality: int = 95) -> bytes:
+        """Encodes a BGR (or grayscale) image. Raises ValueError if neither backend can."""
+        turbo = self._turbo
+        start = time.perf_counter()
+        if turbo is not None:
+            try:
+                data = turbo.encode(np.ascontiguousarray(image), quality=quality)
+                self._failures = 0
+                ENCODE_SECONDS.labels("turbojpeg").observe(time.perf_counter() - start)
+                return data
+            except Exception as e:
+                self._turbo_failed(e)
+        ret, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ret:
+            raise ValueError("Could not encode image as JPEG")
+        ENCODE_SECONDS.labels("opencv").observe(time.perf_counter() - start)
+        return jpeg.tobytes()
+
+    def decode(self, data: bytes) -> Optional[np.ndarray]:
+        """Decodes to BGR, or returns None if the data is not a decodable JPEG. EXIF orientation is not applied."""
+        turbo = self._turbo
+        turbo_error = None
+        start = time.perf_counter()
+        if turbo is not None:
+            try:
+                image = turbo.decode(data)
+                self._failures = 0
+                DECODE_SECONDS.labels("turbojpeg").observe(time.perf_counter() - start)
+                return image
+            except Exception as e:
+                turbo_error = e
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        DECODE_SECONDS.labels("opencv").observe(time.perf_counter() - start)
+        if turbo_error is not None and image is not None:
+            # Only count it against turbo if OpenCV could read the same data (a corrupt frame fails both)
+            self._turbo_failed(turbo_error)
+        return image
+
+
+# Shared by every encode site (video feed, Gemini payloads, upload re-encoding)
+default_codec = JpegCodec()
+
+
+def encode_jpeg(image: np.ndarray, quality: int = 95) -> bytes:
+    return default_codec.encode(image, quality)
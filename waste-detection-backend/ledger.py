@@ -0,0 +1,294 @@
+# ledger.py
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable, Optional
+
+import metrics
+from log import get_logger
+
+logger = get_logger("ledger")
+COMMIT_SECONDS = metrics.histogram("ledger_commit_seconds", "Time to write and fsync one group commit.")
+COMMIT_RECORDS = metrics.histogram("ledger_commit_records", "Records written per group commit.",
+                                   buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+
+
+class LedgerClosed(RuntimeError):
+    pass
+
+
+class ApplyFailed(RuntimeError):
+    """apply() raised for a record that is already on disk; the original error is the __cause__."""
+
+
+def encode_record(seq: int, key: Optional[str], data: dict) -> bytes:
+    """One log line: CRC-32 of the JSON payload, a space, the payload."""
+    payload = json.dumps({"seq": seq, "key": key, "data": data}, separators=(",", ":")).encode()
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def decode_record(line: bytes) -> Optional[dict]:
+    """The record in a log line, or None if the line is torn or corrupt."""
+    if len(line) < 10 or not line.endswith(b"\n") or line[8:9] != b" ":
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def _follow(original: Future) -> Future:
+    """A future that completes (with None) when `original` does, failing if it fails."""
+    follower: Future = Future()
+
+    def done(f: Future) -> None:
+        if f.exception() is not None:
+            follower.set_exception(f.exception())
+        else:
+            follower.set_result(None)
+
+    original.add_done_callback(done)
+    return follower
+
+
+class _Pending:
+    __slots__ = ("seq", "key", "data", "future")
+
+    def __init__(self, seq: int, key: Optional[str], data: dict):
+        self.seq = seq
+        self.key = key
+        self.data = data
+        self.future: Future = Future()
+
+
+class Ledger:
+    """Append-only, fsynced log in front of a state-changing `apply` callback.
+
+    append() assigns the next sequence number and queues the record; one
+    writer thread drains the queue, writes everything waiting as a single
+    group commit (one write, one fsync) and only then calls apply(seq, key, data)
+    for each record in sequence order. The caller's future resolves with
+    apply's result, so an acknowledged record is on disk and every change
+    is applied in one total order. If apply raises, the future fails with
+    ApplyFailed and the record's key is not remembered, so a retry with the
+    same key is appended and applied afresh (the failed record is then
+    skipped on replay, being older than the retry's).
+
+    Records may carry an idempotency key: a key seen before (completed, in
+    flight, or passed in `known_keys`) is not appended again, and the caller
+    gets the original sequence number instead. Only the last `max_keys` keys
+    are kept in memory; once older ones have been dropped, a key missing from
+    memory is looked up through `find_key` (key -> seq or None) before it is
+    treated as new. On startup, records after
+    `applied_through` are replayed through apply. Once the log grows past
+    `max_log_bytes`, `checkpoint` is called to persist everything applied so
+    far, and the log is emptied.
+    """
+
+    def __init__(self, path: str, apply: Callable[[int, Optional[str], dict], Any], applied_through: int = 0,
+                 known_keys: Iterable[tuple[str, int]] = (), checkpoint: Optional[Callable[[], None]] = None,
+                 max_keys: int = 100_000, max_log_bytes: int = 64 * 1024 * 1024,
+                 find_key: Optional[Callable[[str], Optional[int]]] = None):
+        self.path = path
+        self.apply = apply
+        self.checkpoint = checkpoint
+        self.max_keys = max_keys
+        self.max_log_bytes = max_log_bytes
+        self.find_key = find_key
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._queue: deque[_Pending] = deque()
+        self._keys: OrderedDict[str, int] = OrderedDict()  # Idempotency key -> seq, oldest first
+        self._inflight: dict[str, _Pending] = {}
+        self._keys_complete = True # False once a key has been dropped from the window
+        self._closed = False
+        self.appended = 0
+        self.duplicates = 0
+        self.commits = 0
+        for key, seq in known_keys:
+            self._remember(key, seq)
+        self._next_seq = max(applied_through, self._replay(applied_through)) + 1
+        self._file = open(path, "ab")
+        self._writer = threading.Thread(target=self._writer_loop, name="ledger-writer", daemon=True)
+        self._writer.start()
+
+    def _remember(self, key: str, seq: int) -> None:
+        self._keys[key] = seq
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+            self._keys_complete = False
+        if len(self._keys) == self.max_keys:
+            self._keys_complete = False # A full window loaded on startup may not hold every key either
+
+    def _replay(self, applied_through: int) -> int:
+        """Applies logged records newer than applied_through. Returns the last sequence number in the log."""
+        last_seq = 0
+        replayed = 0
+        valid_bytes = 0
+        try:
+            with open(self.path, "rb") as log:
+                for line in log:
+                    record = decode_record(line)
+                    if record is None:
+                        break # Torn tail from a crash mid-write; nothing after it was acknowledged
+                    valid_bytes += len(line)
+                    seq, key = record["seq"], record["key"]
+                    last_seq = seq
+                    if seq <= applied_through or (key is not None and key in self._keys):
+                        continue
+                    self.apply(seq, key, record["data"])
+                    if key is not None:
+                        self._remember(key, seq)
+                    replayed += 1
+        except FileNotFoundError:
+            return 0
+        if valid_bytes < os.path.getsize(self.path):
+            logger.warning(f"Ledger {self.path}: dropping {os.path.getsize(self.path) - valid_bytes} bytes of incomplete records at the end.")
+            with open(self.path, "r+b") as log:
+                log.truncate(valid_bytes)
+                os.fsync(log.fileno())
+        if replayed:
+            logger.info(f"Ledger {self.path}: replayed {replayed} records.")
+        return last_seq
+
+    def append(self, data: dict, key: Optional[str] = None) -> tuple[int, "Future", bool]:
+        """Queues a record. Returns (seq, future of apply's result, duplicate).
+
+        For a duplicate key the original seq is returned with a future that
+        resolves once the original record has been applied (its result is None).
+        """
+        with self._lock:
+            if self._closed:
+                raise LedgerClosed("Ledger is closed")
+            duplicate = self._duplicate(key)
+            if duplicate is not None:
+                return duplicate
+            if key is None or self.find_key is None or self._keys_complete:
+                return self._enqueue(data, key)
+        # Outside the lock: a storage read must not stall other appends or the writer
+        stored_seq = self.find_key(key)
+        with self._lock:
+            if self._closed:
+                raise LedgerClosed("Ledger is closed")
+            duplicate = self._duplicate(key) # Another request may have appended it meanwhile
+            if duplicate is not None:
+                return duplicate
+            if stored_seq is not None:
+                self._remember(key, stored_seq)
+                return self._duplicate(key)
+            return self._enqueue(data, key)
+
+    def _enqueue(self, data: dict, key: Optional[str]) -> tuple[int, Future, bool]:
+        # Called with the lock held
+        pending = _Pending(self._next_seq, key, data)
+        self._next_seq += 1
+        self._queue.append(pending)
+        if key is not None:
+            self._inflight[key] = pending
+        self._wakeup.notify()
+        return pending.seq, pending.future, False
+
+    def _duplicate(self, key: Optional[str]) -> Optional[tuple[int, Future, bool]]:
+        # Called with the lock held
+        if key is None:
+            return None
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.duplicates += 1
+            return pending.seq, _follow(pending.future), True
+        seq = self._keys.get(key)
+        if seq is not None:
+            self.duplicates += 1
+            done: Future = Future()
+            done.set_result(None)
+            return seq, done, True
+        return None
+
+    def _writer_loop(self) -> None:
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed:
+                    self._wakeup.wait()
+                if not self._queue:
+                    return # Closed and drained
+                batch = list(self._queue)
+                self._queue.clear()
+            self._commit(batch)
+
+    def _commit(self, batch: list[_Pending]) -> None:
+        offset = self._file.tell()
+        start = time.perf_counter()
+        try:
+            self._file.write(b"".join(encode_record(p.seq, p.key, p.data) for p in batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            logger.error(f"Ledger write failed ({e}); rejecting {len(batch)} records.")
+            try:
+                self._file.truncate(offset) # So a later replay cannot apply what the callers were told failed
+                self._file.seek(offset)
+            except OSError:
+                pass
+            with self._lock:
+                for pending in batch:
+                    if pending.key is not None:
+                        self._inflight.pop(pending.key, None)
+            for pending in batch:
+                pending.future.set_exception(e)
+            return
+        COMMIT_SECONDS.observe(time.perf_counter() - start)
+        COMMIT_RECORDS.observe(len(batch))
+        self.commits += 1
+        for pending in batch:
+            try:
+                result = self.apply(pending.seq, pending.key, pending.data)
+            except Exception as e:
+                logger.error(f"Ledger apply failed for record {pending.seq}: {e!r}")
+                result, error = None, ApplyFailed(f"Record {pending.seq} is logged but could not be applied")
+                error.__cause__ = e
+            else:
+                error = None
+            with self._lock:
+                self.appended += 1
+                if pending.key is not None:
+                    self._inflight.pop(pending.key, None)
+                    if error is None:
+                        self._remember(pending.key, pending.seq)
+            if error is not None:
+                pending.future.set_exception(error)
+            else:
+                pending.future.set_result(result)
+        if self.checkpoint is not None and self._file.tell() > self.max_log_bytes:
+            self._compact()
+
+    def _compact(self) -> None:
+        # Every record in the log has been applied (or its caller told it failed); once that state is
+        # durably persisted the log can start over. `checkpoint` must not return before it is on disk.
+        try:
+            self.checkpoint()
+            self._file.truncate(0)
+            self._file.seek(0)
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            logger.error(f"Ledger checkpoint failed ({e}); keeping the log.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"next_seq": self._next_seq, "appended": self.appended, "duplicates": self.duplicates, "commits": self.commits,
+                    "queued": len(self._queue), "log_bytes": self._file.tell()}
+
+    def close(self) -> None:
+        """Commits whatever is queued, then stops the writer."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join()
+        self._file.close()
@@ -0,0 +1,171 @@
+# liveness.py
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from log import get_logger
+
+logger = get_logger("liveness")
+
+
+class LivenessTracker:
+    """Online/offline state for every bin, driven by a hashed timer wheel of offline deadlines.
+
+    touch() is O(1): it only moves the bin's deadline forward. Each online
+    bin sits in exactly one wheel slot; when the slot comes round, bins whose
+    deadline has moved on are rescheduled and the rest go offline. A bin's
+    deadline is its last_seen plus its own timeout (or the default).
+    Transitions are reported through on_transition(bin_id, online, timestamp),
+    called outside the tracker's lock but strictly in the order they happened:
+    they are queued under the lock and delivered one at a time, so a slow
+    "offline" callback cannot land after the "online" that followed it.
+    """
+
+    def __init__(self, default_timeout: float = 30, tick_seconds: float = 1.0, slots: int = 512,
+                 on_transition: Optional[Callable[[str, bool, float], None]] = None):
+        self.default_timeout = default_timeout
+        self.tick_seconds = tick_seconds
+        self.on_transition = on_transition
+        self._slots: list[set[str]] = [set() for _ in range(slots)]
+        self._deadlines: dict[str, float] = {}
+        self._scheduled_tick: dict[str, int] = {}
+        self._timeouts: dict[str, float] = {}
+        self._offline: set[str] = set()
+        self._current_tick = self._tick(time.time())
+        self._lock = threading.Lock()
+        self._transitions: deque[tuple[str, bool, float]] = deque() # Not yet delivered, oldest first
+        self._delivering = threading.RLock() # Reentrant, so a callback may call touch()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.transitions = 0
+
+    def _tick(self, timestamp: float) -> int:
+        return int(timestamp // self.tick_seconds)
+
+    def _schedule(self, bin_id: str, deadline: float) -> None:
+        # Deadlines at or before the current tick fire on the next advance
+        tick = max(self._tick(deadline), self._current_tick + 1)
+        self._scheduled_tick[bin_id] = tick
+        self._slots[tick % len(self._slots)].add(bin_id)
+
+    def timeout_for(self, bin_id: str) -> float:
+        return self._timeouts.get(bin_id, self.default_timeout)
+
+    def set_timeout(self, bin_id: str, seconds: Optional[float]) -> None:
+        """Per-bin offline threshold; None reverts to the default. Applies to an online bin's current deadline too."""
+        with self._lock:
+            previous = self.timeout_for(bin_id)
+            if seconds is None:
+                self._timeouts.pop(bin_id, None)
+            else:
+                self._timeouts[bin_id] = seconds
+            deadline = self._deadlines.get(bin_id)
+            if deadline is not None:
+                deadline += self.timeout_for(bin_id) - previous
+                self._deadlines[bin_id] = deadline
+                if self._tick(deadline) < self._scheduled_tick[bin_id]:
+                    # Now due before its slot comes round: move it to an earlier slot
+                    self._slots[self._scheduled_tick[bin_id] % len(self._slots)].discard(bin_id)
+                    self._schedule(bin_id, deadline)
+
+    def is_online(self, bin_id: str) -> bool:
+        return bin_id in self._deadlines
+
+    def offline_bins(self) -> list[str]:
+        with self._lock:
+            return list(self._offline)
+
+    @property
+    def online_count(self) -> int:
+        return len(self._deadlines)
+
+    def touch(self, bin_id: str, last_seen: float) -> None:
+        """Records that the bin was seen at last_seen; brings it online if that is within its timeout."""
+        deadline = last_seen + self.timeout_for(bin_id)
+        with self._lock:
+            current = self._deadlines.get(bin_id)
+            if current is not None:
+                if deadline > current:
+                    self._deadlines[bin_id] = deadline # The wheel reschedules lazily when the old slot fires
+                return
+            if deadline <= time.time():
+                # A stale reading (e.g. replayed from a gateway spool) does not prove the bin is up now
+                self._offline.add(bin_id)
+                return
+            self._offline.discard(bin_id)
+            self._deadlines[bin_id] = deadline
+            self._schedule(bin_id, deadline)
+            self.transitions += 1
+            self._transitions.append((bin_id, True, last_seen))
+        self._deliver()
+
+    def forget(self, bin_id: str) -> None:
+        with self._lock:
+            self._deadlines.pop(bin_id, None)
+            self._offline.discard(bin_id)
+            tick = self._scheduled_tick.pop(bin_id, None)
+            if tick is not None:
+                self._slots[tick % len(self._slots)].discard(bin_id)
+
+    def advance(self, now: Optional[float] = None) -> list[str]:
+        """Expires every deadline up to now. Returns the bins that went offline."""
+        now = time.time() if now is None else now
+        target = self._tick(now)
+        expired = []
+        with self._lock:
+            # After a long stall, one full turn of the wheel visits every slot
+            start = max(self._current_tick + 1, target - len(self._slots) + 1)
+            for tick in range(start, target + 1):
+                slot = self._slots[tick % len(self._slots)]
+                if not slot:
+                    continue
+                due, slot_bins = [], list(slot)
+                slot.clear()
+                for bin_id in slot_bins:
+                    deadline = self._deadlines[bin_id]
+                    if deadline <= now:
+                        due.append(bin_id)
+                    else:
+                        self._current_tick = tick
+                        self._schedule(bin_id, deadline)
+                for bin_id in due:
+                    del self._deadlines[bin_id]
+                    del self._scheduled_tick[bin_id]
+                    self._offline.add(bin_id)
+                expired.extend(due)
+            self._current_tick = target
+            self.transitions += len(expired)
+            self._transitions.extend((bin_id, False, now) for bin_id in expired)
+        if expired:
+            self._deliver()
+        return expired
+
+    def _deliver(self) -> None:
+        # Whoever holds _delivering drains the queue; others wait, then find it empty (or drain what came after)
+        with self._delivering:
+            while True:
+                with self._lock:
+                    if not self._transitions:
+                        return
+                    bin_id, online, timestamp = self._transitions.popleft()
+                if self.on_transition:
+                    self.on_transition(bin_id, online, timestamp)
+
+    # --- Background ticking ---
+    def _run(self) -> None:
+        while not self._stopped.wait(self.tick_seconds):
+            try:
+                self.advance()
+            except Exception as e:
+                logger.exception(f"Liveness tracker error: {e}")
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="liveness-tracker", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.tick_seconds * 2)
@@ -0,0 +1,65 @@
+# log.py
+import atexit
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+ROOT_LOGGER = "trashnet"
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener thread; never blocks the caller, drops records if the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the listener thread; only fold the args in so the record is safe to hand over
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[_DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def _configure() -> None:
+    global _handler, _listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(_handler)
+    root.propagate = False
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop) # Writes out whatever is still queued
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger whose records are written to stdout by a background thread, so callers never wait on I/O.
+
+    The level comes from LOG_LEVEL (default INFO). Pass hot-path details at
+    debug level with %-style arguments so they cost next to nothing when off.
+    """
+    if _listener is None:
+        _configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def dropped_records() -> int:
+    """Records discarded because the queue was full (stdout could not keep up)."""
+    return _handler.dropped if _handler is not None else 0
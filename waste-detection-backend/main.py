@@ -1,26 +1,44 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Response, File, UploadFile
+from fastapi import FastAPI, HTTPException, Response, File, UploadFile, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import Dict, Union, List # Import List for recycled_items type hint
-import random
-import cv2
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, ValidationError
+from typing import Dict, Union, List, Optional # Import List for recycled_items type hint
 import threading
+import asyncio
+from concurrent.futures import TimeoutError as FuturesTimeout
 import numpy as np
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-import base64
 import json
 from datetime import datetime
 import time # Import time module for timestamps
+# Camera, classifier and Gemini modules (OpenCV, Gemini's SDK) are imported when their subsystem starts, see "Subsystems" below
+from storage import Storage
+from timeseries import FillHistory
+from events import EventHub, sse_message, sse_stream
+from upload_limit import UploadSizeLimit
+from liveness import LivenessTracker
+from chat_context import FleetContext
+from forecast import FillForecaster
+from routing import plan_route
+from geoindex import GeoGrid
+from ledger import ApplyFailed, Ledger, LedgerClosed
+import metrics
+from metrics import RequestMetrics
+from log import dropped_records, get_logger
 
 app = FastAPI()
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
+# Uploads are preprocessed before classification: bounded size in, bounded JPEG out
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_MAX_EDGE = int(os.getenv("UPLOAD_MAX_EDGE", "1024"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "85"))
+app.add_middleware(UploadSizeLimit, max_bytes=UPLOAD_MAX_BYTES, paths={"/classify-image"})
+# Added after UploadSizeLimit so it wraps it and the 413 carries CORS headers the browser can read
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -28,15 +46,47 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so rejected uploads are timed too
+app.add_middleware(RequestMetrics)
+logger = get_logger("main")
+
+# --- Subsystems ---
+# Which parts of the server run in this process; storage, credits and the bin/admin endpoints always do.
+# Scale the API out with ENABLE_CAMERA=0 workers next to the one process that owns the camera.
+ENABLE_CAMERA = os.getenv("ENABLE_CAMERA", "1") == "1"
+ENABLE_CLASSIFIER = os.getenv("ENABLE_CLASSIFIER", "1") == "1"
+ENABLE_CHAT = os.getenv("ENABLE_CHAT", "1") == "1"
+ENABLE_TELEMETRY = os.getenv("ENABLE_TELEMETRY", "1") == "1" # Bin status/heartbeat ingestion and offline detection
 
 # --- GLOBAL DATA STORES ---
-users = {
-    "user1": {"credits": 0, "recycled_items": []}
-}
+# Users, recycling events and bins persist in SQLite; writes are batched by a background thread
+storage = Storage(
+    os.getenv("TRASHNET_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "trashnet.db")),
+    flush_interval=float(os.getenv("STORAGE_FLUSH_INTERVAL", "0.05")),
+    flush_batch_size=int(os.getenv("STORAGE_FLUSH_BATCH_SIZE", "500")),
+)
+
+# Waste submissions go through an append-only, fsynced ledger before they touch credits,
+# so an acknowledged submission survives a crash and kiosk retries are applied once
+def apply_submission(seq: int, idempotency_key: Optional[str], record: dict) -> tuple[int, dict]:
+    return storage.record_event(record["user_id"], record["bin_id"], record["category"], record["item_name"], record["credits"],
+                                record["timestamp"], ledger_seq=seq, idempotency_key=idempotency_key)
+
+LEDGER_MAX_KEYS = int(os.getenv("CREDIT_LEDGER_MAX_KEYS", "100000"))
+LEDGER_ACK_TIMEOUT = float(os.getenv("CREDIT_LEDGER_ACK_TIMEOUT", "5"))
+credit_ledger = Ledger(
+    os.getenv("CREDIT_LEDGER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "credits.ledger")),
+    apply_submission,
+    applied_through=storage.last_ledger_seq(),
+    known_keys=storage.idempotency_keys(LEDGER_MAX_KEYS),
+    checkpoint=storage.checkpoint, # Flushed and fsynced before the log is truncated
+    max_keys=LEDGER_MAX_KEYS,
+    find_key=storage.ledger_seq_for_key, # Keys older than the in-memory window are looked up in the database
+)
 
-# Pre-populate bins data to match Admin.tsx mock data, will be updated by Arduino
+# Seed bins to match Admin.tsx mock data on first start, will be updated by Arduino
 # Added 'last_seen' for connection status and 'connection_status' itself
-bins_data: Dict[str, Dict[str, Union[str, int, float, bool]]] = {
+DEFAULT_BINS: Dict[str, Dict[str, Union[str, int, float, bool]]] = {
     "A01": {
         "id": 'A01',
         "name": 'Central Park Bin',
@@ -78,7 +128,70 @@ bins_data: Dict[str, Dict[str, Union[str, int, float, bool]]] = {
     },
 }
 
-CATEGORIES = ["plastic", "metal", "glass", "paper", "wood"]
+# Hot copy of bin state; every change is written through to storage
+bins_data: Dict[str, Dict[str, Union[str, int, float, bool]]] = storage.load_bins()
+if not bins_data:
+    bins_data = DEFAULT_BINS
+    for seeded_bin in bins_data.values():
+        storage.save_bin(seeded_bin)
+
+# Online/offline per bin: heartbeats and status updates push each bin's offline deadline forward
+bin_liveness = LivenessTracker(default_timeout=float(os.getenv("BIN_OFFLINE_THRESHOLD", "30")))
+for loaded_id, loaded_bin in bins_data.items():
+    if loaded_bin.get("offline_threshold") is not None:
+        bin_liveness.set_timeout(loaded_id, float(loaded_bin["offline_threshold"]))
+    bin_liveness.touch(loaded_id, int(loaded_bin.get("last_seen", 0)))
+    loaded_bin["connection_status"] = "online" if bin_liveness.is_online(loaded_id) else "offline"
+
+# Fleet summary and bin lookup for chat prompts, kept current as bins change
+fleet_context = FleetContext(
+    bins_data,
+    token_budget=int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "1500")),
+    top_n=int(os.getenv("CHAT_CONTEXT_TOP_N", "5")),
+)
+for loaded_bin in bins_data.values():
+    fleet_context.update(loaded_bin)
+
+# Spatial index of bin locations for /bins/nearest and location-aware chat answers
+bin_locations = GeoGrid(cell_degrees=float(os.getenv("GEO_INDEX_CELL_DEGREES", "0.01")))
+NEAREST_BINS_MAX_KM = float(os.getenv("NEAREST_BINS_MAX_KM", "25"))
+
+def index_bin_location(bin_info: dict) -> None:
+    if bin_info["lat"] == 0 and bin_info["lng"] == 0:
+        bin_locations.remove(bin_info["id"]) # Registered by telemetry without a known location
+        return
+    # Only bins that can take waste count as available (full ones and ones under maintenance cannot)
+    bin_locations.update(bin_info["id"], float(bin_info["lat"]), float(bin_info["lng"]), available=bin_info.get("status") not in ("full", "maintenance"))
+
+for loaded_bin in bins_data.values():
+    index_bin_location(loaded_bin)
+
+@app.on_event("startup")
+def start_liveness_tracker():
+    if ENABLE_TELEMETRY:
+        bin_liveness.start()
+
+@app.on_event("shutdown")
+def close_storage():
+    bin_liveness.close()
+    # Commit whatever is still pending before the process exits
+    credit_ledger.close()
+    storage.close()
+
+# Fill-level history per bin in fixed-size rings (raw readings plus minute/hour rollups)
+fill_history = FillHistory(raw_capacity=int(os.getenv("FILL_HISTORY_RAW_POINTS", "600")))
+# Pushes bin changes to /admin/bins-events subscribers
+bin_events = EventHub(max_queue=int(os.getenv("BIN_EVENTS_MAX_QUEUE", "256")))
+# Incremental fill-rate fit per bin, used to predict when each bin will be full
+fill_forecaster = FillForecaster(
+    half_life_seconds=float(os.getenv("FORECAST_HALF_LIFE_SECONDS", "21600")),
+    full_threshold=float(os.getenv("FORECAST_FULL_THRESHOLD", "90")),
+)
+# Collection route planning (/admin/collection-route)
+ROUTE_FILL_THRESHOLD = float(os.getenv("ROUTE_FILL_THRESHOLD", "80"))
+ROUTE_HORIZON_HOURS = float(os.getenv("ROUTE_HORIZON_HOURS", "4"))
+ROUTE_TIME_BUDGET_MS = int(os.getenv("ROUTE_TIME_BUDGET_MS", "500"))
+ROUTE_DEPOT = (float(os.getenv("ROUTE_DEPOT_LAT")), float(os.getenv("ROUTE_DEPOT_LNG"))) if os.getenv("ROUTE_DEPOT_LAT") and os.getenv("ROUTE_DEPOT_LNG") else None
 
 CREDIT_VALUES = {
     "plastic": 10,
@@ -89,21 +202,179 @@ CREDIT_VALUES = {
     "unknown": 0
 }
 
-cap = cv2.VideoCapture(0)
-frame_lock = threading.Lock()
-latest_frame = None
+GEMINI_CHAT_MODEL = os.getenv("GEMINI_CHAT_MODEL", "gemini-2.0-flash")
+VIDEO_FEED_MAX_FPS = float(os.getenv("VIDEO_FEED_MAX_FPS", "15"))
+DETECT_FRAME_TIMEOUT = 1.0 # seconds to wait for a fresh frame in detect-waste
+AUTO_DETECT_ENABLED = os.getenv("AUTO_DETECT", "1") == "1"
+
+# --- Camera, classifier and Gemini ---
+# Built by the startup hook below, never on import; each stays None while its subsystem is off
+gemini_client = None        # GeminiClient
+classification_cache = None # PerceptualCache
+waste_classifier = None     # CascadeClassifier
+classify_batcher = None     # MicroBatcher
+camera = None               # Camera
+frame_ring = None           # FrameRing
+video_broadcaster = None    # FrameBroadcaster
+motion_gate = None          # MotionGate
+camera_lock = None          # Lock file held while this process owns the camera
+capture_stopped = threading.Event()
+capture_threads: list[threading.Thread] = []
+
+def require(available: bool, subsystem: str) -> None:
+    if not available:
+        raise HTTPException(status_code=503, detail=f"The {subsystem} is not enabled on this server")
+
+def start_classifier() -> None:
+    global classification_cache, waste_classifier, classify_batcher
+    from result_cache import PerceptualCache
+    from classifier import CascadeClassifier, GeminiClassifier, load_local_classifier
+    from batcher import MicroBatcher
+    # Repeat scans of the same item reuse the earlier Gemini result instead of making a new call
+    classification_cache = PerceptualCache(
+        max_size=int(os.getenv("CLASSIFY_CACHE_SIZE", "256")),
+        ttl_seconds=float(os.getenv("CLASSIFY_CACHE_TTL", "300")),
+        max_distance=int(os.getenv("CLASSIFY_CACHE_MAX_DISTANCE", "6")),
+    )
+    # Local CPU model answers first; Gemini is only asked when the local engine is unsure or absent
+    waste_classifier = CascadeClassifier(
+        remote=GeminiClassifier(gemini_client, model_name=os.getenv("GEMINI_VISION_MODEL", "gemini-2.0-flash")),
+        local=load_local_classifier(
+            os.getenv("LOCAL_CLASSIFIER_MODEL"),
+            input_size=int(os.getenv("LOCAL_CLASSIFIER_INPUT_SIZE", "224")),
+            num_workers=int(os.getenv("LOCAL_CLASSIFIER_WORKERS", "2")),
+        ),
+        threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.8")),
+    )
+    # Concurrent classifications are coalesced into one local batch / one multi-image Gemini prompt
+    classify_batcher = MicroBatcher(
+        waste_classifier.aclassify_batch,
+        max_batch_size=int(os.getenv("CLASSIFY_BATCH_MAX_SIZE", "8")),
+        max_wait_ms=float(os.getenv("CLASSIFY_BATCH_WINDOW_MS", "10")),
+    )
+    metrics.counter("classification_cache_hits_total", "Classification cache lookups that found a result.", function=lambda: classification_cache.hits)
+    metrics.counter("classification_cache_misses_total", "Classification cache lookups that did not.", function=lambda: classification_cache.misses)
+    metrics.gauge("classification_cache_hit_ratio", "Hits over all lookups since startup.", function=lambda: classification_cache.stats()["hit_rate"])
+    metrics.gauge("classification_cache_entries", "Results in the classification cache.", function=lambda: classification_cache.stats()["size"])
+    metrics.gauge("classify_batch_queue_depth", "Classifications waiting to be batched.", function=lambda: classify_batcher.queue_depth)
+    metrics.counter("classify_batches_total", "Classification batches run.", function=lambda: classify_batcher.batches)
+    metrics.counter("classify_batch_items_total", "Items classified in batches.", function=lambda: classify_batcher.items)
 
 def grab_frames():
-    global latest_frame
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    # In MJPEG passthrough the camera's own JPEGs go straight to the video feed; returns after camera.stop()
+    camera.run(frame_ring, on_jpeg=video_broadcaster.publish_jpeg)
+
+VIDEO_FRAMES_SKIPPED = metrics.counter("video_frames_skipped_total", "Captured frames the video feed encoder skipped because it was busy.")
+
+def encode_frames():
+    # Runs apart from grab_frames so JPEG encoding never delays capture
+    last_seq = 0
+    while not capture_stopped.is_set():
+        frame = frame_ring.wait_newer(last_seq, timeout=1.0)
+        if frame is None:
+            continue
+        if last_seq and frame.seq > last_seq + 1 and not camera.passthrough_active:
+            VIDEO_FRAMES_SKIPPED.inc(frame.seq - last_seq - 1)
+        last_seq = frame.seq
+        if not camera.passthrough_active:
+            video_broadcaster.publish(frame.image)
+
+# --- Auto-detection: classify once per deposited item instead of per poll ---
+detection_events = EventHub(max_queue=32)
+latest_detection: Optional[dict] = None
+
+async def publish_auto_detection(image: np.ndarray, seq: int, timestamp: float) -> None:
+    global latest_detection
+    try:
+        result = await classify_camera_frame(image, "auto-detect")
+    except Exception as e:
+        logger.error(f"Classifier error in auto-detect: {e}")
+        return
+    latest_detection = {**result, "frame_seq": seq, "timestamp": timestamp}
+    detection_events.publish("detection", latest_detection)
+
+def watch_for_deposits(loop: asyncio.AbstractEventLoop):
+    # Cheap differencing on every frame; the classifier only runs when a change has settled
+    last_seq = 0
+    while not capture_stopped.is_set():
+        frame = frame_ring.wait_newer(last_seq, timeout=1.0)
+        if frame is None:
             continue
-        with frame_lock:
-            latest_frame = frame
+        last_seq = frame.seq
+        if motion_gate.update(frame.image):
+            asyncio.run_coroutine_threadsafe(publish_auto_detection(frame.image.copy(), frame.seq, frame.timestamp), loop)
 
-grabber_thread = threading.Thread(target=grab_frames, daemon=True)
-grabber_thread.start()
+def start_camera(loop: asyncio.AbstractEventLoop) -> None:
+    global camera, frame_ring, video_broadcaster, motion_gate, camera_lock
+    from capture import Camera, CaptureConfig, FrameRing, lock_device
+    from frame_broadcaster import FrameBroadcaster
+    capture_config = CaptureConfig.from_env()
+    camera_lock = lock_device(capture_config.device)
+    if camera_lock is None:
+        logger.warning(f"Camera {capture_config.device} is owned by another process; serving without it.")
+        return
+    camera = Camera(capture_config)
+    # Preallocated ring of recent frames; consumers block on it instead of polling a shared global
+    frame_ring = FrameRing(capacity=int(os.getenv("FRAME_RING_SIZE", "8")))
+    # Encodes each captured frame once and shares the JPEG with every /video-feed viewer
+    video_broadcaster = FrameBroadcaster(jpeg_quality=capture_config.jpeg_quality)
+    metrics.gauge("camera_fps", "Capture rate over the frames in the ring.", function=lambda: frame_ring.fps())
+    metrics.gauge("video_feed_viewers", "Open /video-feed streams.", function=lambda: video_broadcaster.subscriber_count)
+    metrics.counter("video_feed_frames_encoded_total", "Frames encoded for the video feed.", function=lambda: video_broadcaster.frames_encoded)
+    capture_stopped.clear()
+    capture_threads[:] = [threading.Thread(target=grab_frames, name="camera-capture", daemon=True),
+                          threading.Thread(target=encode_frames, name="video-encoder", daemon=True)]
+    if AUTO_DETECT_ENABLED and classify_batcher is not None:
+        from motion import MotionGate
+        motion_gate = MotionGate(
+            width=int(os.getenv("MOTION_GATE_WIDTH", "160")),
+            settle_frames=int(os.getenv("MOTION_SETTLE_FRAMES", "5")),
+        )
+        capture_threads.append(threading.Thread(target=watch_for_deposits, args=(loop,), name="auto-detect", daemon=True))
+    for thread in capture_threads:
+        thread.start()
+
+def stop_camera() -> None:
+    global camera_lock
+    if camera is None:
+        return
+    capture_stopped.set()
+    camera.stop()
+    for thread in capture_threads:
+        thread.join(timeout=5)
+    # Capture has released the device by now, so the next owner can take it over
+    camera_lock.close()
+    camera_lock = None
+
+@app.on_event("startup")
+async def start_subsystems():
+    global gemini_client
+    if ENABLE_CLASSIFIER or ENABLE_CHAT:
+        from gemini_client import GeminiClient
+        # One shared Gemini client: pooled models, capped concurrency, per-call timeout and jittered retries
+        gemini_client = GeminiClient(
+            max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+            timeout=float(os.getenv("GEMINI_TIMEOUT", "20")),
+            max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "2")),
+            api_key=GEMINI_API_KEY,
+        )
+    if ENABLE_CLASSIFIER:
+        start_classifier()
+    if ENABLE_CAMERA:
+        start_camera(asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+def stop_subsystems():
+    stop_camera()
+
+# --- Metrics ---
+# Read from the existing counters when /metrics is scraped, so they cost nothing on the request path
+CLASSIFICATIONS = metrics.counter("classifications_total", "Items classified, by the engine that answered.", ("source",))
+metrics.counter("credit_ledger_duplicates_total", "Submissions dropped as repeats of an idempotency key.", function=lambda: credit_ledger.duplicates)
+metrics.gauge("credit_ledger_queued", "Submissions waiting for the next ledger commit.", function=lambda: credit_ledger.stats()["queued"])
+metrics.gauge("bin_events_subscribers", "Open /admin/bins-events streams.", function=lambda: bin_events.subscriber_count)
+metrics.gauge("bins", "Bins known to the server.", function=lambda: len(bins_data))
+metrics.counter("log_records_dropped_total", "Log records discarded because stdout could not keep up.", function=dropped_records)
 
 # --- Pydantic Models ---
 class DetectionResult(BaseModel):
@@ -111,17 +382,31 @@ class DetectionResult(BaseModel):
     specific_item: str = "unknown"
     credits_value: int = 0
 
+class AutoDetection(DetectionResult):
+    frame_seq: int
+    timestamp: float # Capture time of the classified frame (Unix seconds)
+
 class SubmitWasteRequest(BaseModel):
     user_id: str
     bin_id: str
     category: str
     specific_item: str = "unknown"
     credits_value: int = 0
+    idempotency_key: Optional[str] = None # Same key on a retry = same submission (also accepted as an Idempotency-Key header)
+
+class CategoryTotal(BaseModel):
+    count: int
+    credits: int
 
 class UserCredits(BaseModel):
     user_id: str
     credits: int
-    recycled_items: list[Dict[str, Union[str, int]]]
+    recycled_items: list[Dict[str, Union[str, int]]] # One page, oldest first; each item carries its event 'id'
+    total_items: int = 0 # Lifetime count, independent of the page size
+    category_totals: Dict[str, CategoryTotal] = {}
+    next_cursor: Optional[int] = None # Pass as ?cursor= to fetch the page of older items
+    latest_id: Optional[int] = None # Pass as ?since= to fetch only items newer than this page
+    has_more: bool = False # More items exist beyond this page in the direction being read
 
 # New models for Arduino gateway communication
 class BinStatusUpdate(BaseModel):
@@ -135,6 +420,90 @@ class BinHeartbeat(BaseModel):
     bin_id: str
     timestamp: int
 
+class TelemetryBatch(BaseModel):
+    status_updates: list[BinStatusUpdate] = []
+    heartbeats: list[BinHeartbeat] = []
+
+class TelemetryBatchResult(BaseModel):
+    accepted_status_updates: int
+    accepted_heartbeats: int
+    unknown_heartbeat_bins: list[str] = []
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def parse_ndjson_telemetry(body: bytes) -> TelemetryBatch:
+    status_updates, heartbeats = [], []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {line_number}: expected a JSON object")
+        record_type = record.pop("type", None)
+        if record_type == "status":
+            status_updates.append(BinStatusUpdate.model_validate(record))
+        elif record_type == "heartbeat":
+            heartbeats.append(BinHeartbeat.model_validate(record))
+        else:
+            raise ValueError(f"Line {line_number}: unknown telemetry record type {record_type!r}")
+    return TelemetryBatch(status_updates=status_updates, heartbeats=heartbeats)
+
+class HistoryPoint(BaseModel):
+    timestamp: int # Bucket start (Unix seconds)
+    min: int
+    max: int
+    avg: float
+    count: int
+
+class HistorySummary(BaseModel):
+    min: Optional[int] = None
+    max: Optional[int] = None
+    avg: Optional[float] = None
+    count: int = 0
+
+class BinHistory(BaseModel):
+    bin_id: str
+    start: int
+    end: int
+    bucket_seconds: int
+    resolution_seconds: int # Granularity of the stored data the points were built from
+    points: list[HistoryPoint]
+    summary: HistorySummary
+
+class NearbyBin(BaseModel):
+    id: str
+    name: str
+    location: str
+    lat: float
+    lng: float
+    fillLevel: int
+    status: str
+    connection_status: str
+    distance_km: float
+
+class BinOfflineThreshold(BaseModel):
+    seconds: Optional[float] = None # None reverts to BIN_OFFLINE_THRESHOLD
+
+class RouteStop(BaseModel):
+    id: str
+    name: str
+    location: str
+    lat: float
+    lng: float
+    fillLevel: int
+    hours_to_threshold: float # 0 if already at or over the threshold
+    distance_from_previous_km: float # From the start for the first stop (0 without one)
+
+class CollectionRoute(BaseModel):
+    stops: list[RouteStop]
+    total_distance_km: float # Includes the way back to the start, if there is one
+    greedy_distance_km: float # Nearest-neighbour route before optimization
+    returns_to_start: bool
+    fill_threshold: float
+    horizon_hours: float
+    optimized: bool # False if the time budget ran out before the route was fully optimized
+    planning_ms: float
+
 # Response model for frontend Admin panel
 class AdminBinData(BaseModel):
     id: str
@@ -148,156 +517,214 @@ class AdminBinData(BaseModel):
     totalCollections: int
     connection_status: str # 'online' | 'offline'
     last_seen_timestamp: int # Unix timestamp for admin debugging
-
-# --- HELPER FUNCTIONS ---
-def map_gemini_to_category(description: str) -> str:
-    desc = description.lower()
-    if any(word in desc for word in ["plastic", "bottle", "container", "bag"]):
-        return "plastic"
-    if any(word in desc for word in ["metal", "can", "aluminum", "steel"]):
-        return "metal"
-    if any(word in desc for word in ["glass", "jar", "bottle"]):
-        return "glass"
-    if any(word in desc for word in ["paper", "cardboard", "sheet", "newspaper"]):
-        return "paper"
-    if any(word in desc for word in ["wood", "stick", "timber", "plywood"]):
-        return "wood"
-    return "unknown"
-
-def parse_gemini_response(text_response: str) -> tuple[str, str]:
-    clean_response = text_response.strip()
-    if clean_response.startswith('```json') and clean_response.endswith('```'):
-        clean_response = clean_response[len('```json'):-len('```')].strip()
-    
-    try:
-        data = json.loads(clean_response)
-        category = data.get("category", "unknown").lower()
-        specific_item = data.get("item_name", "unknown").lower()
-        return category, specific_item
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: Could not parse response as JSON. Error: {e}. Cleaned response: '{clean_response}'. Original response: '{text_response}'")
-        category = map_gemini_to_category(text_response)
-        specific_item = "unknown_item_parsing_error"
-        return category, specific_item
+    offline_threshold_seconds: float # Silence after which the bin is marked offline
+    fill_rate_per_hour: Optional[float] = None # Percentage points per hour; None until enough readings
+    time_to_full_seconds: Optional[int] = None # None if the bin is not filling
+    predicted_full_at: Optional[int] = None # Unix timestamp
 
 # --- ENDPOINTS ---
+async def classify_camera_frame(image: np.ndarray, source: str) -> dict:
+    """Cached, batched classification of one camera frame. Classifier errors propagate."""
+    from result_cache import dhash
+    image_hash = dhash(image)
+    cached = classification_cache.get(image_hash)
+    if cached is not None:
+        return cached
+    prediction = await classify_batcher.submit((image, None))
+    category, specific_item = prediction.category, prediction.specific_item
+    credits = CREDIT_VALUES.get(category, 0)
+    CLASSIFICATIONS.labels(prediction.source).inc()
+    logger.debug("Parsed Result (%s): Category='%s', Specific Item='%s', Assigned Credits=%d, Source=%s, Confidence=%.2f",
+                 source, category, specific_item, credits, prediction.source, prediction.confidence)
+    result = {"category": category, "specific_item": specific_item, "credits_value": credits}
+    classification_cache.put(image_hash, result)
+    return result
+
 @app.get("/detect-waste", response_model=DetectionResult)
-def detect_waste():
-    with frame_lock:
-        frame = latest_frame
+async def detect_waste():
+    require(camera is not None, "camera")
+    require(classify_batcher is not None, "classifier")
+    # Ask for a frame captured after this request arrived; fall back to the newest one if the camera is slow.
+    # Copied, since a batched classification can outlive the ring slot it was captured into
+    frame = (await asyncio.to_thread(frame_ring.next_frame, timeout=DETECT_FRAME_TIMEOUT, copy=True)
+             or frame_ring.latest(copy=True))
     if frame is None:
-        print("No image frame available for detect-waste. Returning 'no image'.")
+        logger.warning("No image frame available for detect-waste. Returning 'no image'.")
         return {"category": "unknown", "specific_item": "no image", "credits_value": 0}
-    
-    _, jpeg = cv2.imencode('.jpg', frame)
-    img_bytes = jpeg.tobytes()
-    
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    prompt = "Analyze the waste item in the image. Respond in JSON format with two keys: 'category' (classify as plastic, metal, glass, paper, or wood) and 'item_name' (a specific name for the item, e.g., 'plastic bottle', 'aluminum can', 'cardboard box')."
-    
+
     try:
-        response = model.generate_content([
-            prompt,
-            genai.types.content.ImageContent(
-                data=img_bytes,
-                mime_type="image/jpeg"
-            )
-        ])
-        
-        desc = response.text if hasattr(response, 'text') else str(response)
-        print(f"Gemini raw response (detect-waste): {desc}")
-        category, specific_item = parse_gemini_response(desc)
-        
-        credits = CREDIT_VALUES.get(category, 0)
-        print(f"Parsed Result (detect-waste): Category='{category}', Specific Item='{specific_item}', Assigned Credits={credits}")
-        
+        return await classify_camera_frame(frame.image, "detect-waste")
     except Exception as e:
-        print(f"Gemini error in detect-waste: {e}")
+        logger.error(f"Classifier error in detect-waste: {e}")
         category = "unknown"
         specific_item = "error"
         credits = 0
     return {"category": category, "specific_item": specific_item, "credits_value": credits}
 
-
 @app.get("/video-feed")
-def video_feed():
-    def gen():
-        while True:
-            with frame_lock:
-                frame = latest_frame
-            if frame is None:
-                continue
-            ret, jpeg = cv2.imencode('.jpg', frame)
-            if not ret:
-                continue
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
-    return StreamingResponse(gen(), media_type='multipart/x-mixed-replace; boundary=frame')
+async def video_feed(max_fps: Optional[float] = None):
+    require(camera is not None, "camera")
+    # Every viewer shares the frames encoded once by grab_frames; max_fps can only lower the server cap
+    fps = min(max_fps, VIDEO_FEED_MAX_FPS) if max_fps else VIDEO_FEED_MAX_FPS
+    return StreamingResponse(video_broadcaster.astream(max_fps=fps), media_type='multipart/x-mixed-replace; boundary=frame')
+
+@app.get("/detections/latest", response_model=AutoDetection)
+def get_latest_detection():
+    if latest_detection is None:
+        raise HTTPException(status_code=404, detail="Nothing has been detected yet")
+    return latest_detection
+
+@app.get("/detections/events")
+async def detection_events_stream():
+    """Server-Sent Events: the latest detection (if any), then a "detection" event each time a newly deposited item is classified."""
+    def snapshot() -> Optional[bytes]:
+        return sse_message("detection", latest_detection) if latest_detection is not None else None
+    return StreamingResponse(sse_stream(detection_events, snapshot), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/submit-waste", response_model=UserCredits)
-def submit_waste(data: SubmitWasteRequest):
-    if data.user_id not in users:
-        users[data.user_id] = {"credits": 0, "recycled_items": []}
-    
-    users[data.user_id]["credits"] += data.credits_value
-    users[data.user_id]["recycled_items"].append({
-        "category": data.category,
-        "item_name": data.specific_item,
-        "timestamp": str(datetime.now()),
-        "bin_id": data.bin_id,
-        "credits": data.credits_value
-    })
-    
-    print(f"Submitted waste: User={data.user_id}, Category={data.category}, Item='{data.specific_item}', Bin={data.bin_id}, Credits Added={data.credits_value}")
-    return {"user_id": data.user_id, "credits": users[data.user_id]["credits"], "recycled_items": users[data.user_id]["recycled_items"]}
+def submit_waste(data: SubmitWasteRequest, response: Response, idempotency_key: Optional[str] = Header(None)):
+    key = data.idempotency_key or idempotency_key
+    record = {"user_id": data.user_id, "bin_id": data.bin_id, "category": data.category, "item_name": data.specific_item,
+              "credits": data.credits_value, "timestamp": str(datetime.now())}
+    try:
+        seq, applied, duplicate = credit_ledger.append(record, key)
+        result = applied.result(timeout=LEDGER_ACK_TIMEOUT) # Returns once the record is fsynced and applied
+    except (LedgerClosed, ApplyFailed, OSError, FuturesTimeout) as e:
+        # Not acknowledged; a retry with the same idempotency key cannot double-count if it did land.
+        # FuturesTimeout is not the builtin TimeoutError before Python 3.11
+        logger.error(f"Could not record submission for {data.user_id}: {e!r}")
+        raise HTTPException(status_code=503, detail="Could not record the submission, please retry")
+    if duplicate:
+        original = storage.event_for_ledger_seq(seq)
+        if original is None:
+            # The ledger has the original record but its event row is missing (e.g. dropped at flush)
+            logger.error(f"No recycling event for ledger record {seq} (idempotency key {key!r})")
+            raise HTTPException(status_code=500, detail="The original submission for this idempotency key could not be found")
+        user_id, event = original
+        if user_id != data.user_id:
+            raise HTTPException(status_code=409, detail="Idempotency key was already used for another user's submission")
+        response.headers["Idempotent-Replayed"] = "true"
+        return user_credits_response(data.user_id, storage.get_credits(data.user_id), [event])
+    credits, event = result
+    # Only the new item is returned; clients fetch history through /user-credits
+    return user_credits_response(data.user_id, credits, [event])
 
 
 @app.post("/classify-image", response_model=DetectionResult)
-def classify_image(file: UploadFile = File(...)):
+async def classify_image(file: UploadFile = File(...)):
+    require(classify_batcher is not None, "classifier")
+    from preprocess import InvalidImage, preprocess_upload
+    from result_cache import dhash
+    upload = await file.read() # Size already capped by UploadSizeLimit while the body streamed in
     try:
-        img_bytes = file.file.read()
-        
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        prompt = "Analyze the waste item in the image. Respond in JSON format with two keys: 'category' (classify as plastic, metal, glass, paper, or wood) and 'item_name' (a specific name for the item, e.g., 'plastic bottle', 'aluminum can', 'cardboard box')."
-        
-        response = model.generate_content([
-            prompt,
-            {
-                "mime_type": "image/jpeg",
-                "data": img_bytes
-            }
-        ])
-        
-        desc = response.text if hasattr(response, 'text') else str(response)
-        print(f"Gemini raw response (classify-image): {desc}")
-        category, specific_item = parse_gemini_response(desc)
+        # Decode (upright per EXIF), downscale and re-encode off the event loop
+        image, img_bytes = await asyncio.to_thread(preprocess_upload, upload, UPLOAD_MAX_EDGE, UPLOAD_JPEG_QUALITY)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.debug("Preprocessed upload: %d -> %d bytes, %dx%d", len(upload), len(img_bytes), image.shape[1], image.shape[0])
+
+    try:
+        image_hash = dhash(image)
+        cached = classification_cache.get(image_hash)
+        if cached is not None:
+            return cached
+
+        prediction = await classify_batcher.submit((image, img_bytes))
+        category, specific_item = prediction.category, prediction.specific_item
         
         credits = CREDIT_VALUES.get(category, 0)
-        print(f"Parsed Result (classify-image): Category='{category}', Specific Item='{specific_item}', Assigned Credits={credits}")
+        CLASSIFICATIONS.labels(prediction.source).inc()
+        logger.debug("Parsed Result (classify-image): Category='%s', Specific Item='%s', Assigned Credits=%d, Source=%s, Confidence=%.2f",
+                     category, specific_item, credits, prediction.source, prediction.confidence)
+        result = {"category": category, "specific_item": specific_item, "credits_value": credits}
+        classification_cache.put(image_hash, result)
+        return result
     except Exception as e:
-        print(f"Gemini error in classify-image: {e}")
+        logger.error(f"Classifier error in classify-image: {e}")
         category = "unknown"
         specific_item = "error"
         credits = 0
     return {"category": category, "specific_item": specific_item, "credits_value": credits}
 
 
+def user_credits_response(user_id: str, credits: int, items: list[dict], next_cursor: Optional[int] = None,
+                          latest_id: Optional[int] = None, has_more: bool = False) -> dict:
+    category_totals = storage.category_totals(user_id)
+    return {
+        "user_id": user_id,
+        "credits": credits,
+        "recycled_items": items,
+        "total_items": sum(total["count"] for total in category_totals.values()),
+        "category_totals": category_totals,
+        "next_cursor": next_cursor,
+        "latest_id": items[-1]["id"] if items else latest_id,
+        "has_more": has_more,
+    }
+
 @app.get("/user-credits/{user_id}", response_model=UserCredits)
-def get_credits(user_id: str):
-    if user_id not in users:
-        users[user_id] = {"credits": 0, "recycled_items": []}
-    
-    print(f"Fetching credits for user: {user_id}. Credits: {users[user_id]['credits']}, Recycled Items Count: {len(users[user_id]['recycled_items'])}")
-    return {"user_id": user_id, "credits": users[user_id]["credits"], "recycled_items": users[user_id]["recycled_items"]}
+def get_credits(
+    user_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = Query(None, description="Return items older than this event id"),
+    since: Optional[int] = Query(None, description="Return only items newer than this event id"),
+):
+    credits = storage.get_credits(user_id)
+    if since is not None:
+        # Incremental poll: only what happened after the client's latest_id
+        items, has_more = storage.events_since(user_id, since, limit)
+        logger.debug("Fetching credits for user: %s. Credits: %d, New Items: %d", user_id, credits, len(items))
+        return user_credits_response(user_id, credits, items, latest_id=since, has_more=has_more)
+
+    items, has_more = storage.events_page(user_id, limit, before_id=cursor)
+    logger.debug("Fetching credits for user: %s. Credits: %d, Page Items: %d", user_id, credits, len(items))
+    return user_credits_response(user_id, credits, items, next_cursor=items[0]["id"] if has_more else None, has_more=has_more)
 
 
 # --- NEW: Endpoints for Arduino Gateway ---
 
-@app.post("/bin-status-update")
-def post_bin_status_update(data: BinStatusUpdate):
+def bin_push_state(bin_info: dict) -> tuple:
+    return int(bin_info["fillLevel"]), str(bin_info["status"]), str(bin_info["connection_status"])
+
+# Last fill level / status / connection state pushed to /admin/bins-events subscribers, per bin
+pushed_bin_state: dict[str, tuple] = {bin_id: bin_push_state(bin_info) for bin_id, bin_info in bins_data.items()}
+
+def publish_bin_delta(bin_id: str) -> None:
+    """Pushes a "bin" event carrying only the fields that changed since the last push (all fields for a new bin)."""
+    bin_info = bins_data[bin_id]
+    fleet_context.update(bin_info)
+    index_bin_location(bin_info)
+    state = bin_push_state(bin_info)
+    previous = pushed_bin_state.get(bin_id)
+    if state == previous:
+        return
+    pushed_bin_state[bin_id] = state
+    if bin_events.subscriber_count == 0:
+        return
+    if previous is None:
+        bin_events.publish("bin", admin_bin_view(bin_info, fill_forecaster.predict(int(time.time()))).model_dump())
+        return
+    delta = {"id": bin_id, "last_seen_timestamp": int(bin_info["last_seen"])}
+    for field, old, new in zip(("fillLevel", "status", "connection_status"), previous, state):
+        if old != new:
+            delta[field] = new
+    bin_events.publish("bin", delta)
+
+def on_bin_liveness_change(bin_id: str, online: bool, timestamp: float) -> None:
+    bin_info = bins_data.get(bin_id)
+    if bin_info is None:
+        return
+    bin_info["connection_status"] = "online" if online else "offline"
+    storage.save_bin(bin_info)
+    publish_bin_delta(bin_id)
+    logger.info(f"Bin {bin_id} is now {bin_info['connection_status']} (last seen {datetime.fromtimestamp(int(bin_info.get('last_seen', 0)))}).")
+
+bin_liveness.on_transition = on_bin_liveness_change
+
+def apply_bin_status(data: BinStatusUpdate) -> None:
     if data.bin_id not in bins_data:
         # If a new bin ID is reported, initialize it with default values
-        print(f"Warning: Received status for unknown bin_id: {data.bin_id}. Initializing with default mock data.")
+        logger.warning(f"Received status for unknown bin_id: {data.bin_id}. Initializing with default mock data.")
         bins_data[data.bin_id] = {
             "id": data.bin_id,
             "name": f"New Bin {data.bin_id}",
@@ -306,13 +733,18 @@ def post_bin_status_update(data: BinStatusUpdate):
             "lng": 0.0,
             "lastEmptied": "N/A",
             "totalCollections": 0,
-            "connection_status": "online" # Assume online upon first update
+            "connection_status": "offline" # Flipped to online by bin_liveness below
         }
     
+    fill_history.record(data.bin_id, data.timestamp, data.fill_percentage)
+
     current_bin = bins_data[data.bin_id]
+    if data.timestamp < int(current_bin.get("last_seen", 0)):
+        # Late reading (e.g. replayed from a gateway spool); never roll the live state back
+        return
+    fill_forecaster.update(data.bin_id, data.timestamp, data.fill_percentage)
     current_bin["fillLevel"] = data.fill_percentage
     current_bin["last_seen"] = data.timestamp
-    current_bin["connection_status"] = "online" # If we get an update, it's online
 
     # Update 'status' field based on fill percentage
     if data.fill_percentage >= 90:
@@ -322,91 +754,265 @@ def post_bin_status_update(data: BinStatusUpdate):
     else:
         current_bin["status"] = "active" # Half full or less than 90% full
 
-    print(f"Received bin status for {data.bin_id}: Fill={data.fill_percentage}%, Status='{current_bin['status']}', Last Seen={datetime.fromtimestamp(data.timestamp)}")
+    bin_liveness.touch(data.bin_id, data.timestamp) # If we get an update, it's online
+    storage.save_bin(current_bin)
+    publish_bin_delta(data.bin_id)
+
+    logger.debug("Received bin status for %s: Fill=%d%%, Status='%s', Last Seen=%d", data.bin_id, data.fill_percentage, current_bin["status"], data.timestamp)
+
+def apply_bin_heartbeat(data: BinHeartbeat) -> bool:
+    """Returns False if the bin is unknown."""
+    if data.bin_id not in bins_data:
+        logger.warning(f"Received heartbeat for unknown bin_id: {data.bin_id}. Ignoring.")
+        return False
+
+    current_bin = bins_data[data.bin_id]
+    current_bin["last_seen"] = max(int(current_bin.get("last_seen", 0)), data.timestamp)
+    bin_liveness.touch(data.bin_id, data.timestamp)
+    storage.save_bin(current_bin)
+    return True
+
+@app.post("/bin-status-update")
+def post_bin_status_update(data: BinStatusUpdate):
+    require(ENABLE_TELEMETRY, "bin telemetry")
+    apply_bin_status(data)
     return {"message": "Bin status updated successfully"}
 
 @app.post("/bin-heartbeat")
 def post_bin_heartbeat(data: BinHeartbeat):
-    if data.bin_id not in bins_data:
-        print(f"Warning: Received heartbeat for unknown bin_id: {data.bin_id}. Ignoring.")
+    require(ENABLE_TELEMETRY, "bin telemetry")
+    if not apply_bin_heartbeat(data):
         raise HTTPException(status_code=404, detail="Bin ID not found")
-
-    bins_data[data.bin_id]["last_seen"] = data.timestamp
-    bins_data[data.bin_id]["connection_status"] = "online"
-    # print(f"Received heartbeat for {data.bin_id}. Last seen updated.")
     return {"message": "Bin heartbeat received"}
 
-@app.get("/admin/bins-data", response_model=Dict[str, AdminBinData])
-def get_admin_bins_data():
-    current_time = int(time.time())
-    offline_threshold = 30 # seconds
-
-    response_data = {}
-    for bin_id, bin_info in bins_data.items():
-        # Determine connection status based on last_seen
-        if current_time - int(bin_info.get("last_seen", 0)) > offline_threshold:
-            bin_info["connection_status"] = "offline"
+@app.post("/bin-telemetry/batch", response_model=TelemetryBatchResult)
+async def post_bin_telemetry_batch(request: Request):
+    """Bulk ingest for gateways: a TelemetryBatch JSON body, or NDJSON with one {"type": "status"|"heartbeat", ...} record per line."""
+    require(ENABLE_TELEMETRY, "bin telemetry")
+    body = await request.body()
+    ndjson = request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE)
+    # Parsing and applying a large batch takes a while, so it runs in the threadpool like the single-record endpoints
+    return await asyncio.to_thread(ingest_telemetry_batch, body, ndjson)
+
+def ingest_telemetry_batch(body: bytes, ndjson: bool) -> dict:
+    try:
+        if ndjson:
+            batch = parse_ndjson_telemetry(body)
         else:
-            bin_info["connection_status"] = "online" # Re-confirm online if within threshold
+            batch = TelemetryBatch.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False, include_input=False))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
-        # Ensure all fields for AdminBinData are present and correctly typed
-        response_data[bin_id] = AdminBinData(
-            id=bin_info["id"],
+    # Oldest first so live state ends up at the newest reading even if the batch is unordered
+    for update in sorted(batch.status_updates, key=lambda update: update.timestamp):
+        apply_bin_status(update)
+    unknown_bins = set()
+    for heartbeat in batch.heartbeats:
+        if not apply_bin_heartbeat(heartbeat):
+            unknown_bins.add(heartbeat.bin_id)
+    return {
+        "accepted_status_updates": len(batch.status_updates),
+        "accepted_heartbeats": sum(1 for heartbeat in batch.heartbeats if heartbeat.bin_id not in unknown_bins),
+        "unknown_heartbeat_bins": sorted(unknown_bins),
+    }
+
+BIN_EVENTS_KEEPALIVE = 15 # seconds between SSE keepalive comments on an idle stream
+
+def admin_bin_view(bin_info: dict, forecast) -> AdminBinData:
+    rate, time_to_full = forecast.get(bin_info["id"])
+    # Ensure all fields for AdminBinData are present and correctly typed
+    return AdminBinData(
+        id=bin_info["id"],
+        name=bin_info["name"],
+        location=bin_info["location"],
+        lat=float(bin_info["lat"]),
+        lng=float(bin_info["lng"]),
+        status=str(bin_info["status"]),
+        fillLevel=int(bin_info["fillLevel"]),
+        lastEmptied=str(bin_info["lastEmptied"]),
+        totalCollections=int(bin_info["totalCollections"]),
+        connection_status=str(bin_info["connection_status"]),
+        last_seen_timestamp=int(bin_info["last_seen"]),
+        offline_threshold_seconds=bin_liveness.timeout_for(bin_info["id"]),
+        fill_rate_per_hour=round(rate, 2) if rate is not None else None,
+        time_to_full_seconds=round(time_to_full) if time_to_full is not None else None,
+        predicted_full_at=int(time.time()) + round(time_to_full) if time_to_full is not None else None,
+    )
+
+@app.get("/bins/nearest", response_model=List[NearbyBin])
+def get_nearest_bins(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=100),
+    exclude_full: bool = Query(False, description="Only bins that can take waste (not full or under maintenance)"),
+    max_km: float = Query(NEAREST_BINS_MAX_KM, gt=0),
+):
+    """The k bins closest to a point, nearest first."""
+    result = []
+    for bin_id, distance in bin_locations.nearest(lat, lng, k, available_only=exclude_full, max_km=max_km):
+        bin_info = bins_data[bin_id]
+        result.append(NearbyBin(
+            id=bin_id,
             name=bin_info["name"],
             location=bin_info["location"],
             lat=float(bin_info["lat"]),
             lng=float(bin_info["lng"]),
-            status=str(bin_info["status"]),
             fillLevel=int(bin_info["fillLevel"]),
-            lastEmptied=str(bin_info["lastEmptied"]),
-            totalCollections=int(bin_info["totalCollections"]),
+            status=str(bin_info["status"]),
             connection_status=str(bin_info["connection_status"]),
-            last_seen_timestamp=int(bin_info["last_seen"])
-        )
-    print(f"Serving admin bins data. Current status of bins: { {id: {'fillLevel': bin['fillLevel'], 'status': bin['status'], 'connection_status': bin['connection_status']} for id, bin in bins_data.items()} }")
+            distance_km=round(distance, 3),
+        ))
+    return result
+
+@app.get("/admin/bins-data", response_model=Dict[str, AdminBinData])
+def get_admin_bins_data():
+    # connection_status is kept current by bin_liveness, so nothing is recomputed here
+    forecast = fill_forecaster.predict(int(time.time()))
+    response_data = {bin_id: admin_bin_view(bin_info, forecast) for bin_id, bin_info in bins_data.items()}
     return response_data
 
+def bins_snapshot() -> bytes:
+    forecast = fill_forecaster.predict(int(time.time()))
+    return sse_message("snapshot", {bin_id: admin_bin_view(bin_info, forecast).model_dump() for bin_id, bin_info in list(bins_data.items())})
+
+@app.get("/admin/bins-events")
+async def admin_bins_events():
+    """Server-Sent Events: one "snapshot" of every bin, then a "bin" event with the changed fields whenever fill level, status or connection state changes."""
+    return StreamingResponse(sse_stream(bin_events, bins_snapshot, keepalive=BIN_EVENTS_KEEPALIVE), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.put("/admin/bins/{bin_id}/offline-threshold", response_model=AdminBinData)
+def put_bin_offline_threshold(bin_id: str, data: BinOfflineThreshold):
+    if bin_id not in bins_data:
+        raise HTTPException(status_code=404, detail="Bin ID not found")
+    if data.seconds is not None and data.seconds <= 0:
+        raise HTTPException(status_code=422, detail="seconds must be positive")
+    bin_info = bins_data[bin_id]
+    bin_info["offline_threshold"] = data.seconds
+    bin_liveness.set_timeout(bin_id, data.seconds)
+    storage.save_bin(bin_info)
+    return admin_bin_view(bin_info, fill_forecaster.predict(int(time.time())))
+
+@app.get("/admin/bins/{bin_id}/history", response_model=BinHistory)
+def get_bin_history(
+    bin_id: str,
+    start: Optional[int] = Query(None, description="Unix seconds; defaults to one hour before end"),
+    end: Optional[int] = Query(None, description="Unix seconds; defaults to now"),
+    bucket: Optional[int] = Query(None, ge=1, description="Rollup bucket width in seconds; picked automatically if omitted"),
+):
+    if bin_id not in bins_data:
+        raise HTTPException(status_code=404, detail="Bin ID not found")
+    end = int(time.time()) if end is None else end
+    start = end - 3600 if start is None else start
+    if start > end:
+        raise HTTPException(status_code=422, detail="start must not be after end")
+    return fill_history.query(bin_id, start, end, bucket)
+
+def hours_to_threshold(bin_info: dict, forecast, threshold: float) -> Optional[float]:
+    fill = float(bin_info["fillLevel"])
+    if fill >= threshold:
+        return 0.0
+    rate, _ = forecast.get(bin_info["id"])
+    if rate is None or rate <= 0:
+        return None
+    return (threshold - fill) / rate
+
+@app.get("/admin/collection-route", response_model=CollectionRoute)
+def get_collection_route(
+    threshold: float = Query(ROUTE_FILL_THRESHOLD, ge=0, le=100, description="Fill level (%) at which a bin needs collecting"),
+    horizon_hours: float = Query(ROUTE_HORIZON_HOURS, ge=0, description="Also collect bins predicted to reach the threshold within this many hours"),
+    start_lat: Optional[float] = Query(None, ge=-90, le=90, description="Where the route starts and ends; defaults to the configured depot"),
+    start_lng: Optional[float] = Query(None, ge=-180, le=180),
+    time_budget_ms: int = Query(ROUTE_TIME_BUDGET_MS, ge=1, le=10000),
+):
+    """Short visiting order for every bin that is full, or will be within horizon_hours (nearest neighbour + 2-opt)."""
+    if (start_lat is None) != (start_lng is None):
+        raise HTTPException(status_code=422, detail="start_lat and start_lng must be given together")
+    start = (start_lat, start_lng) if start_lat is not None else ROUTE_DEPOT
+    forecast = fill_forecaster.predict(int(time.time()))
+    selected = []
+    for bin_info in list(bins_data.values()):
+        if bin_info["lat"] == 0 and bin_info["lng"] == 0:
+            continue # Registered by telemetry without a known location
+        hours = hours_to_threshold(bin_info, forecast, threshold)
+        if hours is not None and hours <= horizon_hours:
+            selected.append((bin_info, hours))
+    plan = plan_route([float(b["lat"]) for b, _ in selected], [float(b["lng"]) for b, _ in selected], start, time_budget_ms / 1000)
+    stops = []
+    for index, leg in zip(plan.order, plan.legs_km):
+        bin_info, hours = selected[index]
+        stops.append(RouteStop(
+            id=bin_info["id"],
+            name=bin_info["name"],
+            location=bin_info["location"],
+            lat=float(bin_info["lat"]),
+            lng=float(bin_info["lng"]),
+            fillLevel=int(bin_info["fillLevel"]),
+            hours_to_threshold=round(hours, 2),
+            distance_from_previous_km=round(leg, 3),
+        ))
+    logger.debug("Planned collection route: %d stops, %.1f km (greedy %.1f km) in %.0f ms", len(stops), plan.total_km, plan.greedy_km, plan.elapsed_seconds * 1000)
+    return CollectionRoute(
+        stops=stops,
+        total_distance_km=round(plan.total_km, 3),
+        greedy_distance_km=round(plan.greedy_km, 3),
+        returns_to_start=start is not None,
+        fill_threshold=threshold,
+        horizon_hours=horizon_hours,
+        optimized=plan.converged,
+        planning_ms=round(plan.elapsed_seconds * 1000, 1),
+    )
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text format: request and Gemini latencies, capture and encode stats, cache and queue counters."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.Registry.CONTENT_TYPE)
+
+@app.get("/admin/classification-cache")
+def get_classification_cache_stats():
+    require(classification_cache is not None, "classifier")
+    return classification_cache.stats()
+
+@app.get("/admin/credit-ledger")
+def get_credit_ledger_stats():
+    return credit_ledger.stats()
+
+@app.get("/admin/classify-batching")
+def get_classify_batching_stats():
+    require(classify_batcher is not None, "classifier")
+    return classify_batcher.stats()
+
 # NEW: Endpoint for Gemini chat
 class GeminiChatRequest(BaseModel):
     user_id: str
     message: str
+    lat: Optional[float] = None # The user's location, if shared, for "nearest bin" questions
+    lng: Optional[float] = None
 
 class GeminiChatResponse(BaseModel):
     response: str
 
-@app.post("/chat/gemini-query", response_model=GeminiChatResponse)
-async def gemini_chat_query(request: GeminiChatRequest):
-    user_id = request.user_id
-    user_message = request.message
+CHAT_NEARBY_BINS = int(os.getenv("CHAT_NEARBY_BINS", "3"))
 
+def build_chat_prompt(user_id: str, user_message: str, lat: Optional[float] = None, lng: Optional[float] = None) -> str:
     # Gather real-time data
-    user_data = users.get(user_id, {"credits": 0, "recycled_items": []})
-    all_bins = list(bins_data.values()) # Use bins_data directly
+    user_data = {"credits": storage.get_credits(user_id), "recycled_items": storage.recent_events(user_id, 5)}
 
-    # Construct a comprehensive prompt
-    context_prompt = (
+    # Construct the prompt: user data, a bounded slice of the fleet, then the question
+    header = (
         f"You are an AI assistant for TrashNet, a smart waste management system. "
         f"You have access to real-time user and bin data. "
         f"The current user is '{user_id}'.\n\n"
         f"--- User Data ---\n"
         f"EcoCredits: {user_data['credits']}\n"
         f"Recycled Items (last 5): {user_data['recycled_items'][-5:] if user_data['recycled_items'] else 'None'}\n\n"
-        f"--- Bin Data ---\n"
-        f"Here is a list of all smart trash bins and their current status:\n"
     )
-    for bin in all_bins:
-        context_prompt += (
-            f"- Bin ID: {bin['id']}, Name: {bin['name']}, Location: {bin['location']}, "
-            f"Fill Level: {bin['fillLevel']}%, Status: {bin['status']}, "
-            f"Connection: {bin['connection_status']}, "
-            f"Last Seen: {datetime.fromtimestamp(int(bin['last_seen'])).strftime('%Y-%m-%d %H:%M:%S UTC')}\n"
-        )
-    context_prompt += "\n"
-
     # Add general knowledge about the system
-    context_prompt += (
+    footer = (
         f"--- System Information ---\n"
-        f"Waste categories supported: {', '.join(CATEGORIES)}. "
+        f"Waste categories supported: {', '.join(category for category in CREDIT_VALUES if category != 'unknown')}. "
         f"Users earn EcoCredits for recycling. Credits can be used for rewards. "
         f"Current time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S IST')}. " # Add current time
         f"Current location: Kochi, Kerala, India.\n\n" # Add current location
@@ -415,12 +1021,80 @@ async def gemini_chat_query(request: GeminiChatRequest):
         f"User: {user_message}\n\n"
         f"Assistant:"
     )
+    # Bins the user recycled at recently stand in for where they are when no location was shared
+    recent_bin_ids = [item["bin_id"] for item in reversed(user_data["recycled_items"])]
+    nearby = []
+    if lat is not None and lng is not None:
+        nearby = bin_locations.nearest(lat, lng, CHAT_NEARBY_BINS, available_only=True, max_km=NEAREST_BINS_MAX_KM)
+    return fleet_context.build_prompt(header, footer, user_message, extra_bin_ids=recent_bin_ids, nearby=nearby)
 
+@app.post("/chat/gemini-query", response_model=GeminiChatResponse)
+async def gemini_chat_query(request: GeminiChatRequest):
+    require(ENABLE_CHAT, "chat assistant")
+    # Reads the user's recent events from SQLite, so it runs off the event loop
+    context_prompt = await asyncio.to_thread(build_chat_prompt, request.user_id, request.message, request.lat, request.lng)
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        chat_response = model.generate_content(context_prompt)
+        chat_response = await gemini_client.generate(context_prompt, model_name=GEMINI_CHAT_MODEL)
         response_text = chat_response.text if hasattr(chat_response, 'text') else str(chat_response)
         return {"response": response_text}
+    except asyncio.TimeoutError:
+        logger.warning("Gemini chat request timed out.")
+        raise HTTPException(status_code=504, detail="AI assistant timed out. Please try again.")
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        raise HTTPException(status_code=500, detail="Failed to get response from AI assistant.")
\ No newline at end of file
+        logger.error(f"Error calling Gemini API: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get response from AI assistant.")
+# --- Streaming chat ---
+CHAT_MAX_STREAMS_PER_USER = int(os.getenv("CHAT_MAX_STREAMS_PER_USER", "2"))
+active_chat_streams: dict[str, int] = {} # user_id -> open streams; only touched on the event loop
+
+class ChatStreamSlot:
+    """One of a user's concurrent chat streams. release() is idempotent."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.released = False
+        active_chat_streams[user_id] = active_chat_streams.get(user_id, 0) + 1
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        remaining = active_chat_streams[self.user_id] - 1
+        if remaining:
+            active_chat_streams[self.user_id] = remaining
+        else:
+            del active_chat_streams[self.user_id]
+
+async def chat_event_stream(context_prompt: str, slot: ChatStreamSlot):
+    parts = []
+    try:
+        async for text in gemini_client.stream(context_prompt, model_name=GEMINI_CHAT_MODEL):
+            parts.append(text)
+            yield sse_message("chunk", {"text": text})
+        yield sse_message("done", {"response": "".join(parts)})
+    except asyncio.TimeoutError:
+        logger.warning("Gemini chat stream timed out.")
+        yield sse_message("error", {"detail": "AI assistant timed out. Please try again."})
+    except Exception as e:
+        logger.error(f"Error streaming from Gemini API: {e}")
+        yield sse_message("error", {"detail": "Failed to get response from AI assistant."})
+    finally:
+        # Also reached when the client disconnects: the response task is cancelled and the Gemini stream closed with it
+        slot.release()
+
+@app.post("/chat/gemini-query/stream")
+async def gemini_chat_query_stream(request: GeminiChatRequest):
+    """Server-Sent Events: "chunk" events with text as Gemini generates it, then "done" with the full response (or "error")."""
+    require(ENABLE_CHAT, "chat assistant")
+    if active_chat_streams.get(request.user_id, 0) >= CHAT_MAX_STREAMS_PER_USER:
+        raise HTTPException(status_code=429, detail="Too many chat responses in progress. Please wait for one to finish.")
+    slot = ChatStreamSlot(request.user_id)
+    try:
+        context_prompt = await asyncio.to_thread(build_chat_prompt, request.user_id, request.message, request.lat, request.lng)
+    except BaseException: # Including cancellation while the prompt is built
+        slot.release()
+        raise
+    # The background task releases the slot even if the stream never started
+    return StreamingResponse(chat_event_stream(context_prompt, slot), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(slot.release))
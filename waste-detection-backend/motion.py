@@ -0,0 +1,77 @@
+# motion.py
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Fires once each time the camera scene changes and then settles.
+
+    Works on small blurred grayscale copies of each frame. Frame-to-frame
+    differencing tells whether something is moving; once motion has stayed
+    below `still_fraction` for `settle_frames` frames, the settled scene is
+    compared with the reference taken at the last settle. Only if it differs
+    (an item was left behind, not just a hand passing through) does update()
+    return True, so each deposit triggers exactly one classification on a
+    sharp frame. While idle the reference slowly follows lighting drift.
+    """
+
+    def __init__(self, width: int = 160, pixel_threshold: int = 25, motion_fraction: float = 0.02,
+                 still_fraction: float = 0.005, change_fraction: float = 0.01, settle_frames: int = 5,
+                 drift_rate: float = 0.02):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.motion_fraction = motion_fraction      # Share of pixels that must change to count as motion
+        self.still_fraction = still_fraction        # Frame-to-frame change below this counts as still
+        self.change_fraction = change_fraction      # Settled scene vs reference above this counts as a new item
+        self.settle_frames = settle_frames
+        self.drift_rate = drift_rate
+        self._reference: Optional[np.ndarray] = None  # float32, updated with accumulateWeighted
+        self._previous: Optional[np.ndarray] = None
+        self._moving = False
+        self._still_count = 0
+        self.triggers = 0
+
+    @property
+    def moving(self) -> bool:
+        return self._moving
+
+    def _prepare(self, image: np.ndarray) -> np.ndarray:
+        height = max(1, round(image.shape[0] * self.width / image.shape[1]))
+        small = cv2.resize(image, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _changed_share(self, a: np.ndarray, b: np.ndarray) -> float:
+        return np.count_nonzero(cv2.absdiff(a, b) > self.pixel_threshold) / a.size
+
+    def update(self, image: np.ndarray) -> bool:
+        """Feeds one frame. Returns True when a change has just settled and the frame should be classified."""
+        small = self._prepare(image)
+        previous, self._previous = self._previous, small
+        if self._reference is None or previous is None or previous.shape != small.shape:
+            self._reference = small.astype(np.float32)
+            self._moving = False
+            return False
+        reference = cv2.convertScaleAbs(self._reference)
+        if not self._moving:
+            if self._changed_share(small, reference) > self.motion_fraction:
+                self._moving = True
+                self._still_count = 0
+            else:
+                cv2.accumulateWeighted(small, self._reference, self.drift_rate)
+            return False
+        if self._changed_share(small, previous) > self.still_fraction:
+            self._still_count = 0
+            return False
+        self._still_count += 1
+        if self._still_count < self.settle_frames:
+            return False
+        self._moving = False
+        changed = self._changed_share(small, reference) > self.change_fraction
+        self._reference = small.astype(np.float32)
+        if changed:
+            self.triggers += 1
+        return changed
@@ -0,0 +1,71 @@
+# preprocess.py
+import struct
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from jpeg import encode_jpeg
+
+# imdecode flags that let libjpeg scale by 1/2, 1/4 or 1/8 while decoding (EXIF orientation is still applied)
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def jpeg_dimensions(data: bytes) -> Optional[tuple[int, int]]:
+    """(width, height) from a JPEG's SOF header without decoding it; None if data is not a readable JPEG."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # Fill byte
+            i += 1
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC) which share the range
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def preprocess_upload(data: bytes, max_edge: int = 1024, jpeg_quality: int = 85) -> tuple[np.ndarray, bytes]:
+    """Decodes an uploaded image, upright per its EXIF orientation, no larger than max_edge on its longest side.
+
+    Returns the BGR pixels and a JPEG re-encoded at jpeg_quality, so the
+    classifier always gets a real JPEG of bounded size whatever was uploaded.
+    Large JPEGs are scaled down during decoding (libjpeg DCT scaling), which
+    is far cheaper than decoding at full size and resizing afterwards.
+    """
+    if not data:
+        raise InvalidImage("The uploaded file is empty") # imdecode raises cv2.error on an empty buffer
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    flag = cv2.IMREAD_COLOR
+    dimensions = jpeg_dimensions(data)
+    if dimensions is not None:
+        longest = max(dimensions)
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if longest // factor >= max_edge:
+                flag = reduced_flag
+                break
+    try:
+        image = cv2.imdecode(buffer, flag)
+    except cv2.error:
+        image = None
+    if image is None:
+        raise InvalidImage("Could not decode the uploaded image")
+    height, width = image.shape[:2]
+    scale = max_edge / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    try:
+        return image, encode_jpeg(image, jpeg_quality)
+    except ValueError:
+        raise InvalidImage("Could not re-encode the uploaded image")
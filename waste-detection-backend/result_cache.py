@@ -0,0 +1,93 @@
+# result_cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8 # 8x8 difference hash -> 64-bit key
+
+
+def dhash(image: np.ndarray) -> int:
+    """64-bit difference hash of a BGR or grayscale image. Near-identical scenes give hashes a few bits apart."""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def dhash_bytes(img_bytes: bytes) -> Optional[int]:
+    """dhash of an encoded upload. Decodes at reduced scale since only a 9x8 thumbnail is needed."""
+    buf = np.frombuffer(img_bytes, dtype=np.uint8)
+    image = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    return dhash(image)
+
+
+class PerceptualCache:
+    """LRU + TTL cache of classification results keyed by perceptual hash.
+
+    A lookup hits when a stored hash is within `max_distance` bits (Hamming
+    distance) of the query, so the same item re-scanned under slightly
+    different lighting or framing reuses the earlier result.
+    """
+
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 300, max_distance: int = 6):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._entries: OrderedDict[int, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Optional[int]) -> Optional[Any]:
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            expired = []
+            for stored_key, (stored_at, _) in self._entries.items():
+                if now - stored_at > self.ttl_seconds:
+                    expired.append(stored_key)
+                    continue
+                distance = (stored_key ^ key).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = stored_key, distance
+                    if distance == 0:
+                        break
+            for stored_key in expired:
+                del self._entries[stored_key]
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key][1]
+
+    def put(self, key: Optional[int], value: Any) -> None:
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,184 @@
+# routing.py
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+MATRIX_BLOCK_ROWS = 256
+MIN_GAIN_KM = 1e-3 # 2-opt moves that save less than a metre are not worth the float32 rounding risk
+
+
+def haversine_matrix(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """Great-circle distances in km between every pair of points, as a float32 matrix.
+
+    Same result as the haversine formula, but via chord lengths between unit
+    vectors (haversine(d) = chord^2 / 4), so each pair costs a few in-place
+    operations instead of several trigonometric calls. The arithmetic is
+    float64 (in float32 the chord's rounding grows to hundreds of metres on
+    near-antipodal legs), so the only loss is storing the result as float32:
+    under a metre per leg of up to 20,000 km.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lng = np.radians(np.asarray(lng, dtype=np.float64))
+    points = np.column_stack((np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)))
+    n = len(points)
+    dist = np.empty((n, n), dtype=np.float32)
+    for begin in range(0, n, MATRIX_BLOCK_ROWS):
+        # A block of rows at a time keeps the scratch arrays in cache
+        rows = points[begin:begin + MATRIX_BLOCK_ROWS]
+        chord = np.zeros((len(rows), n))
+        delta = np.empty_like(chord)
+        for axis in range(3):
+            np.subtract(rows[:, axis, None], points[None, :, axis], out=delta)
+            np.multiply(delta, delta, out=delta)
+            chord += delta
+        np.sqrt(chord, out=chord)
+        chord *= 0.5
+        np.minimum(chord, 1.0, out=chord)
+        np.arcsin(chord, out=chord)
+        np.multiply(chord, 2 * EARTH_RADIUS_KM, out=dist[begin:begin + len(rows)], casting="same_kind")
+    return dist
+
+
+def nearest_neighbour_tour(dist: np.ndarray, start: int = 0) -> np.ndarray:
+    """Greedy tour: from start, always go to the closest unvisited point."""
+    n = len(dist)
+    tour = np.empty(n, dtype=np.int64)
+    visited = np.zeros(n, dtype=bool)
+    current = start
+    for step in range(n):
+        tour[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        row = dist[current].copy()
+        row[visited] = np.inf
+        current = int(np.argmin(row))
+    return tour
+
+
+def tour_length(dist: np.ndarray, tour: np.ndarray) -> float:
+    """Length of the closed tour (back to its first point)."""
+    return float(dist[tour, np.roll(tour, -1)].sum(dtype=np.float64))
+
+
+def nearest_neighbours(dist: np.ndarray, k: int) -> np.ndarray:
+    """The k closest other points to each point, closest first."""
+    n = len(dist)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.int64)
+    candidates = np.argpartition(dist, k, axis=1)[:, :k + 1]
+    candidates = np.take_along_axis(candidates, np.take_along_axis(dist, candidates, axis=1).argsort(axis=1), axis=1)
+    # Drop each point itself (normally first, but coincident points can tie with it)
+    keep = candidates != np.arange(n)[:, None]
+    return np.array([row[mask][:k] for row, mask in zip(candidates, keep)], dtype=np.int64)
+
+
+def two_opt(dist: np.ndarray, tour: np.ndarray, deadline: float, neighbours: int = 10) -> tuple[np.ndarray, bool]:
+    """Improves a closed tour with 2-opt moves until none is left or time.monotonic() passes deadline.
+
+    The first point stays in place. Only moves that create an edge from a
+    point to one of its `neighbours` nearest points are tried (a 2-opt move
+    that shortens the tour always adds at least one such short edge), and
+    only points whose edges changed are looked at again, so the work grows
+    roughly linearly with the number of points. Returns the tour and whether
+    it converged.
+    """
+    tour = tour.copy()
+    n = len(tour)
+    if n < 4:
+        return tour, True
+    near = nearest_neighbours(dist, neighbours).tolist()
+    pos = np.empty(n, dtype=np.int64)
+    pos[tour] = np.arange(n)
+
+    def reverse(i: int, j: int) -> None:
+        # Reverse tour positions i..j (cyclically); if that would move position 0, reverse the rest instead
+        if i > j or i == 0:
+            i, j = j + 1, (i - 1) % n
+        if i <= j:
+            tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+            pos[tour[i:j + 1]] = np.arange(i, j + 1)
+
+    queue = deque(tour.tolist())
+    queued = [True] * n
+    while queue:
+        if time.monotonic() > deadline:
+            return tour, False
+        a = queue.popleft()
+        queued[a] = False
+        i = int(pos[a])
+        for forward in (True, False):
+            # Edge (a, b) with b after a (forward) or before it; try replacing (a, b) and (c, d) with (a, c) and (b, d)
+            b = int(tour[(i + 1) % n]) if forward else int(tour[i - 1])
+            d_ab = dist[a, b]
+            moved = False
+            for c in near[a]:
+                d_ac = dist[a, c]
+                if d_ac >= d_ab:
+                    break # Neighbours are sorted, so no later one can shorten the tour either
+                j = int(pos[c])
+                d = int(tour[(j + 1) % n]) if forward else int(tour[j - 1])
+                if d == a:
+                    continue
+                if d_ab + dist[c, d] - d_ac - dist[b, d] > MIN_GAIN_KM:
+                    if forward:
+                        reverse((i + 1) % n, j)     # a [b .. c] d -> a [c .. b] d
+                    else:
+                        reverse(i, (j - 1) % n)     # d [c .. b] a -> ... ends with (b, d) and (c, a)
+                    for point in (a, b, c, d):
+                        if not queued[point]:
+                            queued[point] = True
+                            queue.append(point)
+                    moved = True
+                    break
+            if moved:
+                break
+    return tour, True
+
+
+@dataclass
+class RoutePlan:
+    order: list[int]              # Indices into the points passed to plan_route, in visiting order
+    legs_km: list[float]          # Distance to each stop from the previous one (or from the start)
+    total_km: float               # Including the way back if the route returns to its start
+    greedy_km: float              # Same route length before 2-opt, for comparison
+    converged: bool               # False if the time budget ran out before 2-opt finished
+    elapsed_seconds: float
+
+
+def plan_route(lat: Sequence[float], lng: Sequence[float], start: Optional[tuple[float, float]] = None,
+               time_budget: float = 0.3) -> RoutePlan:
+    """Short visiting order for the given points: nearest neighbour, then 2-opt within time_budget seconds.
+
+    With a start (a depot, or the truck's position) the route leaves from it
+    and returns to it. Without one it is an open path from whichever point
+    suits best; a zero-distance dummy node turns that into the same closed
+    tour problem.
+    """
+    began = time.monotonic()
+    n = len(lat)
+    if n == 0:
+        return RoutePlan([], [], 0.0, 0.0, True, 0.0)
+    if start is not None:
+        dist = haversine_matrix(np.concatenate(([start[0]], lat)), np.concatenate(([start[1]], lng)))
+    else:
+        dist = np.zeros((n + 1, n + 1), dtype=np.float32)
+        dist[1:, 1:] = haversine_matrix(lat, lng)
+    greedy = nearest_neighbour_tour(dist, 0)
+    tour, converged = two_opt(dist, greedy, began + time_budget)
+    stops = tour[1:]
+    legs = dist[tour[:-1], stops]
+    total = tour_length(dist, tour)
+    return RoutePlan(
+        order=[int(stop) - 1 for stop in stops],
+        legs_km=[float(leg) for leg in legs],
+        total_km=total,
+        greedy_km=tour_length(dist, greedy),
+        converged=converged,
+        elapsed_seconds=time.monotonic() - began,
+    )
@@ -0,0 +1,420 @@
+# storage.py
+import sqlite3
+import threading
+from typing import Optional
+
+from log import get_logger
+
+logger = get_logger("storage")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    credits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS recycling_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    bin_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    item_name TEXT NOT NULL,
+    credits INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    ledger_seq INTEGER,
+    idempotency_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_user_time ON recycling_events (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_bin_time ON recycling_events (bin_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_user_id ON recycling_events (user_id, id);
+CREATE TABLE IF NOT EXISTS user_category_totals (
+    user_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    credits INTEGER NOT NULL,
+    PRIMARY KEY (user_id, category)
+);
+CREATE TABLE IF NOT EXISTS bins (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    location TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    status TEXT NOT NULL,
+    fillLevel INTEGER NOT NULL,
+    lastEmptied TEXT NOT NULL,
+    totalCollections INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    connection_status TEXT NOT NULL,
+    offline_threshold REAL
+);
+"""
+
+INSERT_EVENT_SQL = """
+INSERT INTO recycling_events (id, user_id, bin_id, category, item_name, credits, timestamp, ledger_seq, idempotency_key)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+"""
+# Created after the migration below, since older databases lack the columns
+LEDGER_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_events_ledger_seq ON recycling_events (ledger_seq);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_events_idempotency_key ON recycling_events (idempotency_key) WHERE idempotency_key IS NOT NULL;
+"""
+ADD_TOTALS_SQL = """
+INSERT INTO user_category_totals (user_id, category, count, credits) VALUES (?, ?, ?, ?)
+ON CONFLICT(user_id, category) DO UPDATE SET count = count + excluded.count, credits = credits + excluded.credits
+"""
+BACKFILL_TOTALS_SQL = """
+INSERT INTO user_category_totals (user_id, category, count, credits)
+SELECT user_id, category, COUNT(*), SUM(credits) FROM recycling_events GROUP BY user_id, category
+"""
+EVENT_COLUMNS = "id, category, item_name, timestamp, bin_id, credits"
+UPSERT_USER_SQL = "INSERT INTO users (user_id, credits) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET credits = excluded.credits"
+UPSERT_BIN_SQL = """
+INSERT INTO bins (id, name, location, lat, lng, status, fillLevel, lastEmptied, totalCollections, last_seen, connection_status, offline_threshold)
+VALUES (:id, :name, :location, :lat, :lng, :status, :fillLevel, :lastEmptied, :totalCollections, :last_seen, :connection_status, :offline_threshold)
+ON CONFLICT(id) DO UPDATE SET
+    name = excluded.name, location = excluded.location, lat = excluded.lat, lng = excluded.lng,
+    status = excluded.status, fillLevel = excluded.fillLevel, lastEmptied = excluded.lastEmptied,
+    totalCollections = excluded.totalCollections, last_seen = excluded.last_seen,
+    connection_status = excluded.connection_status, offline_threshold = excluded.offline_threshold
+"""
+BIN_COLUMNS = ("id", "name", "location", "lat", "lng", "status", "fillLevel", "lastEmptied", "totalCollections", "last_seen", "connection_status", "offline_threshold")
+BIN_DEFAULTS = {"status": "active", "fillLevel": 0, "lastEmptied": "N/A", "totalCollections": 0, "last_seen": 0, "connection_status": "offline",
+                "offline_threshold": None}
+
+
+class Storage:
+    """SQLite (WAL) persistence for users, recycling events and bins.
+
+    Writes are write-behind: they land in an in-memory pending batch and a
+    background thread commits them every `flush_interval` seconds (or sooner
+    once `flush_batch_size` rows are pending) in a single transaction. Repeated
+    updates to the same bin inside one batch collapse into one row write.
+    Event reads merge the committed rows with those still queued (or being
+    committed), so they see a row the caller has just written without
+    forcing a flush. User credit balances and per-category
+    totals are kept in memory (a few ints per user) and updated at write
+    time, so neither submit-waste nor a credits poll has to scan history.
+    Event ids are assigned here rather than by SQLite so a queued event can
+    be returned with its id before it is committed. An event whose idempotency
+    key is already stored, or that the database rejects, is dropped at flush
+    time and its credits are taken back out of the in-memory balances; the
+    rest of the batch commits as usual.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.05, flush_batch_size: int = 500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self._write_conn = self._connect()
+        self._write_conn.executescript(SCHEMA)
+        self._migrate()
+        self._readers = threading.local()
+        self._write_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending_events: list[tuple] = []
+        self._flushing_events: list[tuple] = [] # Taken off the queue, not yet committed
+        self._pending_users: dict[str, int] = {}
+        self._pending_bins: dict[str, dict] = {}
+        self._pending_totals: dict[tuple[str, str], list[int]] = {}
+        self._credits: dict[str, int] = {}
+        self._totals: dict[str, dict[str, list[int]]] = {}
+        self._next_event_id = (self._write_conn.execute("SELECT MAX(id) FROM recycling_events").fetchone()[0] or 0) + 1
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._writer = threading.Thread(target=self._writer_loop, name="storage-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _migrate(self) -> None:
+        # Databases created before user_category_totals existed get it backfilled once
+        with self._write_conn:
+            if self._write_conn.execute("SELECT 1 FROM user_category_totals LIMIT 1").fetchone() is None:
+                self._write_conn.execute(BACKFILL_TOTALS_SQL)
+            # Per-bin offline thresholds were added after the bins table; NULL means the server default
+            bin_columns = {row["name"] for row in self._write_conn.execute("PRAGMA table_info(bins)")}
+            if "offline_threshold" not in bin_columns:
+                self._write_conn.execute("ALTER TABLE bins ADD COLUMN offline_threshold REAL")
+            # Ledger sequence numbers and idempotency keys were added with the credit ledger
+            event_columns = {row["name"] for row in self._write_conn.execute("PRAGMA table_info(recycling_events)")}
+            if "ledger_seq" not in event_columns:
+                self._write_conn.execute("ALTER TABLE recycling_events ADD COLUMN ledger_seq INTEGER")
+                self._write_conn.execute("ALTER TABLE recycling_events ADD COLUMN idempotency_key TEXT")
+        self._write_conn.executescript(LEDGER_INDEXES_SQL)
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._readers.conn = conn
+        return conn
+
+    # --- Write-behind batching ---
+    def _pending_count(self) -> int:
+        return len(self._pending_events) + len(self._pending_users) + len(self._pending_bins) + len(self._pending_totals)
+
+    def _enqueued(self) -> None:
+        if self._pending_count() >= self.flush_batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        """Commits everything pending in one transaction."""
+        with self._write_lock:
+            with self._pending_lock:
+                events, self._pending_events = self._pending_events, []
+                self._flushing_events = events
+                users, self._pending_users = self._pending_users, {}
+                bins, self._pending_bins = self._pending_bins, {}
+                totals, self._pending_totals = self._pending_totals, {}
+            if not (events or users or bins or totals):
+                return
+            rejected: list[tuple] = []
+            try:
+                with self._write_conn:
+                    if events:
+                        rejected = self._insert_events(events)
+                    stored_users, stored_totals = (users, totals) if not rejected else self._without(rejected, users, totals)
+                    if stored_users:
+                        self._write_conn.executemany(UPSERT_USER_SQL, stored_users.items())
+                    if stored_totals:
+                        self._write_conn.executemany(ADD_TOTALS_SQL, [(user_id, category, count, credits) for (user_id, category), (count, credits) in stored_totals.items()])
+                    if bins:
+                        self._write_conn.executemany(UPSERT_BIN_SQL, bins.values())
+            except sqlite3.Error:
+                # The transaction rolled back; put the batch back so the next flush retries it
+                with self._pending_lock:
+                    self._flushing_events = []
+                    self._pending_events[:0] = events
+                    self._pending_users = {**users, **self._pending_users}
+                    self._pending_bins = {**bins, **self._pending_bins}
+                    for key, (count, credits) in totals.items():
+                        pending_total = self._pending_totals.setdefault(key, [0, 0])
+                        pending_total[0] += count
+                        pending_total[1] += credits
+                raise
+            with self._pending_lock:
+                self._flushing_events = []
+            if rejected:
+                self._take_back(rejected)
+
+    def _insert_events(self, events: list[tuple]) -> list[tuple]:
+        """Inserts a batch of events inside the open transaction. Returns the events that were not stored."""
+        self._write_conn.execute("SAVEPOINT insert_events")
+        try:
+            inserted = self._write_conn.executemany(INSERT_EVENT_SQL, events).rowcount
+        except sqlite3.IntegrityError:
+            # One bad row must not hold back the others: redo the batch row by row and skip the ones that fail
+            self._write_conn.execute("ROLLBACK TO insert_events")
+            inserted = 0
+            for event in events:
+                try:
+                    inserted += self._write_conn.execute(INSERT_EVENT_SQL, event).rowcount
+                except sqlite3.IntegrityError as e:
+                    logger.error(f"Dropping recycling event {event[0]} for {event[1]}: {e}")
+        self._write_conn.execute("RELEASE insert_events")
+        if inserted == len(events):
+            return []
+        # Ids are ours and ascending, so whatever in this range is missing was not stored
+        stored = {row[0] for row in self._write_conn.execute("SELECT id FROM recycling_events WHERE id BETWEEN ? AND ?", (events[0][0], events[-1][0]))}
+        rejected = [event for event in events if event[0] not in stored]
+        for event in rejected:
+            if event[8] is not None:
+                logger.warning(f"Dropping recycling event {event[0]} for {event[1]}: idempotency key {event[8]!r} is already recorded")
+        return rejected
+
+    @staticmethod
+    def _without(rejected: list[tuple], users: dict[str, int], totals: dict[tuple[str, str], list[int]]) -> tuple[dict, dict]:
+        """Copies of a batch's user balances and category deltas with the rejected events' credits taken out."""
+        users = dict(users)
+        totals = {key: list(total) for key, total in totals.items()}
+        for _, user_id, _, category, _, credits, *_ in rejected:
+            if user_id in users:
+                users[user_id] -= credits
+            total = totals.get((user_id, category))
+            if total is not None:
+                total[0] -= 1
+                total[1] -= credits
+                if total == [0, 0]:
+                    del totals[(user_id, category)]
+        return users, totals
+
+    def _take_back(self, rejected: list[tuple]) -> None:
+        # The rejected events were counted in memory when they were queued
+        with self._pending_lock:
+            for _, user_id, _, category, _, credits, *_ in rejected:
+                self._credits[user_id] = self._credits.get(user_id, 0) - credits
+                if user_id in self._pending_users:
+                    self._pending_users[user_id] -= credits
+                total = self._totals.get(user_id, {}).get(category)
+                if total is not None:
+                    total[0] -= 1
+                    total[1] -= credits
+
+    def checkpoint(self) -> None:
+        """Flushes and copies the WAL into the database file, fsynced.
+
+        With synchronous=NORMAL a commit is only durable once the WAL is synced,
+        which may not have happened yet; callers that are about to discard their
+        own copy of the data (the credit ledger compacting its log) need this.
+        """
+        self.flush()
+        with self._write_lock:
+            busy, _, _ = self._write_conn.execute("PRAGMA wal_checkpoint(FULL)").fetchone()
+        if busy:
+            raise sqlite3.OperationalError("WAL checkpoint could not complete (database busy)")
+
+    def _writer_loop(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Storage flush failed: {e}")
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        self._write_conn.close()
+
+    # --- Users and recycling events ---
+    def get_credits(self, user_id: str) -> int:
+        credits = self._credits.get(user_id)
+        if credits is None:
+            row = self._reader().execute("SELECT credits FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            credits = row["credits"] if row else 0
+            with self._pending_lock:
+                credits = self._credits.setdefault(user_id, credits)
+        return credits
+
+    def category_totals(self, user_id: str) -> dict[str, dict]:
+        """Lifetime {category: {"count", "credits"}} for a user, maintained at write time."""
+        totals = self._totals_for(user_id)
+        with self._pending_lock:
+            return {category: {"count": count, "credits": credits} for category, (count, credits) in totals.items()}
+
+    def _totals_for(self, user_id: str) -> dict[str, list[int]]:
+        totals = self._totals.get(user_id)
+        if totals is None:
+            self.flush() # Pending deltas for this user would otherwise be counted twice
+            rows = self._reader().execute("SELECT category, count, credits FROM user_category_totals WHERE user_id = ?", (user_id,)).fetchall()
+            loaded = {row["category"]: [row["count"], row["credits"]] for row in rows}
+            with self._pending_lock:
+                totals = self._totals.setdefault(user_id, loaded)
+        return totals
+
+    def record_event(self, user_id: str, bin_id: str, category: str, item_name: str, credits: int, timestamp: str,
+                     ledger_seq: Optional[int] = None, idempotency_key: Optional[str] = None) -> tuple[int, dict]:
+        """Queues a recycling event. Returns the user's new credit balance and the event as stored."""
+        self.get_credits(user_id)
+        totals = self._totals_for(user_id)
+        with self._pending_lock:
+            event_id = self._next_event_id
+            self._next_event_id += 1
+            balance = self._credits[user_id] + credits
+            self._credits[user_id] = balance
+            self._pending_users[user_id] = balance
+            self._pending_events.append((event_id, user_id, bin_id, category, item_name, credits, timestamp, ledger_seq, idempotency_key))
+            category_total = totals.setdefault(category, [0, 0])
+            category_total[0] += 1
+            category_total[1] += credits
+            pending_total = self._pending_totals.setdefault((user_id, category), [0, 0])
+            pending_total[0] += 1
+            pending_total[1] += credits
+        self._enqueued()
+        event = {"id": event_id, "category": category, "item_name": item_name, "timestamp": timestamp, "bin_id": bin_id, "credits": credits}
+        return balance, event
+
+    def _unflushed_events(self, user_id: Optional[str] = None) -> list[tuple]:
+        """Queued and in-flight event rows (optionally one user's), oldest first."""
+        with self._pending_lock:
+            rows = self._flushing_events + self._pending_events
+        return rows if user_id is None else [row for row in rows if row[1] == user_id]
+
+    @staticmethod
+    def _event_dict(row: tuple) -> dict:
+        event_id, _, bin_id, category, item_name, credits, timestamp, *_ = row
+        return {"id": event_id, "category": category, "item_name": item_name, "timestamp": timestamp, "bin_id": bin_id, "credits": credits}
+
+    def events_page(self, user_id: str, limit: int, before_id: Optional[int] = None) -> tuple[list[dict], bool]:
+        """The `limit` most recent events older than before_id, oldest first, plus whether older ones remain."""
+        # Unflushed rows are read before the database, so one committed in between shows up in both rather than neither
+        events = {row[0]: self._event_dict(row) for row in self._unflushed_events(user_id) if before_id is None or row[0] < before_id}
+        query = f"SELECT {EVENT_COLUMNS} FROM recycling_events WHERE user_id = ?"
+        params: tuple = (user_id,)
+        if before_id is not None:
+            query += " AND id < ?"
+            params += (before_id,)
+        query += " ORDER BY id DESC LIMIT ?"
+        for row in self._reader().execute(query, params + (limit + 1,)):
+            events.setdefault(row["id"], dict(row))
+        rows = [events[event_id] for event_id in sorted(events, reverse=True)[:limit + 1]]
+        return list(reversed(rows[:limit])), len(rows) > limit
+
+    def events_since(self, user_id: str, after_id: int, limit: int) -> tuple[list[dict], bool]:
+        """Up to `limit` events newer than after_id, oldest first, plus whether more newer ones remain."""
+        events = {row[0]: self._event_dict(row) for row in self._unflushed_events(user_id) if row[0] > after_id}
+        query = f"SELECT {EVENT_COLUMNS} FROM recycling_events WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT ?"
+        for row in self._reader().execute(query, (user_id, after_id, limit + 1)):
+            events.setdefault(row["id"], dict(row))
+        rows = [events[event_id] for event_id in sorted(events)[:limit + 1]]
+        return rows[:limit], len(rows) > limit
+
+    def recent_events(self, user_id: str, limit: int) -> list[dict]:
+        return self.events_page(user_id, limit)[0]
+
+    # --- Ledger bookkeeping ---
+    def last_ledger_seq(self) -> int:
+        """Highest ledger sequence number with a recorded event; ledger records after it need replaying."""
+        unflushed = max((row[7] or 0 for row in self._unflushed_events()), default=0)
+        committed = self._reader().execute("SELECT MAX(ledger_seq) FROM recycling_events").fetchone()[0] or 0
+        return max(unflushed, committed)
+
+    def idempotency_keys(self, limit: int) -> list[tuple[str, int]]:
+        """The `limit` most recent (idempotency key, ledger seq) pairs, oldest first."""
+        unflushed = [(row[8], row[7]) for row in self._unflushed_events() if row[8] is not None]
+        rows = self._reader().execute(
+            "SELECT idempotency_key, ledger_seq FROM recycling_events WHERE idempotency_key IS NOT NULL ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        keys = dict((row[0], row[1]) for row in reversed(rows))
+        keys.update(unflushed)
+        return list(keys.items())[-limit:] if limit else []
+
+    def ledger_seq_for_key(self, idempotency_key: str) -> Optional[int]:
+        """Ledger sequence number of the event recorded under an idempotency key, queued or committed."""
+        for row in reversed(self._unflushed_events()):
+            if row[8] == idempotency_key:
+                return row[7]
+        row = self._reader().execute("SELECT ledger_seq FROM recycling_events WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+        return row[0] if row else None
+
+    def event_for_ledger_seq(self, ledger_seq: int) -> Optional[tuple[str, dict]]:
+        """(user_id, event) recorded for a ledger sequence number, queued or committed."""
+        for row in reversed(self._unflushed_events()):
+            if row[7] == ledger_seq:
+                return row[1], self._event_dict(row)
+        row = self._reader().execute(f"SELECT user_id, {EVENT_COLUMNS} FROM recycling_events WHERE ledger_seq = ?", (ledger_seq,)).fetchone()
+        if row is None:
+            return None
+        event = dict(row)
+        return event.pop("user_id"), event
+
+    # --- Bins ---
+    def load_bins(self) -> dict[str, dict]:
+        rows = self._reader().execute(f"SELECT {', '.join(BIN_COLUMNS)} FROM bins").fetchall()
+        return {row["id"]: dict(row) for row in rows}
+
+    def save_bin(self, bin_info: dict) -> None:
+        """Queues an upsert of the bin's current state; later saves in the same batch replace earlier ones."""
+        row = {column: bin_info.get(column, BIN_DEFAULTS.get(column)) for column in BIN_COLUMNS}
+        with self._pending_lock:
+            self._pending_bins[row["id"]] = row
+        self._enqueued()
@@ -0,0 +1,206 @@
+# telemetry.py
+import json
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BATCH_ENDPOINT = "/bin-telemetry/batch"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+ARDUINO_LINE_PATTERN = re.compile(r"Distance: (\d+) cm \| Status: (.+)")
+
+
+# --- Arduino line parsing ---
+def parse_arduino_line(line: str) -> Optional[tuple[int, str]]:
+    """Extracts (distance_cm, status_text) from a line like 'Distance: 12 cm | Status: Half'."""
+    match = ARDUINO_LINE_PATTERN.search(line)
+    if not match:
+        return None
+    return int(match.group(1)), match.group(2)
+
+def compute_fill_percentage(distance_cm: int, bin_height: float) -> int:
+    """0% full when the sensor reads the bin height, 100% when it reads 0 (closer means fuller)."""
+    fill_level_distance = max(0, bin_height - distance_cm)
+    return round(min(100, (fill_level_distance / bin_height) * 100))
+
+def status_record(bin_id: str, distance_cm: int, fill_percentage: int, status_text: str, timestamp: Optional[int] = None) -> dict:
+    return {
+        "type": "status",
+        "bin_id": bin_id,
+        "distance_cm": distance_cm,
+        "fill_percentage": fill_percentage,
+        "status_text": status_text,
+        "timestamp": int(time.time()) if timestamp is None else timestamp,
+    }
+
+def heartbeat_record(bin_id: str, timestamp: Optional[int] = None) -> dict:
+    return {"type": "heartbeat", "bin_id": bin_id, "timestamp": int(time.time()) if timestamp is None else timestamp}
+
+def encode_ndjson(records: list[dict]) -> bytes:
+    return "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode()
+
+
+# --- Disk spool for readings the server could not take ---
+class TelemetrySpool:
+    """Append-only NDJSON file holding status readings until the server is reachable again.
+
+    Heartbeats are never spooled: a stale heartbeat says nothing useful about
+    whether the bin is online now. The file is capped at `max_bytes`; past that
+    new readings are dropped (and counted) rather than filling the disk.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dropped = 0
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def append(self, records: list[dict]) -> None:
+        records = [record for record in records if record.get("type") == "status"]
+        if not records:
+            return
+        data = encode_ndjson(records)
+        if self.size() + len(data) > self.max_bytes:
+            self.dropped += len(records)
+            print(f"Warning: Telemetry spool {self.path} is full; dropped {len(records)} readings ({self.dropped} total).")
+            return
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def read(self) -> list[dict]:
+        try:
+            with open(self.path, "rb") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue # Torn write from a crash; skip the partial line
+        return records
+
+    def replace(self, records: list[dict]) -> None:
+        """Rewrites the spool with only the records still unsent (atomically, via a temp file)."""
+        if not records:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encode_ndjson(records))
+        os.replace(tmp_path, self.path)
+
+
+# --- Buffered sender ---
+class TelemetrySender:
+    """Buffers gateway telemetry and posts it to the batch endpoint as NDJSON over one pooled Session.
+
+    A background thread flushes every `flush_interval` seconds, or as soon as
+    `max_batch` records are buffered. If the server is unreachable, status
+    readings go to the disk spool and are replayed (oldest first) on the next
+    successful flush.
+    """
+
+    def __init__(self, api_base_url: str, max_batch: int = 100, flush_interval: float = 2.0,
+                 spool_path: str = "telemetry_spool.ndjson", timeout: float = 5.0):
+        self.url = api_base_url.rstrip("/") + BATCH_ENDPOINT
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.spool = TelemetrySpool(spool_path)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._buffer: list[dict] = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telemetry-sender", daemon=True)
+        self._thread.start()
+
+    def add(self, record: dict) -> None:
+        with self._lock:
+            self._buffer.append(record)
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def add_status(self, bin_id: str, distance_cm: int, fill_percentage: int, status_text: str) -> None:
+        self.add(status_record(bin_id, distance_cm, fill_percentage, status_text))
+
+    def add_heartbeat(self, bin_id: str) -> None:
+        self.add(heartbeat_record(bin_id))
+
+    def _post(self, records: list[dict]) -> bool:
+        """Posts one batch. Returns False if the server could not be reached (the caller spools)."""
+        try:
+            response = self.session.post(self.url, data=encode_ndjson(records),
+                                         headers={"Content-Type": NDJSON_MEDIA_TYPE}, timeout=self.timeout)
+        except requests.exceptions.ConnectionError:
+            print(f"Warning: Could not connect to FastAPI server at {self.url}. Is it running?")
+            return False
+        except requests.exceptions.Timeout:
+            print("Warning: Request to FastAPI server timed out.")
+            return False
+        if response.status_code >= 500:
+            print(f"Warning: Server error {response.status_code} when sending telemetry.")
+            return False
+        if response.status_code >= 400:
+            # The server rejected the data itself; retrying the same records would fail forever
+            print(f"Warning: Telemetry batch rejected ({response.status_code}): {response.text}")
+        return True
+
+    def _replay_spool(self) -> bool:
+        records = self.spool.read()
+        for start in range(0, len(records), self.max_batch):
+            if not self._post(records[start:start + self.max_batch]):
+                self.spool.replace(records[start:])
+                return False
+        if records:
+            print(f"Replayed {len(records)} spooled readings.")
+            self.spool.replace([])
+        return True
+
+    def flush(self) -> None:
+        with self._send_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+            if self.spool.size() and not self._replay_spool():
+                self.spool.append(records)
+                return
+            for start in range(0, len(records), self.max_batch):
+                chunk = records[start:start + self.max_batch]
+                if not self._post(chunk):
+                    self.spool.append(records[start:])
+                    return
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"An unexpected error occurred while sending telemetry: {e}")
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=self.timeout * 2)
+        self.flush()
+        self.session.close()
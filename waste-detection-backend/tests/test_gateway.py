@@ -0,0 +1,127 @@
+# test_gateway.py
+"""gateway.py end to end: fake Arduino bins on pseudo-terminals, readings posted to a local HTTP server."""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_serial import open_fake_port  # noqa: E402
+from gateway import AsyncTelemetrySender, BinPortConfig, GatewayConfig, run_gateway  # noqa: E402
+from telemetry import BATCH_ENDPOINT, NDJSON_MEDIA_TYPE, status_record  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs POSIX pseudo-terminals")
+
+
+class TelemetryServer:
+    """Stands in for the backend: records every NDJSON batch posted to the batch endpoint."""
+
+    def __init__(self):
+        self.batches: list[tuple[str, str, list[dict]]] = [] # (path, content type, records)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                records = [json.loads(line) for line in body.splitlines() if line]
+                server.batches.append((self.path, self.headers["Content-Type"], records))
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def records(self, record_type: str) -> list[dict]:
+        return [record for _, _, records in list(self.batches) for record in records if record["type"] == record_type]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+async def wait_until(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for the gateway")
+        await asyncio.sleep(0.05)
+
+
+def test_gateway_parses_lines_from_each_port_and_posts_them(tmp_path):
+    ports = {bin_id: open_fake_port() for bin_id in ("A01", "B03")}
+    try:
+        with TelemetryServer() as server:
+            config = GatewayConfig(
+                bins=[BinPortConfig(port=path, bin_id=bin_id, bin_height=62) for bin_id, (_, path, _) in ports.items()],
+                api_base_url=server.url,
+                heartbeat_interval=0.2,
+                flush_interval=0.1,
+                spool_path=str(tmp_path / "spool.ndjson"),
+            )
+
+            async def scenario():
+                stop = asyncio.Event()
+                gateway = asyncio.create_task(run_gateway(config, stop))
+                # Wait until both ports are open, so nothing written below is lost
+                await wait_until(lambda: {record["bin_id"] for record in server.records("heartbeat")} == set(ports))
+                os.write(ports["A01"][0], b"Distance: 31 cm | Status: Half\r\n")
+                os.write(ports["A01"][0], b"garbage from a reset\r\n")
+                os.write(ports["B03"][0], b"Distance: 0 cm | Status: Full\r\n")
+                await wait_until(lambda: len(server.records("status")) == 2)
+                stop.set()
+                await asyncio.wait_for(gateway, 10)
+
+            asyncio.run(scenario())
+    finally:
+        for master_fd, _, slave_fd in ports.values():
+            os.close(master_fd)
+            os.close(slave_fd)
+
+    assert {(path, content_type) for path, content_type, _ in server.batches} == {(BATCH_ENDPOINT, NDJSON_MEDIA_TYPE)}
+    statuses = {record["bin_id"]: record for record in server.records("status")}
+    assert statuses["A01"]["distance_cm"] == 31
+    assert statuses["A01"]["fill_percentage"] == 50
+    assert statuses["A01"]["status_text"] == "Half"
+    assert statuses["B03"]["distance_cm"] == 0
+    assert statuses["B03"]["fill_percentage"] == 100
+    assert statuses["B03"]["status_text"] == "Full"
+    assert not (tmp_path / "spool.ndjson").exists() # Everything was delivered
+
+
+def test_flush_cancelled_mid_post_spools_the_batch(tmp_path):
+    posted = asyncio.Event()
+
+    async def hang(request):
+        posted.set()
+        await asyncio.Event().wait() # The server never answers
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(hang)) as client:
+            sender = AsyncTelemetrySender(client, "http://backend", max_batch=2, spool_path=str(tmp_path / "spool.ndjson"))
+            for n in range(3):
+                sender.add(status_record(f"B{n:02d}", 31, 50, "Half"))
+            flush = asyncio.create_task(sender.flush())
+            await asyncio.wait_for(posted.wait(), 5)
+            flush.cancel() # As run_gateway does to sender.run() on shutdown
+            with pytest.raises(asyncio.CancelledError):
+                await flush
+            return sender.spool.read()
+
+    spooled = asyncio.run(scenario())
+    assert [record["bin_id"] for record in spooled] == ["B00", "B01", "B02"]
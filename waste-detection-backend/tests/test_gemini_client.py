@@ -0,0 +1,73 @@
+# test_gemini_client.py
+"""GeminiClient.stream against a fake model: the stream is closed however iteration ends."""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_client import GeminiClient  # noqa: E402
+
+
+class FakeResponse:
+    """Streamed response whose chunk iterator and close() record that they were cleaned up."""
+
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.chunks_closed = False
+        self.closed = False
+
+    async def _chunks(self):
+        try:
+            for text in self.texts:
+                yield SimpleNamespace(text=text)
+        finally:
+            self.chunks_closed = True
+
+    def __aiter__(self):
+        return self._chunks()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeModel:
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.responses: list[FakeResponse] = []
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.responses.append(FakeResponse(self.texts))
+        return self.responses[-1]
+
+
+def fake_client(texts: list[str]) -> tuple[GeminiClient, FakeModel]:
+    client = GeminiClient(max_concurrency=1)
+    model = client._models["fake"] = FakeModel(texts)
+    return client, model
+
+
+def test_stream_read_to_the_end_is_closed():
+    client, model = fake_client(["Put it ", "in the blue bin."])
+
+    async def scenario():
+        return [text async for text in client.stream("prompt", model_name="fake")]
+
+    assert asyncio.run(scenario()) == ["Put it ", "in the blue bin."]
+    assert model.responses[0].chunks_closed and model.responses[0].closed
+    assert not client._semaphore.locked()
+
+
+def test_stream_abandoned_by_the_consumer_is_closed():
+    client, model = fake_client(["Put it ", "in the blue bin."])
+
+    async def scenario():
+        stream = client.stream("prompt", model_name="fake")
+        first = await stream.__anext__()
+        await stream.aclose() # What StreamingResponse does when the browser disconnects
+        return first
+
+    assert asyncio.run(scenario()) == "Put it "
+    assert model.responses[0].chunks_closed and model.responses[0].closed
+    assert not client._semaphore.locked()
@@ -0,0 +1,111 @@
+# test_ledger.py
+"""Credit ledger: replay after a crash, torn tails, failed applies and compaction against real storage."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import ApplyFailed, Ledger, encode_record  # noqa: E402
+from storage import Storage  # noqa: E402
+
+
+class Applied:
+    """apply callback that records what it was given."""
+
+    def __init__(self):
+        self.records: list[tuple[int, str, dict]] = []
+
+    def __call__(self, seq, key, data):
+        self.records.append((seq, key, data))
+        return seq
+
+
+def test_unapplied_tail_is_replayed_on_startup(tmp_path):
+    path = str(tmp_path / "credits.ledger")
+    first = Applied()
+    ledger = Ledger(path, first)
+    for n in range(1, 4):
+        assert ledger.append({"n": n}, f"key-{n}")[1].result(timeout=5) == n
+    ledger.close()
+
+    # The database had only seen record 1 when the process died
+    replayed = Applied()
+    ledger = Ledger(path, replayed, applied_through=1, known_keys=[("key-1", 1)])
+    assert replayed.records == [(2, "key-2", {"n": 2}), (3, "key-3", {"n": 3})]
+    # Replayed keys are remembered, and numbering carries on after the log
+    seq, _, duplicate = ledger.append({"n": 3}, "key-3")
+    assert (seq, duplicate) == (3, True)
+    assert ledger.append({"n": 4})[0] == 4
+    ledger.close()
+
+
+@pytest.mark.parametrize("tail", [
+    b"0000", # Write cut off mid-record
+    encode_record(3, "key-3", {"n": 3}).replace(b'"n":3', b'"n":9'), # Complete line, CRC does not match
+])
+def test_torn_or_corrupt_last_record_is_dropped(tmp_path, tail):
+    path = str(tmp_path / "credits.ledger")
+    ledger = Ledger(path, Applied())
+    for n in range(1, 3):
+        ledger.append({"n": n}, f"key-{n}")[1].result(timeout=5)
+    ledger.close()
+    valid_size = os.path.getsize(path)
+    with open(path, "ab") as log:
+        log.write(tail)
+
+    replayed = Applied()
+    ledger = Ledger(path, replayed)
+    assert [seq for seq, _, _ in replayed.records] == [1, 2]
+    assert os.path.getsize(path) == valid_size # Truncated back to the last good record
+    assert ledger.append({"n": 3}, "key-3")[0] == 3
+    ledger.close()
+
+
+def test_failed_apply_does_not_claim_the_key(tmp_path):
+    calls = []
+
+    def apply(seq, key, data):
+        calls.append(seq)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return seq
+
+    ledger = Ledger(str(tmp_path / "credits.ledger"), apply)
+    _, applied, _ = ledger.append({"n": 1}, "key-1")
+    with pytest.raises(ApplyFailed):
+        applied.result(timeout=5)
+    # The retry is a new record, not a duplicate of one that never took effect
+    seq, applied, duplicate = ledger.append({"n": 1}, "key-1")
+    assert not duplicate
+    assert applied.result(timeout=5) == seq == 2
+    assert ledger.append({"n": 1}, "key-1")[2]
+    ledger.close()
+
+
+def test_compaction_keeps_credits_and_totals(tmp_path):
+    db_path, log_path = str(tmp_path / "trashnet.db"), str(tmp_path / "credits.ledger")
+    storage = Storage(db_path)
+
+    def apply(seq, key, data):
+        return storage.record_event(data["user_id"], "A01", data["category"], "item", data["credits"], "2024-01-01 00:00:00",
+                                    ledger_seq=seq, idempotency_key=key)
+
+    ledger = Ledger(log_path, apply, checkpoint=storage.checkpoint, max_log_bytes=1024)
+    for n in range(40):
+        category = "plastic" if n % 2 else "glass"
+        ledger.append({"user_id": "u1", "category": category, "credits": 10}, f"key-{n}")[1].result(timeout=5)
+    assert ledger.stats()["log_bytes"] < 1024 # Compacted at least once
+    ledger.close()
+    storage.close()
+
+    storage = Storage(db_path)
+    replayed = Applied()
+    ledger = Ledger(log_path, replayed, applied_through=storage.last_ledger_seq(), known_keys=storage.idempotency_keys(100))
+    assert replayed.records == []
+    assert storage.get_credits("u1") == 400
+    assert storage.category_totals("u1") == {"glass": {"count": 20, "credits": 200}, "plastic": {"count": 20, "credits": 200}}
+    assert ledger.append({}, "key-0")[2] # Keys from before compaction still dedupe
+    ledger.close()
+    storage.close()
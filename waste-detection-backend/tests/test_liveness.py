@@ -0,0 +1,48 @@
+# test_liveness.py
+"""Bin liveness: deadlines expire, and transitions reach the callback in the order they happened."""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from liveness import LivenessTracker  # noqa: E402
+
+
+def test_bin_goes_offline_after_its_timeout_and_back_online_when_seen():
+    seen = []
+    tracker = LivenessTracker(default_timeout=5, on_transition=lambda bin_id, online, _: seen.append((bin_id, online)))
+    now = time.time()
+    tracker.touch("A01", now)
+    tracker.set_timeout("B03", 60)
+    tracker.touch("B03", now)
+    assert tracker.advance(now + 4) == []
+    assert tracker.advance(now + 6) == ["A01"]
+    assert not tracker.is_online("A01") and tracker.is_online("B03")
+    tracker.touch("A01", time.time())
+    assert seen == [("A01", True), ("B03", True), ("A01", False), ("A01", True)]
+
+
+def test_touch_during_a_slow_expiry_is_delivered_after_it():
+    delivered = []
+    offline_started = threading.Event()
+
+    def on_transition(bin_id, online, timestamp):
+        if not online:
+            offline_started.set()
+            time.sleep(0.2) # E.g. saving the bin and publishing to a slow subscriber
+        delivered.append(online)
+
+    tracker = LivenessTracker(default_timeout=1, on_transition=on_transition)
+    tracker.touch("A01", time.time())
+    delivered.clear()
+
+    expiry = threading.Thread(target=tracker.advance, args=(time.time() + 5,))
+    expiry.start()
+    assert offline_started.wait(5)
+    tracker.touch("A01", time.time()) # Seen again while the offline callback is still running
+    expiry.join()
+
+    assert tracker.is_online("A01")
+    assert delivered == [False, True] # The last thing the callback was told matches the tracker
@@ -0,0 +1,85 @@
+# test_storage.py
+"""Write-behind storage: rejected rows in a batch, and event reads that span committed and queued rows."""
+import os
+import sys
+from typing import Optional
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Storage  # noqa: E402
+
+TIMESTAMP = "2024-01-01 00:00:00"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    # The writer thread never wakes on its own, so each test decides when a batch is committed
+    storage = Storage(str(tmp_path / "trashnet.db"), flush_interval=3600)
+    yield storage
+    storage.close()
+
+
+def record(storage: Storage, user_id: str, category: str = "plastic", item_name: str = "bottle", credits: int = 10, key: Optional[str] = None) -> dict:
+    return storage.record_event(user_id, "A01", category, item_name, credits, TIMESTAMP, idempotency_key=key)[1]
+
+
+def test_rejected_rows_are_skipped_and_their_credits_taken_back(tmp_path):
+    storage = Storage(str(tmp_path / "trashnet.db"), flush_interval=3600)
+    record(storage, "u1", key="key-1")
+    storage.flush()
+    record(storage, "u1", category="glass", credits=5)
+    record(storage, "u1", item_name=None, credits=100) # NOT NULL fails, so the batch is redone row by row
+    record(storage, "u1", credits=50, key="key-1") # Key already stored
+    record(storage, "u1", category="glass", credits=5)
+    assert storage.get_credits("u1") == 170 # Counted when queued
+    storage.flush()
+
+    expected_totals = {"glass": {"count": 2, "credits": 10}, "plastic": {"count": 1, "credits": 10}}
+    assert storage.get_credits("u1") == 20
+    assert storage.category_totals("u1") == expected_totals
+    assert [event["credits"] for event in storage.recent_events("u1", 10)] == [10, 5, 5]
+    storage.close()
+
+    # What was committed agrees with what was kept in memory
+    reopened = Storage(storage.path)
+    assert reopened.get_credits("u1") == 20
+    assert reopened.category_totals("u1") == expected_totals
+    reopened.close()
+
+
+def test_reads_merge_committed_and_queued_events(storage):
+    committed = [record(storage, "u1", credits=n) for n in range(1, 4)]
+    record(storage, "other-user")
+    storage.flush()
+    queued = [record(storage, "u1", credits=n) for n in range(4, 6)]
+
+    page, more = storage.events_page("u1", 10)
+    assert page == committed + queued
+    assert not more
+    assert storage.events_since("u1", committed[1]["id"], 10) == ([committed[2]] + queued, False)
+    assert storage.events_since("u1", committed[0]["id"], 2) == ([committed[1], committed[2]], True)
+
+
+def test_cursor_pagination_across_a_flush(storage):
+    events = [record(storage, "u1", credits=n) for n in range(1, 4)]
+    storage.flush()
+    events += [record(storage, "u1", credits=n) for n in range(4, 7)]
+
+    pages = []
+    page, more = storage.events_page("u1", 2)
+    pages.append(page)
+    storage.flush() # Everything the first page showed from the queue is now committed
+    while more:
+        page, more = storage.events_page("u1", 2, before_id=page[0]["id"])
+        pages.append(page)
+    assert pages == [events[4:6], events[2:4], events[0:2]]
+
+    # Same walk forwards, with a new event queued part way through
+    seen, more = storage.events_since("u1", 0, 4)
+    latest = record(storage, "u1", credits=7)
+    while more or seen[-1]["id"] < latest["id"]:
+        page, more = storage.events_since("u1", seen[-1]["id"], 4)
+        seen += page
+    assert seen == events + [latest]
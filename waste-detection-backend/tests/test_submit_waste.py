@@ -0,0 +1,80 @@
+# test_submit_waste.py
+"""/submit-waste through the credit ledger: idempotent retries, and 503 whenever a submission is not acknowledged."""
+import os
+import sqlite3
+import sys
+import tempfile
+from concurrent.futures import Future
+
+import pytest
+
+DATA_DIR = tempfile.mkdtemp(prefix="trashnet-test-")
+# Set before main is imported: state goes to a scratch directory and nothing but storage and credits starts
+os.environ.update(
+    TRASHNET_DB_PATH=os.path.join(DATA_DIR, "trashnet.db"),
+    CREDIT_LEDGER_PATH=os.path.join(DATA_DIR, "credits.ledger"),
+    ENABLE_CAMERA="0", ENABLE_CLASSIFIER="0", ENABLE_CHAT="0", ENABLE_TELEMETRY="0",
+    LOG_LEVEL="CRITICAL",
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def submission(user_id: str, key: str, category: str = "plastic", credits: int = 10) -> dict:
+    return {"user_id": user_id, "bin_id": "A01", "category": category, "specific_item": "bottle", "credits_value": credits,
+            "idempotency_key": key}
+
+
+def test_repeated_key_returns_the_original_event(client):
+    first = client.post("/submit-waste", json=submission("dup-user", "dup-key"))
+    assert first.status_code == 200
+    retry = client.post("/submit-waste", json=submission("dup-user", "dup-key", category="glass", credits=20))
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json()["credits"] == 10
+    assert retry.json()["recycled_items"] == first.json()["recycled_items"]
+    # The header works the same as the body field
+    body = submission("dup-user", None)
+    assert client.post("/submit-waste", json=body, headers={"Idempotency-Key": "dup-key"}).json()["credits"] == 10
+
+
+def test_key_of_another_users_submission_is_rejected(client):
+    assert client.post("/submit-waste", json=submission("owner", "shared-key")).status_code == 200
+    response = client.post("/submit-waste", json=submission("someone-else", "shared-key"))
+    assert response.status_code == 409
+    assert client.get("/user-credits/someone-else").json()["credits"] == 0
+
+
+def test_unacknowledged_submission_is_a_503(client, monkeypatch):
+    never_done = Future()
+    monkeypatch.setattr(main, "LEDGER_ACK_TIMEOUT", 0.05)
+    monkeypatch.setattr(main.credit_ledger, "append", lambda record, key: (1, never_done, False))
+    response = client.post("/submit-waste", json=submission("slow-user", "slow-key"))
+    assert response.status_code == 503
+
+
+def test_failed_apply_is_a_503_and_the_retry_is_credited_once(client, monkeypatch):
+    record_event = main.storage.record_event
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(main.storage, "record_event", locked)
+    assert client.post("/submit-waste", json=submission("unlucky-user", "unlucky-key")).status_code == 503
+    monkeypatch.setattr(main.storage, "record_event", record_event)
+
+    retry = client.post("/submit-waste", json=submission("unlucky-user", "unlucky-key"))
+    assert retry.status_code == 200
+    assert "Idempotent-Replayed" not in retry.headers
+    again = client.post("/submit-waste", json=submission("unlucky-user", "unlucky-key"))
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert client.get("/user-credits/unlucky-user").json()["credits"] == 10
@@ -0,0 +1,164 @@
+# timeseries.py
+import math
+import threading
+from typing import Optional
+
+import numpy as np
+
+# (bucket width in seconds, number of buckets kept) for each rollup level, finest first
+DEFAULT_ROLLUPS = ((60, 720), (3600, 720)) # 12 hours of minutes, 30 days of hours
+
+
+class _Ring:
+    """Fixed-capacity columnar ring of (bucket start, min, max, sum, count) rows.
+
+    With width=1 every reading is its own row, which is how raw points are kept.
+    Rows are appended in time order; a reading for the currently open bucket
+    is folded into it in place.
+    """
+
+    def __init__(self, width: int, capacity: int):
+        self.width = width
+        self.capacity = capacity
+        self.start = np.zeros(capacity, dtype=np.uint32)
+        self.min = np.zeros(capacity, dtype=np.uint8)
+        self.max = np.zeros(capacity, dtype=np.uint8)
+        self.sum = np.zeros(capacity, dtype=np.uint32)
+        self.count = np.zeros(capacity, dtype=np.uint32)
+        self.head = -1
+        self.size = 0
+
+    @property
+    def oldest(self) -> Optional[int]:
+        if not self.size:
+            return None
+        return int(self.start[(self.head - self.size + 1) % self.capacity])
+
+    def add(self, timestamp: int, fill: int) -> bool:
+        """Returns False (and stores nothing) for a reading older than the newest bucket."""
+        bucket = timestamp - timestamp % self.width
+        if self.size:
+            latest = int(self.start[self.head])
+            if bucket < latest:
+                return False
+            if bucket == latest:
+                i = self.head
+                self.min[i] = min(self.min[i], fill)
+                self.max[i] = max(self.max[i], fill)
+                self.sum[i] += fill
+                self.count[i] += 1
+                return True
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        i = self.head
+        self.start[i] = bucket
+        self.min[i] = self.max[i] = fill
+        self.sum[i] = fill
+        self.count[i] = 1
+        return True
+
+    def range(self, start: int, end: int) -> tuple[np.ndarray, ...]:
+        """Rows with start <= bucket start <= end, oldest first."""
+        order = (np.arange(self.size) + (self.head - self.size + 1)) % self.capacity
+        starts = self.start[order]
+        lo = np.searchsorted(starts, start, side="left")
+        hi = np.searchsorted(starts, end, side="right")
+        rows = order[lo:hi]
+        return self.start[rows], self.min[rows], self.max[rows], self.sum[rows], self.count[rows]
+
+
+class BinSeries:
+    """Raw readings plus rollup levels for one bin."""
+
+    def __init__(self, raw_capacity: int, rollups: tuple = DEFAULT_ROLLUPS):
+        self.levels = [_Ring(1, raw_capacity)] + [_Ring(width, capacity) for width, capacity in rollups]
+        self.late_readings = 0
+
+    def add(self, timestamp: int, fill: int) -> None:
+        fill = max(0, min(100, int(fill)))
+        accepted = [level.add(timestamp, fill) for level in self.levels]
+        if not accepted[0]:
+            self.late_readings += 1
+
+    def pick_level(self, start: int, bucket_seconds: Optional[int]) -> _Ring:
+        """Finest level that still retains `start` and is not coarser than the requested bucket."""
+        candidates = [level for level in self.levels if bucket_seconds is None or level.width <= bucket_seconds]
+        candidates = candidates or self.levels[:1]
+        for level in candidates:
+            if level.oldest is not None and level.oldest <= start:
+                return level
+        # Nothing reaches back that far: use whichever level has the oldest data
+        populated = [level for level in candidates if level.oldest is not None]
+        return min(populated, key=lambda level: level.oldest) if populated else candidates[0]
+
+
+def rebucket(starts, mins, maxs, sums, counts, bucket_seconds: int) -> tuple[np.ndarray, ...]:
+    """Merges time-ordered rows into fixed-width buckets with vectorized reduceat."""
+    if len(starts) == 0:
+        return starts, mins, maxs, sums, counts
+    keys = starts.astype(np.int64) // bucket_seconds
+    first = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    return (
+        keys[first] * bucket_seconds,
+        np.minimum.reduceat(mins, first),
+        np.maximum.reduceat(maxs, first),
+        np.add.reduceat(sums.astype(np.int64), first),
+        np.add.reduceat(counts.astype(np.int64), first),
+    )
+
+
+class FillHistory:
+    """Bounded-memory fill-level history for every bin.
+
+    Each bin keeps its last `raw_capacity` readings plus minute and hour
+    rollups (min, max, sum, count per bucket) in preallocated NumPy rings, so
+    memory per bin is fixed no matter how fast readings arrive. Queries pick
+    the finest level that still covers the requested range and rebucket it.
+    """
+
+    def __init__(self, raw_capacity: int = 600, rollups: tuple = DEFAULT_ROLLUPS, max_points: int = 500):
+        self.raw_capacity = raw_capacity
+        self.rollups = rollups
+        self.max_points = max_points
+        self._series: dict[str, BinSeries] = {}
+        self._lock = threading.Lock()
+
+    def record(self, bin_id: str, timestamp: int, fill: int) -> None:
+        with self._lock:
+            series = self._series.get(bin_id)
+            if series is None:
+                series = self._series[bin_id] = BinSeries(self.raw_capacity, self.rollups)
+            series.add(timestamp, fill)
+
+    def query(self, bin_id: str, start: int, end: int, bucket_seconds: Optional[int] = None) -> dict:
+        """Bucketed min/max/avg between start and end (Unix seconds, inclusive) plus a summary over the whole range."""
+        with self._lock:
+            series = self._series.get(bin_id)
+            if series is None:
+                rows, width = (np.zeros(0, dtype=np.int64),) * 5, 1
+            else:
+                level = series.pick_level(start, bucket_seconds)
+                rows, width = level.range(start, end), level.width
+        if bucket_seconds is None:
+            bucket_seconds = max(width, math.ceil((end - start + 1) / self.max_points))
+        bucket_seconds = max(bucket_seconds, width)
+        starts, mins, maxs, sums, counts = rebucket(*rows, bucket_seconds)
+        total = int(counts.sum())
+        points = [
+            {"timestamp": int(t), "min": int(lo), "max": int(hi), "avg": round(float(s) / int(c), 2), "count": int(c)}
+            for t, lo, hi, s, c in zip(starts, mins, maxs, sums, counts)
+        ]
+        return {
+            "bin_id": bin_id,
+            "start": start,
+            "end": end,
+            "bucket_seconds": bucket_seconds,
+            "resolution_seconds": width,
+            "points": points,
+            "summary": {
+                "min": int(mins.min()) if total else None,
+                "max": int(maxs.max()) if total else None,
+                "avg": round(float(sums.sum()) / total, 2) if total else None,
+                "count": total,
+            },
+        }
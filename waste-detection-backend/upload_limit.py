@@ -0,0 +1,58 @@
+# upload_limit.py
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimit:
+    """ASGI middleware that rejects request bodies over max_bytes on the given paths with 413.
+
+    A Content-Length over the limit is refused before any of the body is
+    read; otherwise bytes are counted as they stream in and the request is
+    cut off the moment the limit is passed, so an oversized upload is never
+    buffered whole.
+    """
+
+    def __init__(self, app, max_bytes: int, paths: set[str]):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def _reject(self, send) -> None:
+        body = b'{"detail":"Upload too large (limit %d bytes)"}' % self.max_bytes
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app makes of the aborted body (usually a 400) is replaced by the 413
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if exceeded:
+            await self._reject(send)